@@ -5,7 +5,7 @@ from itertools import count
 from logging import getLogger
 from datetime import datetime
 import signal
-from typing import Union, Optional, List
+from typing import Union, Optional, List, Callable
 
 import aiohttp
 
@@ -53,6 +53,7 @@ class BetdaqAsyncClient(object):
             t.Language4: self.on_language4,
             t.MExchangeInfo: self.on_mexchangeinfo
         }
+        self._listeners: List[Callable[[Union[t.BaseTopic, r.Response], int], None]] = []
 
     @property
     def client_identifier(self):
@@ -62,6 +63,18 @@ class BetdaqAsyncClient(object):
         kwargs = dict(url=s.STREAM_URL, receive_timeout=s.RECEIVE_TIMEOUT, timeout=s.TIMEOUT)
         return kwargs
 
+    def add_listener(self, listener: Callable[[Union[t.BaseTopic, r.Response], int], None]):
+        """Add synchronous callback, called for every parsed response or data message
+        with message and time (`time.perf_counter_ns`) when the frame was received"""
+        self._listeners.append(listener)
+
+    def _notify_listeners(self, response: Union[t.BaseTopic, r.Response], received_at: int):
+        for listener in self._listeners:
+            try:
+                listener(response, received_at)
+            except Exception:
+                L.exception('Listener %s failed', getattr(listener, '__name__', 'empty'))
+
     async def init_ws(self, first_attempt: bool = False):
         self._cor_id = iter(count())
         self.s = aiohttp.ClientSession(loop=self.loop)
@@ -292,10 +305,13 @@ class BetdaqAsyncClient(object):
                 break
             try:
                 async for msg in self.ws:
+                    received_at = time.perf_counter_ns()
                     if msg.type != aiohttp.WSMsgType.TEXT:
                         break
                     next(cnt_func)
                     resp = parse_response(msg.data)
+                    if resp is not None and self._listeners:
+                        self._notify_listeners(resp, received_at)
                     try:
                         await self.handle_ws_response(resp)
                     except Exception:
@@ -0,0 +1,37 @@
+from logging import getLogger
+from typing import Optional, Union
+
+from .structures import topics as t, responses as r
+from .structures.enums import MessageType
+from ..common.market_index import MarketIndex
+
+
+L = getLogger(__name__)
+
+
+class MarketIndexListener(object):
+
+    def __init__(self, index: MarketIndex):
+        """Keeps market index up to date with streamed MExchangeInfo and SExchangeInfo topics.
+        `on_aapi_message` should be registered as AAPI client listener (`BetdaqAsyncClient.add_listener`)
+        :param index: index, passed to `GBEiRequestEncoder` as `market_index`
+        """
+        self.index = index
+
+    def on_aapi_message(self, response: Union[t.BaseTopic, r.Response], received_at: Optional[int] = None):
+        if isinstance(response, t.MExchangeInfo):
+            market_id = response.market_id or response.topic_kwargs.get('market_id')
+            if market_id is None:
+                return
+            if response.head is not None and response.head.message_type == MessageType.Delete:
+                self.index.remove_market(market_id)
+            elif response.withdrawal_sequence_number is not None:
+                self.index.set_withdrawal_sequence_number(market_id, response.withdrawal_sequence_number)
+        elif isinstance(response, t.SExchangeInfo):
+            selection_id = response.selection_id or response.topic_kwargs.get('selection_id')
+            if selection_id is None:
+                return
+            if response.head is not None and response.head.message_type == MessageType.Delete:
+                self.index.remove_selection(selection_id)
+            elif response.selection_reset_count is not None:
+                self.index.set_selection_reset_count(selection_id, response.selection_reset_count)
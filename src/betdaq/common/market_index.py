@@ -0,0 +1,57 @@
+from logging import getLogger
+from typing import Dict, Optional
+
+
+L = getLogger(__name__)
+
+
+def is_filled(price: dict) -> bool:
+    """Are expected selection reset count and withdrawal sequence number of `LightWeightPriceToAdd` item set"""
+    return price.get('expected_selection_reset_count') is not None and \
+        price.get('expected_withdrawal_sequence_number') is not None
+
+
+class MarketIndex(object):
+
+    def __init__(self):
+        """Latest selection reset counts and market withdrawal sequence numbers.
+        Passed to `GBEiRequestEncoder` to fill expected values of added lightweight prices,
+        kept up to date with AAPI by `betdaq.aapi.market_index.MarketIndexListener`
+        """
+        self.withdrawal_sequence_numbers: Dict[int, int] = {}  # market_id: withdrawal sequence number
+        self.selection_reset_counts: Dict[int, int] = {}  # selection_id: selection reset count
+
+    def set_withdrawal_sequence_number(self, market_id: int, value: int):
+        self.withdrawal_sequence_numbers[market_id] = value
+
+    def remove_market(self, market_id: int):
+        self.withdrawal_sequence_numbers.pop(market_id, None)
+
+    def set_selection_reset_count(self, selection_id: int, value: int):
+        self.selection_reset_counts[selection_id] = value
+
+    def remove_selection(self, selection_id: int):
+        self.selection_reset_counts.pop(selection_id, None)
+
+    def get_withdrawal_sequence_number(self, market_id: int, default: Optional[int] = None) -> Optional[int]:
+        return self.withdrawal_sequence_numbers.get(market_id, default)
+
+    def get_selection_reset_count(self, selection_id: int, default: Optional[int] = None) -> Optional[int]:
+        return self.selection_reset_counts.get(selection_id, default)
+
+    def fill(self, price: dict, default: int = 0) -> dict:
+        """`LightWeightPriceToAdd` item with missing (or None) expected reset count and withdrawal sequence number
+        set to the latest known values. Given price is not changed, its copy is returned if anything is filled
+        :param price: lightweight price to add
+        :param default: value to use for markets and selections, not known by the index
+        """
+        if is_filled(price):
+            return price
+        price = dict(price)
+        if price.get('expected_selection_reset_count') is None:
+            price['expected_selection_reset_count'] = self.selection_reset_counts.get(price['selection_id'], default)
+        if price.get('expected_withdrawal_sequence_number') is None:
+            price['expected_withdrawal_sequence_number'] = self.withdrawal_sequence_numbers.get(
+                price['market_id'], default
+            )
+        return price
@@ -0,0 +1,84 @@
+import asyncio
+from logging import getLogger
+from typing import Callable, List, Optional
+
+from .protocol import GBEiProtocol
+from .protocol.utils import price_key
+
+
+L = getLogger(__name__)
+
+
+class LightweightPriceBatcher(object):
+
+    def __init__(self, protocol: GBEiProtocol, window: float = 0, max_items: int = 100,
+                 on_drop: Optional[Callable[[List[dict]], None]] = None):
+        """Collects lightweight prices to add or cancel and sends them within as few envelopes as possible.
+        Cancels are always sent ahead of adds. Cancel of the price, which is still waiting in the batch to be added,
+        removes that price from the batch, so reordering never changes the final state of the price.
+        :param protocol: protocol to send prices with
+        :param window: time (in seconds) to collect prices for. 0 means prices are collected till the end
+                       of current event loop iteration, so all prices added synchronously are sent together
+        :param max_items: max number of prices in single envelope. When reached, batch is sent immediately
+        :param on_drop: called with prices to add, which won't be sent: removed by cancel or collected
+                        while protocol is not connected
+        """
+        self.protocol = protocol
+        self.window = window
+        self.max_items = max_items
+        self._adds: List[dict] = []
+        self._cancels: List[dict] = []
+        self._handle: Optional[asyncio.Handle] = None
+        self.on_drop = on_drop
+
+    def __len__(self):
+        return len(self._adds) + len(self._cancels)
+
+    def add(self, price: dict):
+        """Queue `LightWeightPriceToAdd` item"""
+        self._adds.append(price)
+        self._schedule()
+
+    def cancel(self, price: dict):
+        """Queue `LightWeightPriceToCancel` item"""
+        if self._adds:
+            key = price_key(price)
+            adds = [_ for _ in self._adds if price_key(_) != key]
+            if len(adds) != len(self._adds):
+                self._report_dropped([_ for _ in self._adds if price_key(_) == key])
+                self._adds = adds
+        self._cancels.append(price)
+        self._schedule()
+
+    def _report_dropped(self, prices: List[dict]):
+        if self.on_drop is not None and prices:
+            try:
+                self.on_drop(prices)
+            except Exception:
+                L.exception('Dropped prices callback failed')
+
+    def _schedule(self):
+        if len(self._adds) >= self.max_items or len(self._cancels) >= self.max_items:
+            self.flush()
+        elif self._handle is None:
+            loop = asyncio.get_running_loop()
+            if self.window:
+                self._handle = loop.call_later(self.window, self.flush)
+            else:
+                self._handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        """Send all collected prices right away"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        cancels, self._cancels = self._cancels, []
+        adds, self._adds = self._adds, []
+        if not self.protocol.connected:
+            L.warning('Not connected to GBEi, dropping %s cancels and %s adds', len(cancels), len(adds))
+            self._report_dropped(adds)
+            return
+        for i in range(0, len(cancels), self.max_items):
+            self.protocol.send_cancel_lightweight_prices(cancels[i:i + self.max_items])
+        for i in range(0, len(adds), self.max_items):
+            self.protocol.send_add_lightweight_prices(adds[i:i + self.max_items])
@@ -0,0 +1,150 @@
+"""GBEi codec and end-to-end throughput benchmark.
+Run with `python -m betdaq.gbei.benchmark --help` for options
+"""
+import argparse
+import asyncio
+import time
+from itertools import count
+from typing import Callable, Iterable, List
+
+from .fake_server import FakeGBEiServer
+from .latency import AckLatencyTracker
+from .protocol import GBEiProtocol, GBEiRequestEncoder, GBEiMessageType, LWPActionType, ProtocolEvents
+
+
+BATCH_SIZES = (1, 10, 100, 1000)
+
+
+def make_prices(size: int, encoder: GBEiRequestEncoder, references: Iterable[int] = None) -> List[dict]:
+    """Generate `LightWeightPriceToAdd` items in given encoder format"""
+    references = iter(references or count(1))
+    integer = encoder.odds_precision is not None
+    expire_at = encoder._get_expire_at()
+    return [{
+        'selection_id': 1000 + i, 'market_id': 100 + i // 10, 'polarity': i % 2,
+        'odds': 250 if integer else '2.5', 'delta_stake': 1000 if integer else '10',
+        'expire_price_at': expire_at, 'expected_selection_reset_count': 0,
+        'expected_withdrawal_sequence_number': 0, 'punter_reference_number': next(references),
+    } for i in range(size)]
+
+
+def measure(func: Callable, iterations: int) -> float:
+    """Average time (in nanoseconds) of single function call"""
+    func()  # warm up caches
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+def bench_codec(encoder: GBEiRequestEncoder, batch_sizes: Iterable[int] = BATCH_SIZES,
+                iterations: int = 1000) -> List[dict]:
+    """Measure encoding and decoding of GBEi messages
+    :param encoder: encoder to measure
+    :param batch_sizes: numbers of prices in single message
+    :param iterations: number of calls per measurement, divided by batch size (but at least 10)
+    :return: rows with operation, batch size, nanoseconds per call and prices per second
+    """
+    e = encoder.e
+    rows = []
+    for size in batch_sizes:
+        prices = make_prices(size, encoder)
+        cancels = [{k: _[k] for k in ('selection_id', 'polarity', 'odds', 'punter_reference_number')}
+                   for _ in prices]
+        envelope = encoder.add_lightweight_prices(prices)
+        data = e.dumps(envelope)
+        notifications = [dict(
+            {k: v for k, v in _.items() if k not in ('delta_stake', 'expire_price_at')},
+            expire_at=_['expire_price_at'], lwp_action_type=LWPActionType.ChangedExplicitly.value,
+            remaining_stake=_['delta_stake'],
+        ) for _ in prices]
+        notification = encoder.encode_request(GBEiMessageType.LWPChangeNotification.value, {'prices': notifications})
+        operations = {
+            'encoder.add_lightweight_prices': lambda: e.dumps(encoder.add_lightweight_prices(prices)),
+            'encoder.cancel_lightweight_prices': lambda: e.dumps(encoder.cancel_lightweight_prices(cancels)),
+            'Envelope.dumps': lambda: e.dumps(envelope),
+            'encoder.dumps': lambda: encoder.dumps(envelope),  # with template for small batches
+            'Envelope.loads': lambda: e.loads(data),
+            'Envelope.loads notification': lambda: e.loads(notification),
+        }
+        for name, func in operations.items():
+            ns = measure(func, max(10, iterations // size))
+            rows.append({'operation': name, 'batch_size': size, 'ns_per_call': ns,
+                         'prices_per_second': size * 1e9 / ns})
+    return rows
+
+
+async def bench_end_to_end(encoder: GBEiRequestEncoder, batch_size: int = 100, batches: int = 100,
+                           timeout: float = 60, **server_kwargs) -> dict:
+    """Send batches of adds to fake GBEi server over local TCP and wait for all acknowledgements
+    :param encoder: encoder used by both client and server
+    :param batch_size: number of prices in single AddLightweightPrices message
+    :param batches: number of messages to send
+    :param timeout: max time (in seconds) to wait for all acknowledgements
+    :param server_kwargs: `FakeGBEiServer` parameters, e.g. to simulate fills or fragmented delivery
+    :return: throughput and acknowledgement latency (nanoseconds) percentiles
+    """
+    server = FakeGBEiServer(encoder, **server_kwargs)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(lambda: GBEiProtocol(encoder), server.host, server.port)
+    tracker = AckLatencyTracker(unacknowledged_after=timeout)
+    tracker.attach(protocol)
+    done = loop.create_future()
+    total = batch_size * batches
+
+    def on_message(parsed: dict):
+        acknowledged = tracker.latency.get(LWPActionType.ChangedExplicitly)
+        if acknowledged is not None and acknowledged.count >= total and not done.done():
+            done.set_result(None)
+
+    protocol.add_callback(ProtocolEvents.data_received, on_message)
+    references = count(1)
+    try:
+        started = time.perf_counter_ns()
+        for _ in range(batches):
+            protocol.send_add_lightweight_prices(make_prices(batch_size, encoder, references))
+            await asyncio.sleep(0)
+        await asyncio.wait_for(done, timeout)
+        elapsed = time.perf_counter_ns() - started
+    finally:
+        protocol.on_stop()
+        await server.stop()
+    result = {'batch_size': batch_size, 'batches': batches, 'elapsed_ns': elapsed,
+              'prices_per_second': total * 1e9 / elapsed, 'messages_per_second': batches * 1e9 / elapsed}
+    result.update(('ack_%s' % k, v) for k, v in tracker.latency[LWPActionType.ChangedExplicitly].snapshot().items())
+    return result
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    parser.add_argument('--iterations', type=int, default=10000, help='codec calls per measurement, per price')
+    parser.add_argument('--integer', action='store_true', help='represent decimals and datetimes as integers')
+    parser.add_argument('--end-to-end', action='store_true', help='also send messages to local fake GBEi server')
+    parser.add_argument('--batches', type=int, default=100, help='number of messages sent end-to-end')
+    parser.add_argument('--fill-probability', type=float, default=0.)
+    parser.add_argument('--fragment-size', type=int, default=None, help='split server responses into chunks')
+    args = parser.parse_args(argv)
+
+    encoder = GBEiRequestEncoder(1, 1, decimal_as_string=not args.integer, datetime_as_timestamp=True,
+                                 decimal_as_integer=args.integer, datetime_as_nanoseconds=args.integer)
+    print('%-36s %10s %14s %14s' % ('operation', 'batch', 'us/call', 'prices/s'))
+    for row in bench_codec(encoder, args.batch_sizes, args.iterations):
+        print('%-36s %10d %14.2f %14.0f' % (row['operation'], row['batch_size'], row['ns_per_call'] / 1e3,
+                                            row['prices_per_second']))
+    if args.end_to_end:
+        print()
+        print('%-10s %10s %14s %12s %12s %12s' % (
+            'batch', 'messages', 'prices/s', 'ack p50 us', 'ack p99 us', 'ack max us'))
+        for size in args.batch_sizes:
+            result = asyncio.run(bench_end_to_end(encoder, size, args.batches, fill_probability=args.fill_probability,
+                                                  fragment_size=args.fragment_size))
+            print('%-10d %10d %14.0f %12.1f %12.1f %12.1f' % (
+                size, args.batches, result['prices_per_second'], result['ack_p50'] / 1e3,
+                result['ack_p99'] / 1e3, result['ack_max'] / 1e3,
+            ))
+
+
+if __name__ == '__main__':
+    main()
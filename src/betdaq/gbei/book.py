@@ -0,0 +1,124 @@
+from logging import getLogger
+from decimal import Decimal as DecimalNative
+from typing import Dict, Set, List, Iterable, Optional, Union
+
+from .protocol.utils import price_key
+from .protocol.enums import LWPActionType, GBEiMessageType
+
+
+L = getLogger(__name__)
+# actions after which lightweight price can still be matched (if it has remaining stake)
+ACTIVE_ACTIONS = {LWPActionType.ChangedExplicitly.value, LWPActionType.Matched.value}
+
+
+def as_number(value: Union[str, DecimalNative, int]) -> Union[DecimalNative, int]:
+    """Represent decimal value, encoded in any of encoder formats, as number to compare and do maths with"""
+    if isinstance(value, str):
+        return DecimalNative(value)
+    return value
+
+
+class LightweightPriceBook(object):
+
+    def __init__(self):
+        """Current state of punter lightweight prices, built from GBEi notifications.
+        Prices are keyed by (selection_id, polarity, odds, punter_reference_number), see `price_key`
+        and indexed by market and by selection with polarity
+        """
+        self.prices: Dict[tuple, dict] = {}
+        self._by_market: Dict[tuple, Set[tuple]] = {}  # (market_id, polarity): price keys
+        self._by_selection: Dict[tuple, Set[tuple]] = {}  # (selection_id, polarity): price keys
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __contains__(self, key: tuple):
+        return key in self.prices
+
+    def get(self, key: tuple) -> Optional[dict]:
+        return self.prices.get(key)
+
+    def upsert(self, price: dict):
+        """Add or replace price. Price should contain `market_id` and all fields of the key"""
+        key = price_key(price)
+        polarity = price['polarity']
+        self.prices[key] = price
+        self._by_market.setdefault((price['market_id'], polarity), set()).add(key)
+        self._by_selection.setdefault((price['selection_id'], polarity), set()).add(key)
+
+    def remove(self, key: tuple) -> Optional[dict]:
+        price = self.prices.pop(key, None)
+        if price is None:
+            return None
+        polarity = price['polarity']
+        for index, index_key in ((self._by_market, (price['market_id'], polarity)),
+                                 (self._by_selection, (price['selection_id'], polarity))):
+            keys = index[index_key]
+            keys.discard(key)
+            if not keys:
+                del index[index_key]
+        return price
+
+    def _get_prices(self, index: Dict[tuple, Set[tuple]], item_id: int, polarity: Optional[int]) -> List[dict]:
+        polarities = (0, 1) if polarity is None else (polarity,)
+        return [self.prices[key] for p in polarities for key in index.get((item_id, p), ())]
+
+    def market_prices(self, market_id: int, polarity: Optional[int] = None) -> List[dict]:
+        """Active prices on market, optionally only of given polarity (0 = Against, 1 = For)"""
+        return self._get_prices(self._by_market, market_id, polarity)
+
+    def selection_prices(self, selection_id: int, polarity: Optional[int] = None) -> List[dict]:
+        """Active prices on selection, optionally only of given polarity (0 = Against, 1 = For)"""
+        return self._get_prices(self._by_selection, selection_id, polarity)
+
+    def clear(self, market_ids: Iterable[int] = None, selection_ids: Iterable[int] = None):
+        """Remove prices on given markets and selections, or all prices if none specified"""
+        if market_ids is None and selection_ids is None:
+            self.prices.clear()
+            self._by_market.clear()
+            self._by_selection.clear()
+            return
+        keys = set()
+        for market_id in market_ids or ():
+            keys.update(price_key(_) for _ in self.market_prices(market_id))
+        for selection_id in selection_ids or ():
+            keys.update(price_key(_) for _ in self.selection_prices(selection_id))
+        for key in keys:
+            self.remove(key)
+
+    def replace(self, prices: Iterable[dict], market_ids: Iterable[int] = None, selection_ids: Iterable[int] = None):
+        """Replace prices within given scope (all prices by default) with snapshot,
+        e.g. collected from `LightWeightPriceSummary` messages"""
+        self.clear(market_ids, selection_ids)
+        for price in prices:
+            self.upsert(price)
+
+    def take(self, other: 'LightweightPriceBook'):
+        """Replace all prices with prices of another book, e.g. filled from snapshot, without copying them.
+        The other book is left empty"""
+        self.prices, self._by_market, self._by_selection = other.prices, other._by_market, other._by_selection
+        other.prices, other._by_market, other._by_selection = {}, {}, {}
+
+    def apply_change_notification(self, message: dict):
+        """Apply `LWPChangeNotification` message body"""
+        for price in message['prices']:
+            if price['lwp_action_type'] in ACTIVE_ACTIONS and as_number(price['remaining_stake']):
+                self.upsert(price)
+            else:
+                self.remove(price_key(price))
+
+    def apply_summary(self, message: dict):
+        """Apply `LightWeightPriceSummary` message body"""
+        for price in message['prices']:
+            self.upsert(price)
+
+    def on_message(self, parsed: dict):
+        """Callback for `ProtocolEvents.data_received` event to keep the book up to date"""
+        message_type = parsed['message_header']['type']
+        if message_type == GBEiMessageType.LWPChangeNotification.value:
+            self.apply_change_notification(parsed['message'])
+        elif message_type == GBEiMessageType.lightweightPriceSummary.value:
+            self.apply_summary(parsed['message'])
+        elif message_type == GBEiMessageType.resetOccurred.value:
+            L.info('Reset occurred, dropping %s lightweight prices', len(self.prices))
+            self.clear()
@@ -0,0 +1,120 @@
+from datetime import datetime
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .book import ACTIVE_ACTIONS, as_number
+from .protocol import GBEiProtocol, GBEiRequestEncoder, GBEiMessageType, ProtocolEvents
+from .protocol.utils import price_key
+from .protocol.timer_wheel import Timer, TimerWheel
+
+
+L = getLogger(__name__)
+EPOCH = datetime(1970, 1, 1)
+
+
+class PriceExpiryWatcher(object):
+
+    def __init__(self, wheel: TimerWheel, encoder: GBEiRequestEncoder, refresh_before: float = 1.,
+                 on_refresh: Optional[Callable[[dict], None]] = None,
+                 on_expired: Optional[Callable[[dict], None]] = None):
+        """Tracks `expire_price_at` of sent prices locally, so they are known to lapse without waiting
+        for `Expired` notification. Should be attached to protocol with `attach`.
+        :param wheel: timer wheel with the clock of seconds since epoch
+        :param encoder: encoder, prices are sent with, to interpret expiry time format
+        :param refresh_before: time (in seconds) before expiry, when `on_refresh` is called
+        :param on_refresh: callback with the sent price (`LightWeightPriceToAdd`), which is about to expire,
+                           e.g. to send it again with later expiry time
+        :param on_expired: callback with the sent price, which has just expired locally
+        """
+        self.wheel = wheel
+        self.encoder = encoder
+        self.refresh_before = refresh_before
+        self.on_refresh = on_refresh
+        self.on_expired = on_expired
+        self._timers: Dict[tuple, Tuple[dict, Timer, Optional[Timer]]] = {}  # key: (price, expiry, refresh)
+        self.expired: Set[tuple] = set()  # keys of locally expired prices, not confirmed by GBEi yet
+
+    def __len__(self):
+        return len(self._timers)
+
+    def attach(self, protocol: GBEiProtocol):
+        protocol.add_callback(ProtocolEvents.data_sent, self.on_sent)
+        protocol.add_callback(ProtocolEvents.data_received, self.on_message)
+        protocol.add_callback(ProtocolEvents.prices_dropped, self.on_dropped)
+        protocol.add_callback(ProtocolEvents.connection_lost, self.on_connection_lost)
+
+    def as_timestamp(self, value) -> float:
+        """Represent datetime of any encoder format as seconds since epoch"""
+        if isinstance(value, datetime):
+            return (value - EPOCH).total_seconds()
+        if self.encoder.datetime_as_nanoseconds:
+            return value / 1e9
+        return value
+
+    def is_expired(self, price: dict) -> bool:
+        return price_key(price) in self.expired
+
+    def track(self, price: dict):
+        """Schedule expiry of added price, replacing the previous one of the same price"""
+        key = price_key(price)
+        self.forget(key)
+        expire_at = self.as_timestamp(price['expire_price_at'])
+        refresh = None
+        if self.on_refresh is not None:
+            refresh = self.wheel.schedule(expire_at - self.refresh_before, self._refresh, key)
+        self._timers[key] = (price, self.wheel.schedule(expire_at, self._expire, key), refresh)
+
+    def forget(self, key: tuple):
+        self.expired.discard(key)
+        timers = self._timers.pop(key, None)
+        if timers is not None:
+            _, expiry, refresh = timers
+            expiry.cancel()
+            if refresh is not None:
+                refresh.cancel()
+
+    def clear(self):
+        for key in list(self._timers):
+            self.forget(key)
+        self.expired.clear()
+
+    def _refresh(self, key: tuple):
+        timers = self._timers.get(key)
+        if timers is not None:
+            self.on_refresh(timers[0])
+
+    def _expire(self, key: tuple):
+        price, _, refresh = self._timers.pop(key)
+        if refresh is not None:
+            refresh.cancel()
+        self.expired.add(key)
+        L.debug('Price %s expired', key)
+        if self.on_expired is not None:
+            self.on_expired(price)
+
+    def on_sent(self, envelope: dict):
+        message_type = envelope['message_header']['type']
+        if message_type == GBEiMessageType.addLightweightPrices.value:
+            for price in envelope['message']['prices']:
+                self.track(price)
+        elif message_type == GBEiMessageType.cancelLightweightPrices.value:
+            for price in envelope['message']['prices']:
+                self.forget(price_key(price))
+
+    def on_message(self, parsed: dict):
+        message_type = parsed['message_header']['type']
+        if message_type == GBEiMessageType.LWPChangeNotification.value:
+            for price in parsed['message']['prices']:
+                if price['lwp_action_type'] not in ACTIVE_ACTIONS or not as_number(price['remaining_stake']):
+                    self.forget(price_key(price))
+        elif message_type == GBEiMessageType.resetOccurred.value:
+            self.clear()
+
+    def on_dropped(self, prices: List[dict]):
+        """Prices queued, but never written to GBEi, won't expire there"""
+        for price in prices:
+            self.forget(price_key(price))
+
+    def on_connection_lost(self, exc: Optional[Exception]):
+        """Expired notifications of locally expired prices may be missed while disconnected, they are gone anyway"""
+        self.expired.clear()
@@ -0,0 +1,132 @@
+from array import array
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+from .book import as_number
+from .protocol import GBEiMessageType, LWPActionType
+
+
+L = getLogger(__name__)
+MATCHED = LWPActionType.Matched.value
+
+
+class MarketExposure(object):
+    __slots__ = ('base', 'outcomes', 'if_win', 'if_lose', 'selection_ids', '_min', '_dirty')
+
+    def __init__(self):
+        """Matched exposure of single market, in compact per-selection arrays.
+        Profit if selection `i` wins is `base + outcomes[i]`, if none of known selections wins it's `base`
+        """
+        self.base = 0.
+        self.outcomes = array('d')
+        self.if_win = array('d')  # profit of bets on selection `i` if it wins
+        self.if_lose = array('d')  # profit of bets on selection `i` if it loses
+        self.selection_ids = array('q')
+        self._min = 0.  # min of outcomes and 0, valid unless dirty
+        self._dirty = False
+
+    def add(self, index: int, win: float, lose: float):
+        """Add fill on selection with given index, profit `win` if it wins and `lose` if it loses"""
+        self.base += lose
+        value = self.outcomes[index] + win - lose
+        self.outcomes[index] = value
+        self.if_win[index] += win
+        self.if_lose[index] += lose
+        if value < self._min:
+            self._min = value
+        elif win > lose:  # the minimum could have been increased
+            self._dirty = True
+
+    def worst_case(self) -> float:
+        """Lowest profit over all outcomes of the market"""
+        if self._dirty:
+            self._min = min(min(self.outcomes), 0.)
+            self._dirty = False
+        return self.base + self._min
+
+
+class ExposureAggregator(object):
+
+    def __init__(self, odds_precision: Optional[int] = None):
+        """Net matched exposure per selection and market, updated incrementally on every fill
+        from `Matched` LWPChangeNotification items. Stake is the backer's stake for both polarities,
+        so back bet wins `stake * (odds - 1)` or loses `stake`, and lay bet wins `stake` or loses `stake * (odds - 1)`.
+        Amounts are floats in units of encoder representation (minor units in integer mode).
+        :param odds_precision: encoder `odds_precision`, if odds are represented as integers
+        """
+        self.odds_scale = 10 ** odds_precision if odds_precision is not None else 1
+        self.markets: Dict[int, MarketExposure] = {}
+        self._selections: Dict[int, Tuple[MarketExposure, int]] = {}  # selection_id: (market exposure, index)
+
+    def _get_index(self, market_id: int, selection_id: int) -> Tuple[MarketExposure, int]:
+        try:
+            return self._selections[selection_id]
+        except KeyError:
+            pass
+        market = self.markets.get(market_id)
+        if market is None:
+            market = self.markets[market_id] = MarketExposure()
+        market.outcomes.append(0.)
+        market.if_win.append(0.)
+        market.if_lose.append(0.)
+        market.selection_ids.append(selection_id)
+        result = self._selections[selection_id] = (market, len(market.outcomes) - 1)
+        return result
+
+    def _profit(self, polarity: int, odds, stake) -> Tuple[float, float]:
+        """Profit of the bet if selection wins and if it loses"""
+        stake = float(as_number(stake))
+        liability = stake * (float(as_number(odds)) / self.odds_scale - 1)
+        if polarity:
+            return liability, -stake
+        return -liability, stake
+
+    def add_fill(self, market_id: int, selection_id: int, polarity: int, odds, stake):
+        market, index = self._get_index(market_id, selection_id)
+        market.add(index, *self._profit(polarity, odds, stake))
+
+    def on_message(self, parsed: dict):
+        if parsed['message_header']['type'] != GBEiMessageType.LWPChangeNotification.value:
+            return
+        for price in parsed['message']['prices']:
+            if price['lwp_action_type'] == MATCHED and price.get('matched_stake') is not None:
+                self.add_fill(price['market_id'], price['selection_id'], price['polarity'], price['odds'],
+                              price['matched_stake'])
+
+    def selection_exposure(self, selection_id: int) -> Tuple[float, float]:
+        """Profit of bets on selection if it wins and if it loses"""
+        try:
+            market, index = self._selections[selection_id]
+        except KeyError:
+            return 0., 0.
+        return market.if_win[index], market.if_lose[index]
+
+    def market_outcomes(self, market_id: int) -> Dict[int, float]:
+        """Profit of all bets on the market if given selection wins"""
+        market = self.markets.get(market_id)
+        if market is None:
+            return {}
+        return {selection_id: market.base + value
+                for selection_id, value in zip(market.selection_ids, market.outcomes)}
+
+    def worst_case(self, market_id: int) -> float:
+        """Lowest profit of the market over all outcomes"""
+        market = self.markets.get(market_id)
+        return market.worst_case() if market is not None else 0.
+
+    def check(self, price: dict, max_loss: float) -> bool:
+        """Pre-trade check of `LightWeightPriceToAdd` item: would market loss stay within limit,
+        if the price is matched fully. Every outcome changes by at most the max loss of the new bet,
+        so the check is O(1) and never lets the limit be breached, but can reject bets, which reduce the risk
+        :param price: price to add
+        :param max_loss: max allowed loss (positive number) of the market
+        """
+        delta_stake = as_number(price['delta_stake'])
+        if delta_stake <= 0:
+            return True
+        win, lose = self._profit(price['polarity'], price['odds'], delta_stake)
+        return self.worst_case(price['market_id']) + min(win, lose) >= -max_loss
+
+    def clear(self):
+        self.markets.clear()
+        self._selections.clear()
@@ -0,0 +1,298 @@
+import asyncio
+import random
+from collections import deque
+from decimal import Decimal as DecimalNative, ROUND_DOWN
+from logging import getLogger
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from .book import as_number
+from .protocol.enums import GBEiMessageType, LWPActionType
+from .protocol.utils import price_key
+from .protocol.request_encoder import GBEiRequestEncoder
+
+
+L = getLogger(__name__)
+NOTIFICATION_FIELDS = ('market_id', 'selection_id', 'polarity', 'odds', 'punter_reference_number',
+                       'expected_selection_reset_count', 'expected_withdrawal_sequence_number')
+
+
+def same_type(value, like):
+    """Represent number in the same format as given decimal value of any encoder format"""
+    return str(value) if isinstance(like, str) else value
+
+
+def part_of(value: Union[DecimalNative, int], ratio: float) -> Union[DecimalNative, int]:
+    """Part of the amount, rounded down to the amount precision"""
+    if isinstance(value, int):
+        return int(value * ratio)
+    return (value * DecimalNative(str(ratio))).quantize(DecimalNative('0.01'), ROUND_DOWN)
+
+
+class FakeGBEiConnection(asyncio.Protocol):
+
+    def __init__(self, server: 'FakeGBEiServer'):
+        """Single client connection to fake GBEi server"""
+        self.server = server
+        self._transport: Optional[asyncio.Transport] = None
+        self._buff = b''
+        self._fragments: Deque[bytes] = deque()
+        self._fragment_handle: Optional[asyncio.Handle] = None
+
+    def connection_made(self, transport) -> None:
+        self._transport = transport
+        self.server.connections.add(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._transport = None
+        self.server.connections.discard(self)
+        if self._fragment_handle is not None:
+            self._fragment_handle.cancel()
+            self._fragment_handle = None
+
+    def data_received(self, data: bytes) -> None:
+        data = memoryview(self._buff + data if self._buff else data)
+        encoder = self.server.encoder
+        while data:
+            size = encoder.e.frame_length(data)
+            if size is None:
+                break
+            frame, data = data[:size], data[size:]
+            if size == 1:  # keep alive
+                continue
+            try:
+                parsed, _ = encoder.parse_response(frame)
+            except Exception:
+                L.exception('Failed to parse request %s', bytes(frame))
+                continue
+            self.server.requests_received += 1
+            if self.server.response_delay:
+                asyncio.get_running_loop().call_later(self.server.response_delay, self.server.handle, self, parsed)
+            else:
+                self.server.handle(self, parsed)
+        self._buff = bytes(data)
+
+    def write(self, data: bytes):
+        if self._transport is None:
+            return
+        size = self.server.fragment_size
+        if not size:
+            self._transport.write(data)
+            return
+        self._fragments.extend(data[i:i + size] for i in range(0, len(data), size))
+        if self._fragment_handle is None:
+            self._write_fragment()
+
+    def _write_fragment(self):
+        """Write single fragment per event loop iteration (or fragment delay), so client receives them separately"""
+        self._fragment_handle = None
+        if self._transport is None or not self._fragments:
+            return
+        self._transport.write(self._fragments.popleft())
+        if self._fragments:
+            self._fragment_handle = asyncio.get_running_loop().call_later(
+                self.server.fragment_delay, self._write_fragment
+            )
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class FakeGBEiServer(object):
+
+    def __init__(self, encoder: Optional[GBEiRequestEncoder] = None, host: str = '127.0.0.1', port: int = 0,
+                 fill_probability: float = 0., summary_size: int = 100, response_delay: float = 0,
+                 fragment_size: Optional[int] = None, fragment_delay: float = 0, seed: Optional[int] = None):
+        """Local stand-in for GBEi lightweight price server, speaking the same binary envelope format.
+        Keeps active prices of the punter, acknowledges adds and cancels with LWPChangeNotification,
+        answers pings and queries, and can simulate bursts of fills, resets and fragmented TCP delivery.
+        Meant for tests and benchmarks only.
+        :param encoder: encoder to parse requests and build responses with.
+                        Created with `GBEiProtocol.create` defaults if not specified
+        :param host: host to listen on
+        :param port: port to listen on, random free port by default
+        :param fill_probability: chance of every added price to be matched right after it's acknowledged
+        :param summary_size: max number of prices in single LightWeightPriceSummary response
+        :param response_delay: time (in seconds) to wait before processing every request, to simulate network latency
+        :param fragment_size: split written messages into chunks of this size, to simulate fragmented TCP delivery
+        :param fragment_delay: time (in seconds) between written chunks
+        :param seed: random seed for fills
+        """
+        if encoder is None:
+            encoder = GBEiRequestEncoder(0, 0, source='fakegbei', decimal_as_string=True, datetime_as_timestamp=True)
+        self.encoder = encoder
+        self.host = host
+        self.port = port
+        self.fill_probability = fill_probability
+        self.summary_size = summary_size
+        self.response_delay = response_delay
+        self.fragment_size = fragment_size
+        self.fragment_delay = fragment_delay
+        self.random = random.Random(seed)
+        self.prices: Dict[tuple, dict] = {}  # price key: LightWeightPriceNotification item
+        self.connections: Set[FakeGBEiConnection] = set()
+        self.requests_received = 0
+        self._order_ids = iter(range(1, 2 ** 62))
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> Tuple[str, int]:
+        """Start listening
+        :return: host and port the server is listening on
+        """
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: FakeGBEiConnection(self), self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        L.info('Fake GBEi server is listening on %s:%s', self.host, self.port)
+        return self.host, self.port
+
+    @property
+    def url(self) -> str:
+        """Server address in `BETDAQ_GBEI_URL` format"""
+        return '%s:%s' % (self.host, self.port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for connection in list(self.connections):
+            connection.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    def disconnect(self):
+        """Drop all client connections, keeping prices"""
+        for connection in list(self.connections):
+            connection.close()
+
+    def encode(self, message_type: GBEiMessageType, body: dict) -> bytes:
+        return self.encoder.encode_request(message_type.value, body)
+
+    def broadcast(self, data: bytes):
+        for connection in self.connections:
+            connection.write(data)
+
+    def _notification(self, price: dict, action: LWPActionType, remaining_stake, matched_stake=None) -> dict:
+        notification = {_: price.get(_, 0) for _ in NOTIFICATION_FIELDS}
+        notification.update(expire_at=price['expire_at'], lwp_action_type=action.value,
+                            remaining_stake=remaining_stake)
+        if matched_stake is not None:
+            notification.update(matched_stake=matched_stake, order_id=next(self._order_ids),
+                                matched_against_side_stake=matched_stake)
+        return notification
+
+    def _notify(self, notifications: List[dict]):
+        if notifications:
+            self.broadcast(self.encode(GBEiMessageType.LWPChangeNotification, {'prices': notifications}))
+
+    def handle(self, connection: FakeGBEiConnection, parsed: dict):
+        """Process single request and send responses"""
+        message_type = GBEiMessageType(parsed['message_header']['type'])
+        message = parsed['message']
+        if message_type is GBEiMessageType.addLightweightPrices:
+            self._add(message['prices'])
+        elif message_type is GBEiMessageType.cancelLightweightPrices:
+            self._cancel(message['prices'])
+        elif message_type is GBEiMessageType.cancelAllLightweightPrices:
+            self._cancel_all(lambda price: True, LWPActionType.CancelledAll)
+        elif message_type is GBEiMessageType.cancelAllLightweightPricesOnMarkets:
+            market_ids = set(message['market_ids'])
+            self._cancel_all(lambda price: price['market_id'] in market_ids, LWPActionType.CancelledAllOnMarket)
+        elif message_type is GBEiMessageType.cancelAllLightweightPricesOnSelections:
+            selection_ids = set(message['selection_ids'])
+            self._cancel_all(lambda price: price['selection_id'] in selection_ids,
+                             LWPActionType.CancelledAllOnSelection)
+        elif message_type is GBEiMessageType.ping:
+            connection.write(self.encode(GBEiMessageType.pingResponse, {
+                'punter_query_reference_number': message['punter_query_reference_number'],
+                'total_summary_notifications': 0,
+            }))
+        elif message_type is GBEiMessageType.queryAllLightweightPrices:
+            self._query(connection, message['punter_query_reference_number'], self.prices.values())
+        elif message_type is GBEiMessageType.queryAllLightweightPricesOnMarkets:
+            market_ids = set(message['market_ids'])
+            self._query(connection, message['punter_query_reference_number'],
+                        [_ for _ in self.prices.values() if _['market_id'] in market_ids])
+        elif message_type is GBEiMessageType.queryAllLightweightPricesOnSelections:
+            selection_ids = set(message['selection_ids'])
+            self._query(connection, message['punter_query_reference_number'],
+                        [_ for _ in self.prices.values() if _['selection_id'] in selection_ids])
+        else:
+            L.warning('Unexpected request %s', message_type.name)
+
+    def _add(self, prices: List[dict]):
+        notifications = []
+        for price in prices:
+            key = price_key(price)
+            current = self.prices.get(key)
+            remaining = as_number(price['delta_stake'])
+            if current is not None:
+                remaining += as_number(current['remaining_stake'])
+            remaining = max(remaining, 0)
+            remaining_stake = same_type(remaining, price['delta_stake'])
+            item = dict(price, expire_at=price['expire_price_at'], remaining_stake=remaining_stake)
+            del item['delta_stake'], item['expire_price_at']
+            if remaining:
+                self.prices[key] = item
+            else:
+                self.prices.pop(key, None)
+            notifications.append(self._notification(item, LWPActionType.ChangedExplicitly, remaining_stake))
+        self._notify(notifications)
+        if self.fill_probability:
+            self.fill([price_key(_) for _ in prices if self.random.random() < self.fill_probability])
+
+    def _cancel(self, prices: List[dict]):
+        notifications = []
+        for price in prices:
+            current = self.prices.pop(price_key(price), None)
+            if current is None:
+                notifications.append(self._notification(dict(price, expire_at=0), LWPActionType.LWPDoesNotExist,
+                                                        same_type(0, price['odds'])))
+            else:
+                notifications.append(self._notification(current, LWPActionType.CancelledExplicitly,
+                                                        same_type(0, current['remaining_stake'])))
+        self._notify(notifications)
+
+    def _cancel_all(self, is_cancelled, action: LWPActionType):
+        keys = [key for key, price in self.prices.items() if is_cancelled(price)]
+        self._notify([
+            self._notification(price, action, same_type(0, price['remaining_stake']))
+            for price in (self.prices.pop(_) for _ in keys)
+        ])
+
+    def _query(self, connection: FakeGBEiConnection, reference: int, prices: Iterable[dict]):
+        prices = list(prices)
+        chunks = [prices[i:i + self.summary_size] for i in range(0, len(prices), self.summary_size)] or [[]]
+        for chunk in chunks:
+            connection.write(self.encode(GBEiMessageType.lightweightPriceSummary, {
+                'punter_query_reference_number': reference,
+                'total_summary_notifications': len(chunks),
+                'prices': chunk,
+            }))
+
+    def fill(self, keys: Optional[Iterable[tuple]] = None, ratio: float = 1.) -> int:
+        """Match active prices in single burst of notifications
+        :param keys: keys (see `price_key`) of prices to match, all active prices if not specified
+        :param ratio: part of remaining stake of every price to match
+        :return: number of matched prices
+        """
+        keys = list(self.prices) if keys is None else [_ for _ in keys if _ in self.prices]
+        notifications = []
+        for key in keys:
+            price = self.prices[key]
+            stake = price['remaining_stake']
+            remaining = as_number(stake)
+            matched = remaining if ratio >= 1 else part_of(remaining, ratio)
+            remaining -= matched
+            if remaining:
+                price['remaining_stake'] = same_type(remaining, stake)
+            else:
+                del self.prices[key]
+            notifications.append(self._notification(price, LWPActionType.Matched, same_type(remaining, stake),
+                                                    matched_stake=same_type(matched, stake)))
+        self._notify(notifications)
+        return len(notifications)
+
+    def reset(self):
+        """Simulate GBEi reset: all prices are cancelled and ResetOccurred is sent to every connection"""
+        self.prices.clear()
+        self.broadcast(self.encode(GBEiMessageType.resetOccurred, {}))
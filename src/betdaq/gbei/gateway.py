@@ -0,0 +1,221 @@
+import asyncio
+from logging import getLogger
+from typing import Iterable, List, Optional
+
+from .protocol import GBEiProtocol, GBEiRequestEncoder, GBEiMessageType, ProtocolEvents
+from .shared_ring import SharedRing
+from ..aapi.utils import on_future_task_callback
+
+
+L = getLogger(__name__)
+REFERENCE_BITS = 40  # punter query reference numbers of client with index i are in [(i + 1) << 40, (i + 2) << 40)
+REPLY_TYPES = {GBEiMessageType.pingResponse.value, GBEiMessageType.lightweightPriceSummary.value}
+
+
+def ring_names(name: str, index: int):
+    """Names of commands and notifications rings of gateway client"""
+    return '%s-commands-%s' % (name, index), '%s-notifications-%s' % (name, index)
+
+
+def reference_range(index: int) -> range:
+    """Punter query reference numbers of gateway client, so they never collide with other clients
+    and gateway protocol own ones, which start from 1"""
+    return range((index + 1) << REFERENCE_BITS, (index + 2) << REFERENCE_BITS)
+
+
+def reference_client(reference: int) -> int:
+    """Index of gateway client, given punter query reference number belongs to, -1 for gateway protocol one"""
+    return (reference >> REFERENCE_BITS) - 1
+
+
+class GBEiGateway(object):
+
+    def __init__(self, protocol: GBEiProtocol, name: str, clients: int = 1, capacity: int = 1024 * 1024,
+                 poll_interval: float = 0.0005, max_batch: int = 1000):
+        """Single GBEi connection shared by several processes. Every client process gets a pair of
+        shared memory rings: commands ring with encoded GBEi messages, which are written to the connection as is,
+        and notifications ring with raw messages received from GBEi, which client decodes itself.
+        Clients should encode messages with the same punter id, session key and source as gateway encoder.
+        Ping and query responses are delivered only to the client, which sent the request, by its punter query
+        reference number, see `reference_range`. Requests with references of other clients are rejected.
+        :param protocol: connected protocol
+        :param name: prefix of shared memory rings names, clients attach to rings by it
+        :param clients: number of client processes
+        :param capacity: size (in bytes) of every ring
+        :param poll_interval: pause (in seconds) between polls of commands rings, when they are empty
+        :param max_batch: max number of commands taken from single ring at once, so other clients are not starved
+        """
+        self.protocol = protocol
+        self.name = name
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+        self.commands: List[SharedRing] = []
+        self.notifications: List[SharedRing] = []
+        for i in range(clients):
+            commands, notifications = ring_names(name, i)
+            self.commands.append(SharedRing(commands, capacity, create=True))
+            self.notifications.append(SharedRing(notifications, capacity, create=True))
+        self.forwarded = 0  # number of commands written to GBEi
+        self.rejected = 0  # number of commands, which failed to decode
+        self.dropped = 0  # number of notifications not delivered to client, because its ring was full
+        self._task: Optional[asyncio.Task] = None
+        self._frame: Optional[bytes] = None  # received frame, waiting for its decoded message
+        protocol.add_callback(ProtocolEvents.frame_received, self.on_frame)
+        protocol.add_callback(ProtocolEvents.data_received, self.on_message)
+
+    def on_frame(self, frame: bytes):
+        self._frame = frame
+
+    def on_message(self, message: dict):
+        """Forward frame of decoded message to clients. Frames, which protocol failed to decode, are not forwarded"""
+        frame, self._frame = self._frame, None
+        if frame is None:
+            return
+        if message['message_header']['type'] in REPLY_TYPES:
+            index = reference_client(message['message']['punter_query_reference_number'])
+            if 0 <= index < len(self.notifications):
+                self._put(self.notifications[index], frame)
+            return
+        for ring in self.notifications:
+            self._put(ring, frame)
+
+    def _put(self, ring: SharedRing, frame: bytes):
+        if not ring.put(frame):
+            self.dropped += 1
+            L.warning('Notifications ring %s is full, dropping message', ring.name)
+
+    def poll(self) -> int:
+        """Forward commands from all clients
+        :return: number of forwarded commands
+        """
+        forwarded = 0
+        for index, ring in enumerate(self.commands):
+            references = reference_range(index)
+            for _ in range(self.max_batch):
+                data = ring.get()
+                if data is None:
+                    break
+                try:
+                    envelope, _ = self.protocol.encoder.parse_response(data)
+                    reference = envelope['message'].get('punter_query_reference_number')
+                    if reference is not None and reference not in references:
+                        raise ValueError('Reference number %s is out of client range' % reference)
+                    self.protocol.send_encoded(data, envelope)
+                except Exception:
+                    self.rejected += 1
+                    L.exception('Failed to forward command from %s', ring.name)
+                    continue
+                forwarded += 1
+        self.forwarded += forwarded
+        return forwarded
+
+    async def run(self):
+        while True:
+            if not self.poll():
+                await asyncio.sleep(self.poll_interval)
+            else:
+                await asyncio.sleep(0)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        self._task.add_done_callback(on_future_task_callback)
+
+    def stop(self):
+        """Stop forwarding commands and remove rings"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for ring in self.commands + self.notifications:
+            ring.close()
+
+    def stats(self) -> dict:
+        return {
+            'forwarded': self.forwarded,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'queued_commands_bytes': [len(_) for _ in self.commands],
+            'queued_notifications_bytes': [len(_) for _ in self.notifications],
+        }
+
+
+class GatewayClient(object):
+
+    def __init__(self, name: str, index: int, encoder: GBEiRequestEncoder):
+        """Access to GBEi connection of gateway from another process
+        :param name: name of the gateway
+        :param index: index of the client, unique per process
+        :param encoder: encoder with the same punter id, session key and source as gateway one
+        """
+        commands, notifications = ring_names(name, index)
+        self.commands = SharedRing(commands)
+        self.notifications = SharedRing(notifications)
+        self.encoder = encoder
+        self._references = iter(reference_range(index))
+
+    def send(self, envelope: dict) -> bool:
+        """Queue message to the gateway
+        :return: False if commands ring is full
+        """
+        return self.commands.put(self.encoder.dumps(envelope))
+
+    def send_add_lightweight_prices(self, prices: List[dict], expire_at: Optional[float] = None) -> bool:
+        return self.send(self.encoder.add_lightweight_prices(prices, expire_at))
+
+    def send_cancel_lightweight_prices(self, prices: List[dict], expire_at: Optional[float] = None) -> bool:
+        return self.send(self.encoder.cancel_lightweight_prices(prices, expire_at))
+
+    def send_cancel_all_lightweight_prices(self, expire_at: Optional[float] = None) -> bool:
+        return self.send(self.encoder.get_envelope(GBEiMessageType.cancelAllLightweightPrices.value,
+                                                   {'expire_at': expire_at}))
+
+    def send_cancel_all_lightweight_prices_on_markets(self, market_ids: List[int],
+                                                      expire_at: Optional[float] = None) -> bool:
+        return self.send(self.encoder.get_envelope(GBEiMessageType.cancelAllLightweightPricesOnMarkets.value,
+                                                   {'market_ids': market_ids, 'expire_at': expire_at}))
+
+    def send_cancel_all_lightweight_prices_on_selections(self, selection_ids: List[int],
+                                                         expire_at: Optional[float] = None) -> bool:
+        return self.send(self.encoder.get_envelope(GBEiMessageType.cancelAllLightweightPricesOnSelections.value,
+                                                   {'selection_ids': selection_ids, 'expire_at': expire_at}))
+
+    def _send_request(self, message_type: GBEiMessageType, message_body: dict,
+                      expire_at: Optional[float] = None) -> Optional[int]:
+        reference = next(self._references)
+        message_body.update(punter_query_reference_number=reference, expire_at=expire_at)
+        if self.send(self.encoder.get_envelope(message_type.value, message_body)):
+            return reference
+        return None
+
+    def send_ping(self, expire_at: Optional[float] = None) -> Optional[int]:
+        """Queue Ping command, PingResponse is received by `poll` of this client only
+        :return: punter query reference number of the request, None if commands ring is full
+        """
+        return self._send_request(GBEiMessageType.ping, {}, expire_at)
+
+    def send_query_all(self, market_ids: Iterable[int] = None, selection_ids: Iterable[int] = None,
+                       expire_at: Optional[float] = None) -> Optional[int]:
+        """Queue query of currently active lightweight prices, see `GBEiProtocol.query_all`.
+        LightWeightPriceSummary responses are received by `poll` of this client only
+        :return: punter query reference number of the request, None if commands ring is full
+        """
+        if market_ids is not None:
+            return self._send_request(GBEiMessageType.queryAllLightweightPricesOnMarkets,
+                                      {'market_ids': list(market_ids)}, expire_at)
+        if selection_ids is not None:
+            return self._send_request(GBEiMessageType.queryAllLightweightPricesOnSelections,
+                                      {'selection_ids': list(selection_ids)}, expire_at)
+        return self._send_request(GBEiMessageType.queryAllLightweightPrices, {}, expire_at)
+
+    def poll(self, max_messages: int = 1000) -> List[dict]:
+        """Received GBEi messages, decoded"""
+        messages = []
+        for _ in range(max_messages):
+            frame = self.notifications.get()
+            if frame is None:
+                break
+            messages.append(self.encoder.parse_response(frame)[0])
+        return messages
+
+    def close(self):
+        self.commands.close()
+        self.notifications.close()
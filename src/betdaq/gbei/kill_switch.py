@@ -0,0 +1,113 @@
+import time
+from logging import getLogger
+from typing import Dict, Optional, Tuple, Union
+
+from ..common.enums import MarketStatus, SelectionStatus
+from ..aapi.structures import topics as t, responses as r
+from ..aapi.structures.enums import MessageType
+from .metrics import Histogram
+from .protocol import GBEiProtocol, GBEiMessageType, ProtocolEvents
+
+
+L = getLogger(__name__)
+MARKETS_CANCEL = GBEiMessageType.cancelAllLightweightPricesOnMarkets.value
+SELECTIONS_CANCEL = GBEiMessageType.cancelAllLightweightPricesOnSelections.value
+
+
+class KillSwitch(object):
+
+    def __init__(self, protocol: GBEiProtocol):
+        """Cancels lightweight prices on GBEi as soon as AAPI reports the state, which makes them unsafe:
+        market is not active, is in-running or has a withdrawal, selection is not active or is reset.
+        Unsafe status is acted on whenever it's reported, including the first update of market or selection,
+        withdrawals and resets are detected by the change of known sequence number or reset count.
+        Should be registered as AAPI client listener (`BetdaqAsyncClient.add_listener`),
+        cancels are sent within the same event loop iteration as AAPI message is received.
+        :param protocol: protocol to send cancels with, can be replaced on reconnect with `attach`
+        """
+        self.protocol = None
+        self._withdrawal_sequence_numbers: Dict[int, int] = {}  # market_id: withdrawal sequence number
+        self._reset_counts: Dict[int, int] = {}  # selection_id: selection reset count
+        self._pending: Dict[Tuple[str, int], int] = {}  # (cancel message type, item id): AAPI frame receipt time
+        self.latency = Histogram()  # nanoseconds from AAPI frame receipt till GBEi cancel is written
+        self.triggered = 0
+        self.attach(protocol)
+
+    def attach(self, protocol: GBEiProtocol):
+        self.protocol = protocol
+        self._pending.clear()
+        protocol.add_callback(ProtocolEvents.data_sent, self.on_sent)
+
+    def on_aapi_message(self, response: Union[t.BaseTopic, r.Response], received_at: int):
+        if isinstance(response, t.MExchangeInfo):
+            self._on_market(response, received_at)
+        elif isinstance(response, t.SExchangeInfo):
+            self._on_selection(response, received_at)
+
+    def _on_market(self, topic: t.MExchangeInfo, received_at: int):
+        market_id = topic.market_id or topic.topic_kwargs.get('market_id')
+        if market_id is None:
+            return
+        if topic.head is not None and topic.head.message_type == MessageType.Delete:
+            self._withdrawal_sequence_numbers.pop(market_id, None)
+            return
+        reason = None
+        if topic.status is not None and topic.status != MarketStatus.Active:
+            reason = 'status %s' % topic.status.name
+        if topic.is_currently_in_running:
+            reason = 'in-running'
+        if topic.withdrawal_sequence_number is not None:
+            sequence_number = self._withdrawal_sequence_numbers.get(market_id)
+            self._withdrawal_sequence_numbers[market_id] = topic.withdrawal_sequence_number
+            if sequence_number is not None and topic.withdrawal_sequence_number != sequence_number:
+                reason = 'withdrawal'
+        if reason is not None:
+            L.info('Cancelling prices on market %s due to %s', market_id, reason)
+            self._cancel(self.protocol.send_cancel_all_lightweight_prices_on_markets, MARKETS_CANCEL, market_id,
+                         received_at)
+
+    def _on_selection(self, topic: t.SExchangeInfo, received_at: int):
+        selection_id = topic.selection_id or topic.topic_kwargs.get('selection_id')
+        if selection_id is None:
+            return
+        if topic.head is not None and topic.head.message_type == MessageType.Delete:
+            self._reset_counts.pop(selection_id, None)
+            return
+        reason = None
+        if topic.status is not None and topic.status != SelectionStatus.Active:
+            reason = 'status %s' % topic.status.name
+        if topic.selection_reset_count is not None:
+            reset_count = self._reset_counts.get(selection_id)
+            self._reset_counts[selection_id] = topic.selection_reset_count
+            if reset_count is not None and topic.selection_reset_count != reset_count:
+                reason = 'reset'
+        if reason is not None:
+            L.info('Cancelling prices on selection %s due to %s', selection_id, reason)
+            self._cancel(self.protocol.send_cancel_all_lightweight_prices_on_selections, SELECTIONS_CANCEL,
+                         selection_id, received_at)
+
+    def _cancel(self, send, message_type: str, item_id: int, received_at: Optional[int]):
+        self.triggered += 1
+        if not self.protocol.connected:
+            L.warning('Not connected to GBEi, cancel is not sent')
+            return
+        if received_at is not None:
+            self._pending[(message_type, item_id)] = received_at
+        send([item_id])
+
+    def on_sent(self, envelope: dict):
+        """Measure latency of cancels, when they are written to transport"""
+        if not self._pending:
+            return
+        message_type = envelope['message_header']['type']
+        if message_type == MARKETS_CANCEL:
+            item_ids = envelope['message']['market_ids']
+        elif message_type == SELECTIONS_CANCEL:
+            item_ids = envelope['message']['selection_ids']
+        else:
+            return
+        now = time.perf_counter_ns()
+        for item_id in item_ids:
+            received_at = self._pending.pop((message_type, item_id), None)
+            if received_at is not None:
+                self.latency.add(now - received_at)
@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Dict, Optional, OrderedDict as OrderedDictType
+
+from .metrics import Histogram
+from .protocol import GBEiProtocol, GBEiMessageType, LWPActionType, ProtocolEvents
+
+
+L = getLogger(__name__)
+TRACKED_TYPES = (GBEiMessageType.addLightweightPrices.value, GBEiMessageType.cancelLightweightPrices.value)
+
+
+class AckLatencyTracker(object):
+
+    def __init__(self, unacknowledged_after: float = 10, max_pending: int = 100000):
+        """Latency of GBEi acknowledgements: time from sending AddLightweightPrices or CancelLightweightPrices
+        till the first LWPChangeNotification with the same punter reference number, per notification action type.
+        Should be attached to protocol with `attach`, to get sent and received messages.
+        :param unacknowledged_after: time (in seconds) after which sent price without any notification
+                                     is counted as unacknowledged and forgotten
+        :param max_pending: max number of sent prices waiting for notification, the oldest are forgotten above it
+        """
+        self.unacknowledged_after = int(unacknowledged_after * 1e9)
+        self.max_pending = max_pending
+        self._sent: OrderedDictType[int, int] = OrderedDict()  # punter reference number: perf_counter_ns when sent
+        self.latency: Dict[LWPActionType, Histogram] = {}  # nanoseconds from send till first notification
+        self.unacknowledged = 0  # number of prices without notification in `unacknowledged_after`
+        self.evicted = 0  # number of prices forgotten because of `max_pending` limit
+
+    def __len__(self):
+        return len(self._sent)
+
+    def attach(self, protocol: GBEiProtocol):
+        protocol.add_callback(ProtocolEvents.data_sent, self.on_sent)
+        protocol.add_callback(ProtocolEvents.data_received, self.on_message)
+
+    def _expire(self, now: int):
+        sent = self._sent
+        deadline = now - self.unacknowledged_after
+        while sent:
+            reference, sent_at = next(iter(sent.items()))
+            if sent_at > deadline:
+                break
+            del sent[reference]
+            self.unacknowledged += 1
+            L.debug('No acknowledgement for price %s', reference)
+
+    def on_sent(self, envelope: dict, now: Optional[int] = None):
+        if envelope['message_header']['type'] not in TRACKED_TYPES:
+            return
+        now = time.perf_counter_ns() if now is None else now
+        sent = self._sent
+        for price in envelope['message']['prices']:
+            reference = price['punter_reference_number']
+            sent.pop(reference, None)  # new command for the same price, wait for its notification
+            sent[reference] = now
+        while len(sent) > self.max_pending:
+            sent.popitem(last=False)
+            self.evicted += 1
+        self._expire(now)
+
+    def on_message(self, parsed: dict, now: Optional[int] = None):
+        if parsed['message_header']['type'] != GBEiMessageType.LWPChangeNotification.value:
+            return
+        now = time.perf_counter_ns() if now is None else now
+        sent = self._sent
+        for price in parsed['message']['prices']:
+            sent_at = sent.pop(price['punter_reference_number'], None)
+            if sent_at is None:
+                continue
+            action = LWPActionType(price['lwp_action_type'])
+            histogram = self.latency.get(action)
+            if histogram is None:
+                histogram = self.latency[action] = Histogram()
+            histogram.add(now - sent_at)
+        self._expire(now)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Acknowledgement latency (nanoseconds) per action type and counters
+        :param reset: should histograms be reset after the snapshot, to get latencies of the next period
+        """
+        self._expire(time.perf_counter_ns())
+        result = {
+            'pending': len(self._sent),
+            'unacknowledged': self.unacknowledged,
+            'evicted': self.evicted,
+            'latency': {action.name: histogram.snapshot() for action, histogram in self.latency.items()},
+        }
+        if reset:
+            for histogram in self.latency.values():
+                histogram.reset()
+        return result
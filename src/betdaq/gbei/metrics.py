@@ -0,0 +1,53 @@
+from typing import List, Optional
+
+
+class Histogram(object):
+
+    def __init__(self, buckets: int = 64):
+        """Histogram of non-negative integer values (e.g. latencies in nanoseconds) with power of 2 buckets.
+        Bucket `i` counts values in range [2 ** (i - 1), 2 ** i), bucket 0 counts zeroes
+        :param buckets: number of buckets, values above the last bucket are counted in it
+        """
+        self.buckets: List[int] = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def add(self, value: int):
+        self.buckets[min(value.bit_length(), len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> Optional[int]:
+        """Upper bound of bucket, containing given percentile (0-100) of values"""
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min((1 << i) - 1, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+    def reset(self):
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
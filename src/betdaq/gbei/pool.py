@@ -0,0 +1,301 @@
+import asyncio
+from functools import partial
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from . import settings as s
+from .protocol import GBEiProtocol, GBEiRequestEncoder, ProtocolEvents, GBEiMessageType
+from ..aapi.utils import on_future_task_callback
+
+
+L = getLogger(__name__)
+# messages GBEi sends to every connection of the punter
+BROADCAST_TYPES = {GBEiMessageType.LWPChangeNotification.value, GBEiMessageType.resetOccurred.value}
+
+
+def default_encoder(source: str) -> GBEiRequestEncoder:
+    return GBEiRequestEncoder(s.PUNTER_ID, s.PUNTER_SESSION_KEY, source=source,
+                              decimal_as_string=True, datetime_as_timestamp=True)
+
+
+class PooledConnection(object):
+
+    def __init__(self, index: int, source: str):
+        """State of single pool connection"""
+        self.index = index
+        self.source = source
+        self.protocol: Optional[GBEiProtocol] = None
+        self.rtt: Optional[float] = None  # last ping round trip time (in seconds)
+        self.failures = 0  # number of times connection was lost or failed health check
+        self.reconnect_task: Optional[asyncio.Task] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.protocol is not None and self.protocol.connected
+
+
+class GBEiConnectionPool(object):
+
+    def __init__(self, shards: int = 4, spares: int = 1,
+                 encoder_factory: Callable[[str], GBEiRequestEncoder] = default_encoder,
+                 source_prefix: Optional[str] = None, connect: Callable[..., Awaitable[GBEiProtocol]] = None,
+                 health_interval: Optional[float] = 30, health_timeout: float = 5, reconnect_delay: float = 1,
+                 **protocol_kwargs):
+        """Several GBEi connections, each with its own message source. Prices are routed by market id hash,
+        so all commands of single market go through the same connection and keep their order.
+        When connection is lost or fails health check, its markets are moved to a spare connection (or the least
+        loaded healthy one) and it's reconnected in background, becoming a spare.
+        GBEi sends notifications to every connection of the punter, so they are passed to pool callbacks only from
+        the primary connection, which is moved to another healthy one when it fails.
+        Cancels are routed by `market_id` of the item, or by market of the selection known from added or received
+        prices. Cancels, market of which is unknown, are rejected.
+        Pool can be used in place of single protocol by batcher, quoting engine or kill switch.
+        :param shards: number of market shards, each initially served by its own connection
+        :param spares: number of extra connections to fail shards over to
+        :param encoder_factory: function creating encoder for given message source.
+                                Encoders of all connections should use the same representation of values
+        :param source_prefix: prefix of connection sources, punter id by default. Sources are `<prefix>-<index>`
+        :param connect: coroutine function creating connected protocol, with `GBEiProtocol.create` signature
+        :param health_interval: frequency (in seconds) of pinging every connection, None to disable health checks
+        :param health_timeout: time (in seconds) to wait for ping response, connection is considered failed after it
+        :param reconnect_delay: pause (in seconds) before reconnecting lost connection
+        :param protocol_kwargs: additional protocol initialization parameters
+        """
+        prefix = source_prefix if source_prefix is not None else str(s.PUNTER_ID)
+        self.shards = shards
+        self.connections = [PooledConnection(i, '%s-%s' % (prefix, i)) for i in range(shards + spares)]
+        self.routes: List[int] = list(range(shards))  # shard: index of connection serving it
+        self._encoder_factory = encoder_factory
+        self._connect = connect or GBEiProtocol.create
+        self._protocol_kwargs = protocol_kwargs
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.reconnect_delay = reconnect_delay
+        self._callbacks: List[Tuple[ProtocolEvents, Callable]] = []
+        self.primary: Optional[int] = None  # index of connection, notifications of which are passed to callbacks
+        self._selection_markets: Dict[int, int] = {}  # selection_id: market_id, to route cancels
+        self.rejected = 0  # number of cancels not sent, as market of their selection is unknown
+        self._health_task: Optional[asyncio.Task] = None
+        self._stopped = False
+        self.failovers = 0
+
+    @property
+    def connected(self) -> bool:
+        return any(_.healthy for _ in self.connections)
+
+    def add_callback(self, event: ProtocolEvents, callback: Callable):
+        """Add callback to all current and future connections.
+        Received messages, which GBEi sends to every connection, and raw frames are passed from the primary one only
+        """
+        self._callbacks.append((event, callback))
+        for connection in self.connections:
+            if connection.protocol is not None:
+                connection.protocol.add_callback(event, self._connection_callback(connection, event, callback))
+
+    def _connection_callback(self, connection: PooledConnection, event: ProtocolEvents, callback: Callable):
+        if event is ProtocolEvents.data_received:
+            def on_data_received(parsed: dict):
+                if connection.index == self.primary or parsed['message_header']['type'] not in BROADCAST_TYPES:
+                    callback(parsed)
+            return on_data_received
+        if event is ProtocolEvents.frame_received:
+            def on_frame_received(frame: bytes):
+                if connection.index == self.primary:
+                    callback(frame)
+            return on_frame_received
+        return callback
+
+    def _elect_primary(self):
+        """Keep primary connection, while it's healthy, otherwise choose the first healthy one"""
+        if self.primary is not None and self.connections[self.primary].healthy:
+            return
+        previous = self.primary
+        self.primary = next((_.index for _ in self.connections if _.healthy), None)
+        if self.primary != previous:
+            L.info('GBEi pool primary connection is %s',
+                   self.connections[self.primary].source if self.primary is not None else None)
+
+    async def _open(self, connection: PooledConnection):
+        protocol = await self._connect(encoder=self._encoder_factory(connection.source), **self._protocol_kwargs)
+        for event, callback in self._callbacks:
+            protocol.add_callback(event, self._connection_callback(connection, event, callback))
+        protocol.add_callback(ProtocolEvents.data_received, self._learn_markets)
+        protocol.add_callback(ProtocolEvents.connection_lost, partial(self._on_connection_lost, connection, protocol))
+        connection.protocol = protocol
+        self._elect_primary()
+        L.info('GBEi pool connection %s established', connection.source)
+
+    async def start(self):
+        """Open all connections. Shards of connections, which failed to open, are failed over right away"""
+        self._stopped = False
+        results = await asyncio.gather(*(self._open(_) for _ in self.connections), return_exceptions=True)
+        for connection, result in zip(self.connections, results):
+            if isinstance(result, Exception):
+                L.warning('Failed to open GBEi pool connection %s', connection.source, exc_info=result)
+                self._fail(connection)
+        if self.health_interval:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_cycle())
+            self._health_task.add_done_callback(on_future_task_callback)
+
+    def stop(self):
+        self._stopped = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for connection in self.connections:
+            if connection.reconnect_task is not None:
+                connection.reconnect_task.cancel()
+            if connection.healthy:
+                connection.protocol.on_stop()
+
+    def _on_connection_lost(self, connection: PooledConnection, protocol: GBEiProtocol, exc: Optional[Exception]):
+        if not self._stopped and connection.protocol is protocol:  # not failed already
+            L.warning('GBEi pool connection %s lost', connection.source)
+            self._fail(connection)
+
+    def _fail(self, connection: PooledConnection):
+        """Move shards away from failed connection and reconnect it"""
+        connection.failures += 1
+        if connection.protocol is not None and connection.protocol.connected:
+            connection.protocol.on_stop()
+        connection.protocol = None
+        self._elect_primary()
+        self._failover(connection.index)
+        if not self._stopped and (connection.reconnect_task is None or connection.reconnect_task.done()):
+            connection.reconnect_task = asyncio.get_running_loop().create_task(self._reconnect(connection))
+            connection.reconnect_task.add_done_callback(on_future_task_callback)
+
+    def _failover(self, index: int):
+        shards = [shard for shard, route in enumerate(self.routes) if route == index]
+        if not shards:
+            return
+        loads = {_.index: 0 for _ in self.connections if _.healthy}
+        if not loads:
+            L.error('No healthy GBEi pool connections to fail shards %s over to', shards)
+            return
+        for route in self.routes:
+            if route in loads:
+                loads[route] += 1
+        target = min(loads, key=loads.get)  # spare connections have no shards
+        for shard in shards:
+            self.routes[shard] = target
+        self.failovers += 1
+        L.warning('GBEi pool shards %s moved from %s to %s', shards, self.connections[index].source,
+                  self.connections[target].source)
+
+    async def _reconnect(self, connection: PooledConnection):
+        while not self._stopped:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._open(connection)
+            except Exception:
+                L.warning('Failed to reconnect GBEi pool connection %s', connection.source, exc_info=True)
+                continue
+            for shard, route in enumerate(self.routes):
+                if not self.connections[route].healthy:  # nothing was healthy on failover
+                    self.routes[shard] = connection.index
+            return
+
+    async def _check(self, connection: PooledConnection):
+        try:
+            connection.rtt = await connection.protocol.ping(timeout=self.health_timeout)
+        except Exception:
+            if connection.healthy:
+                L.warning('GBEi pool connection %s failed health check', connection.source, exc_info=True)
+                self._fail(connection)
+
+    async def _health_cycle(self):
+        while not self._stopped:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self._check(_) for _ in self.connections if _.healthy))
+
+    def shard(self, market_id: int) -> int:
+        return hash(market_id) % self.shards
+
+    def protocol_for(self, market_id: int) -> GBEiProtocol:
+        return self.connections[self.routes[self.shard(market_id)]].protocol
+
+    def _any_index(self) -> int:
+        for connection in self.connections:
+            if connection.healthy:
+                return connection.index
+        return self.routes[0]
+
+    def _any_protocol(self) -> GBEiProtocol:
+        connection = self.connections[self._any_index()]
+        if not connection.healthy:
+            raise ConnectionError('No healthy GBEi pool connections')
+        return connection.protocol
+
+    def _learn_markets(self, parsed: dict):
+        """Remember markets of selections from received prices, e.g. ones added before pool was started"""
+        for price in parsed['message'].get('prices') or ():
+            if price.get('market_id') is not None and price.get('selection_id') is not None:
+                self._selection_markets[price['selection_id']] = price['market_id']
+
+    def _group(self, items: Iterable, get_market_id: Callable) -> Dict[int, list]:
+        """Split items by connection, keeping their order.
+        Items of unknown market are rejected, as sending them through another connection could overtake
+        commands of their market
+        """
+        groups: Dict[int, list] = {}
+        for item in items:
+            market_id = get_market_id(item)
+            if market_id is None:
+                self.rejected += 1
+                L.error('Market of %s is unknown to GBEi pool, it is not sent', item)
+                continue
+            groups.setdefault(self.routes[self.shard(market_id)], []).append(item)
+        return groups
+
+    def _send(self, method: str, groups: Dict[int, list], *args):
+        for index, items in groups.items():
+            protocol = self.connections[index].protocol
+            if protocol is None or not protocol.connected:
+                L.warning('GBEi pool connection %s is down, dropping %s items', self.connections[index].source,
+                          len(items))
+                continue
+            getattr(protocol, method)(items, *args)
+
+    def send_add_lightweight_prices(self, prices: List[dict], expire_at=None):
+        for price in prices:
+            self._selection_markets[price['selection_id']] = price['market_id']
+        self._send('send_add_lightweight_prices', self._group(prices, lambda _: _['market_id']), expire_at)
+
+    def send_cancel_lightweight_prices(self, prices: List[dict], expire_at=None):
+        groups = self._group(prices, lambda _: _.get('market_id', self._selection_markets.get(_['selection_id'])))
+        self._send('send_cancel_lightweight_prices', groups, expire_at)
+
+    def send_cancel_all_lightweight_prices(self, expire_at=None):
+        self._any_protocol().send_cancel_all_lightweight_prices(expire_at)
+
+    def send_cancel_all_lightweight_prices_on_markets(self, market_ids: List[int], expire_at=None):
+        self._send('send_cancel_all_lightweight_prices_on_markets', self._group(market_ids, lambda _: _), expire_at)
+
+    def send_cancel_all_lightweight_prices_on_selections(self, selection_ids: List[int], expire_at=None):
+        self._send('send_cancel_all_lightweight_prices_on_selections',
+                   self._group(selection_ids, self._selection_markets.get), expire_at)
+
+    async def ping(self, timeout: float = 10) -> float:
+        return await self._any_protocol().ping(timeout)
+
+    async def query_all(self, market_ids: Iterable[int] = None, selection_ids: Iterable[int] = None,
+                        timeout: float = 30, consumer: Optional[Callable[[dict], None]] = None,
+                        on_progress: Optional[Callable[[int, int, int], None]] = None) -> Union[List[dict], int]:
+        if consumer is not None:
+            def learn_and_consume(price: dict):
+                self._selection_markets[price['selection_id']] = price['market_id']
+                consumer(price)
+            return await self._any_protocol().query_all(market_ids, selection_ids, timeout, learn_and_consume,
+                                                        on_progress)
+        return await self._any_protocol().query_all(market_ids, selection_ids, timeout, consumer, on_progress)
+
+    def stats(self) -> List[dict]:
+        return [{
+            'source': _.source,
+            'connected': _.healthy,
+            'primary': _.index == self.primary,
+            'shards': [shard for shard, route in enumerate(self.routes) if route == _.index],
+            'rtt': _.rtt,
+            'failures': _.failures,
+        } for _ in self.connections]
@@ -1,2 +1,2 @@
 from .protocol import GBEiProtocol, GBEiRequestEncoder
-from .enums import LWPActionType, ProtocolEvents, GBEiMessageType
+from .enums import LWPActionType, ProtocolEvents, GBEiMessageType, WritePolicy, OutboundLane, Direction
@@ -28,8 +28,12 @@ class LWPActionType(Enum):
 class ProtocolEvents(Enum):
     connection_made = 0  # connection to GBEi server established. Accepts no parameters
     data_received = 1  # data received from GBEi server. Accepts single parameter, parsed GBEi message as dictionary
-    data_sent = 2  # data sent to GBEi server. Accepts single parameter, message dictionary object
+    data_sent = 2  # data written to GBEi server transport. Accepts single parameter, message dictionary object
     connection_lost = 3  # connection with GBEi lost for any reason. Accepts one parameter, optional exception
+    frame_received = 4  # raw message received from GBEi server, before it's parsed. Accepts single parameter, bytes
+    # prices of AddLightweightPrices messages, which will never be written to GBEi (dropped by write policy or
+    # queue limit, cancelled while queued or queued when connection was lost). Accepts single parameter, list of prices
+    prices_dropped = 5
 
 
 class GBEiMessageType(Enum):
@@ -46,3 +50,21 @@ class GBEiMessageType(Enum):
     LWPChangeNotification = 'lwpchangenotification'
     pingResponse = 'pingresponse'
     resetOccurred = 'resetoccurred'
+
+
+class WritePolicy(Enum):
+    keep = 0  # queue all messages while writing is paused
+    drop_adds = 1  # drop AddLightweightPrices messages while writing is paused, they will be stale anyway
+    collapse_adds = 2  # merge consecutive queued AddLightweightPrices messages into single one
+
+
+class OutboundLane(Enum):
+    # lanes are written in order of their values
+    cancel = 0  # CancelLightweightPrices and CancelAllLightweightPrices* messages
+    control = 1  # Ping, queries and any other messages
+    add = 2  # AddLightweightPrices messages
+
+
+class Direction(Enum):
+    inbound = 0  # bytes received from GBEi
+    outbound = 1  # bytes written to GBEi
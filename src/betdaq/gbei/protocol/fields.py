@@ -1,10 +1,39 @@
 import struct
 from enum import EnumMeta
-from typing import Any, Tuple, Union
+from functools import partial
+from typing import Any, Callable, Tuple, Union
 from datetime import datetime, timedelta
 from decimal import Decimal as DecimalNative
 
-from pytz import UTC
+from .varint import decode_lsb, decode_msb, encode_lsb, encode_msb, encode_string
+
+
+TICKS_PER_SECOND = 10000000  # .NET tick is 100 nanoseconds
+NANOSECONDS_PER_TICK = 100
+EPOCH_TICKS = 621355968000000000  # ticks between 0001-01-01 and 1970-01-01
+MAX_TICKS = 3155378975999999999  # ticks of 9999-12-31 23:59:59.9999999
+
+
+def ticks_to_ns(ticks: int) -> int:
+    """Convert .NET ticks to nanoseconds since epoch"""
+    return (ticks - EPOCH_TICKS) * NANOSECONDS_PER_TICK
+
+
+def ns_to_ticks(ns: int) -> int:
+    """Convert nanoseconds since epoch to .NET ticks, sub-tick part is truncated"""
+    return ns // NANOSECONDS_PER_TICK + EPOCH_TICKS
+
+
+def ticks_to_timestamp(ticks: int) -> float:
+    """Convert .NET ticks to seconds since epoch"""
+    return (ticks - EPOCH_TICKS) / TICKS_PER_SECOND
+
+
+def timestamp_to_ticks(ts: float) -> int:
+    """Convert seconds since epoch to .NET ticks.
+    Whole seconds are converted separately to not lose precision on float multiplication"""
+    seconds = int(ts)
+    return seconds * TICKS_PER_SECOND + round((ts - seconds) * TICKS_PER_SECOND) + EPOCH_TICKS
 
 
 class Serializable:
@@ -27,6 +56,10 @@ class BaseField(Serializable):
     def dumps(self, value):
         return struct.pack(self.f, *self.get_args(value))
 
+    def pack_into(self, buffer: bytearray, offset: int, value):
+        """Write value into buffer at given offset. Supported by fields of fixed `size` only"""
+        struct.pack_into(self.f, buffer, offset, *self.get_args(value))
+
     def loads(self, bts: memoryview):
         sub_bts = bts[:self.size]
         return struct.unpack(self.f, sub_bts)[0], bts[self.size:]
@@ -53,27 +86,36 @@ class Long(BaseField):
 
 class DateTime(Long):
 
-    def __init__(self, as_timestamp: bool = False):
+    def __init__(self, as_timestamp: bool = False, as_nanoseconds: bool = False):
+        """
+        :param as_timestamp: should values be represented as float seconds since epoch
+        :param as_nanoseconds: should values be represented as integer nanoseconds since epoch.
+                               Takes priority over `as_timestamp`
+        """
         self.dt = datetime(1, 1, 1)
-        self.m = 10000000
+        self.m = TICKS_PER_SECOND
         self.as_timestamp = as_timestamp
+        self.as_nanoseconds = as_nanoseconds
 
     def ticks(self, dt):
-        return int((dt - self.dt).total_seconds() * self.m)
+        return (dt - self.dt) // timedelta(microseconds=1) * 10
 
-    def dumps(self, value):
+    def get_args(self, value):
+        if self.as_nanoseconds:
+            return (ns_to_ticks(value),)
         if self.as_timestamp:
-            value = datetime.utcfromtimestamp(value)
-        return super().dumps(self.ticks(value))
+            return (timestamp_to_ticks(value),)
+        return (self.ticks(value),)
 
     def loads(self, bts: memoryview):
         ticks, bts = super().loads(bts)
         if not ticks:
             return None, bts
-        dt = self.dt + timedelta(microseconds=ticks * 0.1)
+        if self.as_nanoseconds:
+            return ticks_to_ns(ticks), bts
         if self.as_timestamp:
-            dt = UTC.localize(dt).timestamp()
-        return dt, bts
+            return ticks_to_timestamp(ticks), bts
+        return self.dt + timedelta(microseconds=ticks // 10), bts
 
 
 class Decimal(BaseField):
@@ -81,25 +123,41 @@ class Decimal(BaseField):
     size = struct.calcsize(f)
     max_8_bytes_integer = int('1'*63, 2)  # 63 bits all set to 1
 
-    def __init__(self, as_string: bool = False):
+    def __init__(self, as_string: bool = False, precision: int = None):
+        """
+        :param as_string: should decimals be represented as strings
+        :param precision: if set, decimals are represented as integers scaled by `10 ** precision`,
+                          e.g. odds `2.5` with precision 2 are represented as `250`; extra decimal places
+                          of decoded values are truncated toward zero, e.g. `-1.239` is decoded as `-123`.
+                          Takes priority over `as_string`
+        """
         self.as_string = as_string
+        self.precision = precision
 
-    def dumps(self, value: Union[DecimalNative, str]):
+    def get_args(self, value: Union[DecimalNative, str, int]):
+        if self.precision is not None:
+            integer = abs(value)
+            return integer & self.max_8_bytes_integer, integer >> 64, 0, self.precision, (value < 0) << 7
         if self.as_string:
             value = DecimalNative(value)
         parts = value.as_tuple()
         exp = abs(parts.exponent)
         integer = abs(int(value * (10 ** exp)))
-        integer1 = integer & self.max_8_bytes_integer
-        integer2 = integer >> 64
-        result = struct.pack(self.f, integer1, integer2, 0, exp, parts.sign << 7)
-        return result
+        return integer & self.max_8_bytes_integer, integer >> 64, 0, exp, parts.sign << 7
 
     def loads(self, bts: memoryview):
         b = bts[:self.size]
         integer1, integer2, _, exp, sign = struct.unpack(self.f, b)
         value = integer2 << 64
         value |= (integer1 & self.max_8_bytes_integer)
+        if self.precision is not None:
+            if exp > self.precision:
+                value //= 10 ** (exp - self.precision)
+            elif exp < self.precision:
+                value *= 10 ** (self.precision - exp)
+            if sign:
+                value = -value
+            return value, bts[self.size:]
         value = DecimalNative(value) / (10 ** exp)
         sign = sign >> 7
         if sign:
@@ -112,56 +170,30 @@ class Decimal(BaseField):
 class Length(BaseField):
 
     def dumps(self, value):
-        parts = [value & 127]
-        value = value >> 7
-        while value:
-            parts.insert(0, (value & 127) | 128)
-            value = value >> 7
-        bts = struct.pack('<%sB' % len(parts), *parts)
-        return bts
+        return encode_msb(value)
 
     def loads(self, bts: memoryview):
-        value = 0
-        for i in range(10):
-            b = struct.unpack('<B', bts[0:1])[0]
-            bts = bts[1:]
-            value = (value << 7) | (b & 127)
-            if not (b & 128):
-                break
-        return value, bts
+        value, offset = decode_msb(bts)
+        return value, bts[offset:]
 
 
 class String(BaseField):
 
     def encode_length(self, length: int):
-        parts = []
-        while length > 127:
-            parts.append((length & 127) | 128)
-            length = length >> 7
-        parts.append(length & 127)
-        bts = struct.pack('<%sB' % len(parts), *parts)
-        return bts
+        return encode_lsb(length)
 
     def dumps(self, value):
-        value = bytes(value, 'utf-8')
-        length = len(value)
-        encoded_length = self.encode_length(length)
-        return b''.join((encoded_length, value))
+        return encode_string(value)
 
     def loads(self, bts: memoryview):
-        size = 0
-        for i in range(10):
-            b = struct.unpack('<B', bts[0:1])[0]
-            bts = bts[1:]
-            sub = (b & 127) << (i * 7)
-            size |= sub
-            if not b & 128:  # if largest bit of current byte is 0
-                break
-        if size:
-            s = bytes(bts[:size]).decode()
-        else:
-            s = ''
-        return s, bts[size:]
+        size, offset = decode_lsb(bts)
+        end = offset + size
+        return str(bts[offset:end], 'utf-8'), bts[end:]
+
+    def skip(self, bts: memoryview):
+        """Rest of bytes after the string, without decoding it"""
+        size, offset = decode_lsb(bts)
+        return bts[offset + size:]
 
 
 class Enum(BaseField):
@@ -186,23 +218,29 @@ class Enum(BaseField):
 class MoneyAmount(BaseField):
     # decimal + string of 3 symbols
 
-    def __init__(self, currency: str, as_string: bool = False):
+    def __init__(self, currency: str, as_string: bool = False, precision: int = None):
         """
         :param currency: 3-letter currency code, which is used by account
+        :param as_string: should amounts be represented as strings
+        :param precision: if set, amounts are represented as integers in minor currency units,
+                          e.g. `1.5` with precision 2 is represented as `150`, see `Decimal`
         """
         self.currency = currency
-        self.decimal = Decimal(as_string=as_string)
+        self.decimal = Decimal(as_string=as_string, precision=precision)
         self.str = String()
+        self.currency_bts = self.str.dumps(currency)
+        self.size = self.decimal.size + len(self.currency_bts)
+
+    def dumps(self, value: Union[DecimalNative, str, int]):
+        return self.decimal.dumps(value) + self.currency_bts
 
-    def dumps(self, value: DecimalNative):
-        stake = self.decimal.dumps(value)
-        currency = self.str.dumps(self.currency)
-        return b''.join((stake, currency))
+    def pack_into(self, buffer: bytearray, offset: int, value: Union[DecimalNative, str, int]):
+        """Write amount into buffer at given offset, currency is expected to be there already"""
+        self.decimal.pack_into(buffer, offset, value)
 
     def loads(self, bts: memoryview):
         stake, bts = self.decimal.loads(bts)
-        currency, bts = self.str.loads(bts)
-        return stake, bts
+        return stake, self.str.skip(bts)
 
 
 class Array(BaseField):
@@ -216,11 +254,23 @@ class Array(BaseField):
         items = [self.field.dumps(_) for _ in value]
         return b''.join((size, b''.join(items)))
 
-    def loads(self, bts: memoryview):
+    def loads(self, bts: memoryview, consumer: Callable[[Any], bool] = None, as_record: bool = False):
+        """
+        :param consumer: callback, which gets every item as soon as it's decoded. Items, it returns True for,
+                         are consumed and not added to the result list
+        :param as_record: should frame items be decoded to records, see `BaseFrame.loads`
+        """
         size, bts = self.len.loads(bts)
         items = []
+        load = partial(self.field.loads, as_record=True) if as_record else self.field.loads
+        if consumer is not None:
+            for i in range(size):
+                item, bts = load(bts)
+                if not consumer(item):
+                    items.append(item)
+            return items, bts
         for i in range(size):
-            item, bts = self.field.loads(bts)
+            item, bts = load(bts)
             items.append(item)
         return items, bts
 
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Callable, Dict, Optional
+
+from ..metrics import Histogram
+from ...aapi.utils import on_future_task_callback
+
+
+L = getLogger(__name__)
+
+
+def callback_name(callback: Callable) -> str:
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+class ProtocolMetrics(object):
+
+    def __init__(self, time_callbacks: bool = True):
+        """Counters and histograms of single GBEi connection, updated by protocol it's passed to as `metrics`.
+        Updates are plain attribute increments and `perf_counter_ns` calls, cheap enough to stay on in production.
+        :param time_callbacks: should duration of every callback call be measured, it takes two clock reads per call
+        """
+        self.time_callbacks = time_callbacks
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.keep_alives_in = 0
+        self.messages_in: Dict[str, int] = {}  # message type: number of received messages
+        self.messages_out: Dict[str, int] = {}  # message type: number of written or queued messages
+        self.decode_errors = 0
+        self.decode_ns = Histogram()  # time of decoding single message
+        self.callback_ns: Dict[Callable, Histogram] = {}  # callback: time of single call
+        self.buffered_bytes = 0  # bytes of incomplete frame, waiting for the rest of it
+        self.max_buffered_bytes = 0
+        self.heartbeat_ns = Histogram()  # actual interval between heartbeats
+        self._last_heartbeat: Optional[int] = None
+        self._emitter: Optional[asyncio.Task] = None
+
+    def on_received(self, message_type: str, decode_ns: int):
+        self.messages_in[message_type] = self.messages_in.get(message_type, 0) + 1
+        self.decode_ns.add(decode_ns)
+
+    def on_sent(self, message_type: str):
+        self.messages_out[message_type] = self.messages_out.get(message_type, 0) + 1
+
+    def on_buffered(self, size: int):
+        self.buffered_bytes = size
+        if size > self.max_buffered_bytes:
+            self.max_buffered_bytes = size
+
+    def on_callback(self, callback: Callable, duration_ns: int):
+        histogram = self.callback_ns.get(callback)
+        if histogram is None:
+            histogram = self.callback_ns[callback] = Histogram()
+        histogram.add(duration_ns)
+
+    def on_heartbeat(self, now: Optional[int] = None):
+        now = time.perf_counter_ns() if now is None else now
+        if self._last_heartbeat is not None:
+            self.heartbeat_ns.add(now - self._last_heartbeat)
+        self._last_heartbeat = now
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Current values, times are in nanoseconds
+        :param reset: should counters and histograms be reset after the snapshot, to get values of the next period
+        """
+        callbacks = {}
+        for callback, histogram in self.callback_ns.items():
+            name = callback_name(callback)
+            if name in callbacks:
+                name = '%s#%s' % (name, len(callbacks))
+            callbacks[name] = histogram.snapshot()
+        result = {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'keep_alives_in': self.keep_alives_in,
+            'messages_in': dict(self.messages_in),
+            'messages_out': dict(self.messages_out),
+            'decode_errors': self.decode_errors,
+            'decode_ns': self.decode_ns.snapshot(),
+            'callback_ns': callbacks,
+            'buffered_bytes': self.buffered_bytes,
+            'max_buffered_bytes': self.max_buffered_bytes,
+            'heartbeat_interval_ns': self.heartbeat_ns.snapshot(),
+        }
+        if reset:
+            self.reset()
+        return result
+
+    def reset(self):
+        self.bytes_in = self.bytes_out = self.keep_alives_in = self.decode_errors = 0
+        self.messages_in.clear()
+        self.messages_out.clear()
+        self.decode_ns.reset()
+        for histogram in self.callback_ns.values():
+            histogram.reset()
+        self.max_buffered_bytes = self.buffered_bytes
+        self.heartbeat_ns.reset()
+
+    async def emit_cycle(self, interval: float, emit: Callable[[dict], None]):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                emit(self.snapshot(reset=True))
+            except Exception:
+                L.exception('Failed to emit GBEi protocol metrics')
+
+    def start_emitter(self, interval: float = 60, emit: Optional[Callable[[dict], None]] = None):
+        """Periodically pass snapshot of the last period to `emit`, which logs it by default"""
+        self.stop_emitter()
+        emit = emit or (lambda snapshot: L.info('GBEi protocol metrics: %s', snapshot))
+        self._emitter = asyncio.get_running_loop().create_task(self.emit_cycle(interval, emit))
+        self._emitter.add_done_callback(on_future_task_callback)
+
+    def stop_emitter(self):
+        if self._emitter is not None:
+            self._emitter.cancel()
+            self._emitter = None
@@ -1,3 +1,7 @@
+import copy
+import typing
+from types import MappingProxyType
+
 from ...common.enums import Currency
 from .enums import LWPActionType, GBEiMessageType
 from .fields import Int, String, DateTime, Long, Array, Decimal, MoneyAmount,\
@@ -8,8 +12,78 @@ length = Length()
 currency = Currency.GBP.value
 
 
+class Record(object):
+    """Decoded frame with attribute access. Also supports read access of dict, so it can be used in place of one"""
+    __slots__ = ()
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % _ for _ in self.items()))
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, _) for _ in self.__slots__]
+
+    def items(self):
+        return [(_, getattr(self, _)) for _ in self.__slots__]
+
+    def to_dict(self) -> dict:
+        """Copy as dicts, including nested records"""
+        result = {}
+        for key, value in self.items():
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [_.to_dict() if isinstance(_, Record) else _ for _ in value]
+            elif isinstance(value, MappingProxyType):
+                value = dict(value)
+            result[key] = value
+        return result
+
+
+def make_record(name: str, fields: typing.Iterable[str]) -> type:
+    """Record class with given fields and positional `__init__`, generated like namedtuple one,
+    as it's several times faster than setting attributes one by one"""
+    fields = tuple(fields)
+    namespace = {'__slots__': fields}
+    if fields:
+        body = '\n    '.join('self.%s = %s' % (_, _) for _ in fields)
+        code = 'def __init__(self, %s):\n    %s' % (', '.join(fields), body)
+        exec(code, namespace)
+    return type(name, (Record,), namespace)
+
+
 class Meta(type):
     fields_key = '__fields__'
+    record_key = 'record'
+    record_arrays_key = '__record_arrays__'
 
     def __new__(mcs, name, bases, attrs):
         class_fields = {}
@@ -24,12 +98,23 @@ class Meta(type):
                 class_fields[v.name] = v
         res = super(Meta, mcs).__new__(mcs, name, bases, attrs)
         setattr(res, mcs.fields_key, class_fields)
+        # class of decoded values, filled by decoder directly when frame `as_record` is set
+        setattr(res, mcs.record_key, make_record(name + 'Record', class_fields))
+        # names of array fields with frame items, which are decoded to records of the item frame as well
+        setattr(res, mcs.record_arrays_key, frozenset(
+            k for k, v in class_fields.items() if isinstance(v, Array) and isinstance(type(v.field), Meta)))
         return res
 
 
 class BaseFrame(Serializable, metaclass=Meta):
     include_length = False
 
+    def copy(self) -> 'BaseFrame':
+        """Frame with own copies of fields, so their representation can be set apart from other frames"""
+        frame = copy.copy(self)
+        setattr(frame, Meta.fields_key, {k: copy_field(v) for k, v in getattr(self, Meta.fields_key).items()})
+        return frame
+
     def dumps(self, item):
         fields = getattr(self, Meta.fields_key)
         buff = b''
@@ -47,7 +132,13 @@ class BaseFrame(Serializable, metaclass=Meta):
             buff = b''.join((size, buff))
         return buff
 
-    def loads(self, bts: memoryview):
+    def loads(self, bts: memoryview, consumer: typing.Callable[[dict, typing.Any], bool] = None,
+              as_record: bool = False):
+        """
+        :param consumer: callback, which gets items of array fields as soon as they are decoded,
+                         with the fields decoded so far. Items, it returns True for, are not added to the array
+        :param as_record: should values (and frame items of arrays) be decoded to `record` instances instead of dicts
+        """
         fields = getattr(self, Meta.fields_key)
         data = {}
         if self.include_length:
@@ -56,14 +147,47 @@ class BaseFrame(Serializable, metaclass=Meta):
             bts = bts[:l]
         else:
             remaining = bts
-        for name, field in fields.items():
-            value, bts = field.loads(bts)
-            data[name] = value
+        if consumer is not None:
+            record_arrays = getattr(self, Meta.record_arrays_key) if as_record else ()
+            for name, field in fields.items():
+                if isinstance(field, Array):
+                    value, bts = field.loads(bts, lambda item: consumer(data, item), name in record_arrays)
+                else:
+                    value, bts = field.loads(bts)
+                data[name] = value
+            if as_record:
+                data = self.record(*data.values())
+        elif as_record:
+            record_arrays = getattr(self, Meta.record_arrays_key)
+            values = []
+            for name, field in fields.items():
+                if name in record_arrays:
+                    value, bts = field.loads(bts, as_record=True)
+                else:
+                    value, bts = field.loads(bts)
+                values.append(value)
+            data = self.record(*values)
+        else:
+            for name, field in fields.items():
+                value, bts = field.loads(bts)
+                data[name] = value
         if not self.include_length:
             remaining = bts
         return data, remaining
 
 
+def copy_field(field: Serializable) -> Serializable:
+    """Copy of the field, including nested fields and frames"""
+    if isinstance(field, BaseFrame):
+        return field.copy()
+    result = copy.copy(field)
+    if isinstance(field, (Array, Optional)):
+        result.field = copy_field(field.field)
+    elif isinstance(field, MoneyAmount):
+        result.decimal = copy.copy(field.decimal)
+    return result
+
+
 class ProtocolHeader(BaseFrame):
     include_length = True
     version = Byte()  # always 1 (if above field is 0, ignore)
@@ -223,6 +347,39 @@ class Envelope(BaseFrame):
         _.type: _()
         for _ in MessageBody.__subclasses__()
     }
+    header_cache_size = 64  # max number of distinct message headers cached per envelope instance
+    as_record = False  # should messages be decoded to `record` instances instead of dicts, set per instance
+
+    def __init__(self):
+        # own copies of message bodies, so representation of decimals and datetimes is set per envelope
+        self.body_mapping = {k: v.copy() for k, v in self.body_mapping.items()}
+        # raw message header bytes: (shared read-only parsed header, body decoder)
+        self._header_cache = {}
+        # raw protocol or envelope header bytes: shared read-only parsed header, used with `as_record`
+        self._frame_header_cache = {}
+
+    @staticmethod
+    def frame_length(bts: memoryview) -> typing.Optional[int]:
+        """Size of the first frame in given bytes, None if it's not received completely yet.
+        Frame consists of 4 length prefixed parts: protocol header, envelope header, message header and message.
+        Zero length protocol header is single byte keep alive frame
+        """
+        offset = 0
+        size = len(bts)
+        for part in range(4):
+            value = 0
+            while True:
+                if offset >= size:
+                    return None
+                b = bts[offset]
+                offset += 1
+                value = (value << 7) | (b & 127)
+                if not (b & 128):
+                    break
+            if not value and not part:
+                return offset
+            offset += value
+        return offset if offset <= size else None
 
     def dumps(self, data: dict):
         ph = self.protocol_header.dumps(data['protocol_header'])
@@ -231,18 +388,60 @@ class Envelope(BaseFrame):
         message = self.body_mapping[data['message_header']['type']].dumps(data['message'])
         return b''.join((ph, eh, mh, message))
 
-    def loads(self, bts: bytes):
+    def _load_message_header(self, bts: memoryview):
+        """Resolve message header and matching body decoder.
+        Headers are nearly constant per connection, so parsed ones are cached by their raw bytes
+        """
+        l, header_bts = length.loads(bts)
+        end = len(bts) - len(header_bts) + l
+        raw = bts[:end]
+        key = raw if raw.readonly else bytes(raw)
+        try:
+            mh, body = self._header_cache[key]
+        except KeyError:
+            mh, _ = self.message_header.loads(raw)
+            mh = MappingProxyType(mh)
+            body = self.body_mapping[mh['type']]
+            if len(self._header_cache) < self.header_cache_size:
+                self._header_cache[bytes(raw)] = (mh, body)
+        return mh, body, bts[end:]
+
+    def _load_frame_header(self, frame: BaseFrame, bts: memoryview):
+        """Protocol and envelope headers are the same in every message, so they are decoded once
+        and shared by their raw bytes"""
+        l, header_bts = length.loads(bts)
+        end = len(bts) - len(header_bts) + l
+        key = bytes(bts[:end])
+        try:
+            header = self._frame_header_cache[key]
+        except KeyError:
+            header = MappingProxyType(frame.loads(bts)[0])
+            if len(self._frame_header_cache) < self.header_cache_size:
+                self._frame_header_cache[key] = header
+        return header, bts[end:]
+
+    def loads(self, bts: bytes, consumer: typing.Callable[[dict, typing.Any], bool] = None):
+        """
+        :param consumer: callback, which gets items of message array fields as soon as they are decoded,
+                         see `BaseFrame.loads`
+        """
         if not bts:
             return None
         bts = memoryview(bts)
+        if self.as_record:
+            ph, bts = self._load_frame_header(self.protocol_header, bts)
+            eh, bts = self._load_frame_header(self.envelope_header, bts)
+            mh, body, bts = self._load_message_header(bts)
+            message, bts = body.loads(bts, consumer, as_record=True)
+            return self.record(ph, eh, mh, message), bts
         ph, bts = self.protocol_header.loads(bts)
         eh, bts = self.envelope_header.loads(bts)
-        mh, bts = self.message_header.loads(bts)
-        message, bts = self.body_mapping[mh['type']].loads(bts)
+        mh, body, bts = self._load_message_header(bts)
+        message, bts = body.loads(bts, consumer)
         data = {
             'protocol_header': ph,
             'envelope_header': eh,
-            'message_header': mh,
+            'message_header': dict(mh),  # copy of the cached one, so it can be changed by consumers
             'message': message
         }
         return data, bts
@@ -0,0 +1,221 @@
+import time
+from collections import deque
+from logging import getLogger
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from ...common.market_index import is_filled
+from .enums import GBEiMessageType, WritePolicy, OutboundLane
+from .utils import price_key
+from .request_encoder import GBEiRequestEncoder
+
+
+L = getLogger(__name__)
+ADD_TYPE = GBEiMessageType.addLightweightPrices.value
+LANES = {
+    ADD_TYPE: OutboundLane.add,
+    GBEiMessageType.cancelLightweightPrices.value: OutboundLane.cancel,
+    GBEiMessageType.cancelAllLightweightPrices.value: OutboundLane.cancel,
+    GBEiMessageType.cancelAllLightweightPricesOnMarkets.value: OutboundLane.cancel,
+    GBEiMessageType.cancelAllLightweightPricesOnSelections.value: OutboundLane.cancel,
+}  # message type: lane, control lane is used for any other message
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate: float, burst: int = 1):
+        """Rate limit
+        :param rate: number of allowed messages per second
+        :param burst: max number of messages allowed at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, now: float = None) -> bool:
+        """Take single token if available"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now: float = None) -> float:
+        """Time (in seconds) till next token is available"""
+        self._refill(time.monotonic() if now is None else now)
+        return max(0., (1 - self.tokens) / self.rate)
+
+
+class OutboundQueue(object):
+
+    def __init__(self, encoder: GBEiRequestEncoder, policy: WritePolicy = WritePolicy.keep,
+                 max_bytes: int = 4 * 1024 * 1024, rate_limits: Dict[OutboundLane, Tuple[float, int]] = None,
+                 on_drop: Optional[Callable[[List[dict]], None]] = None):
+        """Messages waiting to be written to transport, split by priority lanes.
+        Messages of higher priority lane are always written ahead of lower priority lanes ones,
+        cancels first, then pings and queries, then adds. Cancel of the price removes it from queued adds.
+        :param encoder: encoder to re-encode collapsed or modified messages with
+        :param policy: what to do with AddLightweightPrices messages while writing is paused
+        :param max_bytes: max size of queued messages. AddLightweightPrices messages are dropped above it,
+                          any other messages (e.g. cancels) are always queued
+        :param rate_limits: lane: (messages per second, burst size) to keep under GBEi commands limit
+        :param on_drop: called with prices of AddLightweightPrices messages, which won't be written anymore
+        """
+        self._encoder = encoder
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self._buckets = {lane: TokenBucket(*limit) for lane, limit in (rate_limits or {}).items()}
+        # lane: [[message type, encoded message or None, envelope, size]], in order of lanes priority
+        self._lanes: Dict[OutboundLane, Deque[list]] = {_: deque() for _ in OutboundLane}
+        self._count = 0
+        self.size = 0
+        self.high_watermark = 0  # max size of queued messages seen
+        self.dropped = 0  # number of dropped add messages
+        self.collapsed = 0  # number of add messages merged into previous ones
+        self.rate_limited = 0  # number of messages queued because of lane rate limit
+        self.on_drop = on_drop
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def get_lane(envelope: Optional[dict]) -> OutboundLane:
+        if envelope is None:
+            return OutboundLane.control
+        return LANES.get(envelope['message_header']['type'], OutboundLane.control)
+
+    def acquire(self, envelope: Optional[dict]) -> bool:
+        """Check if message can be written right away: nothing is queued in its lane or higher priority ones
+        and lane rate limit allows it. Cancel written ahead of queued adds removes cancelled prices from them
+        """
+        lane = self.get_lane(envelope)
+        for queued_lane, items in self._lanes.items():
+            if queued_lane.value > lane.value:
+                break
+            if items:
+                return False
+        bucket = self._buckets.get(lane)
+        if bucket is not None and not bucket.acquire():
+            self.rate_limited += 1
+            return False
+        if lane is OutboundLane.cancel:
+            self._remove_cancelled_adds(envelope)
+        return True
+
+    def queued(self) -> Dict[str, int]:
+        return {lane.name: len(items) for lane, items in self._lanes.items()}
+
+    def push(self, data: bytes, envelope: Optional[dict] = None, droppable: bool = True) -> bool:
+        """Queue encoded message
+        :param data: encoded message
+        :param envelope: message envelope, required to find out message lane and to drop or collapse messages
+        :param droppable: should write policy be applied to AddLightweightPrices message
+        :return: if message was queued
+        """
+        message_type = envelope['message_header']['type'] if envelope is not None else None
+        lane = self.get_lane(envelope)
+        items = self._lanes[lane]
+        size = len(data)
+        if lane is OutboundLane.cancel:
+            self._remove_cancelled_adds(envelope)
+        elif message_type == ADD_TYPE:
+            if (droppable and self.policy is WritePolicy.drop_adds) or self.size + size > self.max_bytes:
+                self.dropped += 1
+                self._report_dropped(envelope['message']['prices'])
+                return False
+            if droppable and self.policy is WritePolicy.collapse_adds and items:
+                last = items[-1]
+                prices = last[2]['message']['prices'] + envelope['message']['prices']
+                last[1] = None
+                last[2] = dict(envelope, message=dict(envelope['message'], prices=prices))
+                last[3] += size
+                self.collapsed += 1
+                self._add_size(size)
+                return True
+            if not all(is_filled(price) for price in envelope['message']['prices']):
+                data = None  # encoded again when written, with expected values, known by market index at that time
+        items.append([message_type, data, envelope, size])
+        self._count += 1
+        self._add_size(size)
+        return True
+
+    def _report_dropped(self, prices: List[dict]):
+        if self.on_drop is not None and prices:
+            try:
+                self.on_drop(prices)
+            except Exception:
+                L.exception('Dropped prices callback failed')
+
+    def _add_size(self, size: int):
+        self.size += size
+        if self.size > self.high_watermark:
+            self.high_watermark = self.size
+
+    def _remove_cancelled_adds(self, envelope: dict):
+        """Remove prices cancelled by given message from queued adds, as cancel is written ahead of them"""
+        adds = self._lanes[OutboundLane.add]
+        if not adds:
+            return
+        message_type = envelope['message_header']['type']
+        message = envelope['message']
+        if message_type == GBEiMessageType.cancelLightweightPrices.value:
+            keys = {price_key(_) for _ in message['prices']}
+            is_cancelled = lambda price: price_key(price) in keys  # noqa E731
+        elif message_type == GBEiMessageType.cancelAllLightweightPricesOnMarkets.value:
+            market_ids = set(message['market_ids'])
+            is_cancelled = lambda price: price['market_id'] in market_ids  # noqa E731
+        elif message_type == GBEiMessageType.cancelAllLightweightPricesOnSelections.value:
+            selection_ids = set(message['selection_ids'])
+            is_cancelled = lambda price: price['selection_id'] in selection_ids  # noqa E731
+        else:
+            is_cancelled = lambda price: True  # noqa E731
+        removed = []
+        for item in list(adds):
+            add = item[2]
+            prices = [_ for _ in add['message']['prices'] if not is_cancelled(_)]
+            if len(prices) == len(add['message']['prices']):
+                continue
+            removed.extend(_ for _ in add['message']['prices'] if is_cancelled(_))
+            if prices:
+                add = item[2] = dict(add, message=dict(add['message'], prices=prices))
+                data = self._encoder.dumps(add)
+                item[1] = data if all(is_filled(_) for _ in prices) else None
+                self.size += len(data) - item[3]
+                item[3] = len(data)
+            else:
+                adds.remove(item)
+                self._count -= 1
+                self.size -= item[3]
+        self._report_dropped(removed)
+
+    def pop_ready(self) -> Tuple[List[Tuple[bytes, Optional[dict]]], Optional[float]]:
+        """Get queued messages, allowed to be written by lanes rate limits, in order of lanes priority
+        :return: (encoded message, envelope) ready to be written and time (in seconds) till next message is allowed,
+                 if any messages are left in the queue
+        """
+        chunks = []
+        delay = None
+        now = time.monotonic()
+        for lane, items in self._lanes.items():
+            bucket = self._buckets.get(lane)
+            while items:
+                if bucket is not None and not bucket.acquire(now):
+                    lane_delay = bucket.delay(now)
+                    delay = lane_delay if delay is None else min(delay, lane_delay)
+                    break
+                _, data, envelope, size = items.popleft()
+                self._count -= 1
+                self.size -= size
+                chunks.append((data if data is not None else self._encoder.dumps(envelope), envelope))
+        return chunks, delay
+
+    def clear(self):
+        self._report_dropped([price for _ in self._lanes[OutboundLane.add] for price in _[2]['message']['prices']])
+        for items in self._lanes.values():
+            items.clear()
+        self._count = 0
+        self.size = 0
@@ -1,23 +1,59 @@
+import time
 import asyncio
+from itertools import count
 from logging import getLogger
 from datetime import datetime
-from typing import Optional, Dict, List, Callable
+from typing import Optional, Dict, List, Callable, Iterable, Tuple, Union
 
 from .. import settings as s
 from ...aapi.utils import on_future_task_callback
-from .enums import ProtocolEvents
+from .enums import ProtocolEvents, GBEiMessageType, WritePolicy, OutboundLane, Direction
+from .instrumentation import ProtocolMetrics
+from .outbound import OutboundQueue
+from .recorder import SessionRecorder
 from .request_encoder import GBEiRequestEncoder
+from .streams import NotificationStream
+from .timer_wheel import TimerWheel
 
 
 L = getLogger(__name__)
 
 
+class PendingRequest(object):
+    """Request waiting for GBEi response with the same punter query reference number"""
+    __slots__ = ('future', 'sent_at', 'messages', 'received', 'consumer', 'on_progress', 'items')
+
+    def __init__(self, future: asyncio.Future, consumer: Optional[Callable[[dict], None]] = None,
+                 on_progress: Optional[Callable[[int, int, int], None]] = None):
+        self.future = future
+        self.sent_at = time.perf_counter()
+        self.messages: List[dict] = []  # received summaries, unless their prices are streamed to consumer
+        self.received = 0  # number of received summaries
+        self.consumer = consumer
+        self.on_progress = on_progress
+        self.items = 0  # number of prices streamed to consumer
+
+
 class GBEiProtocol(asyncio.Protocol):
 
-    def __init__(self, encoder: GBEiRequestEncoder, heartbeat_interval: float = 60):
+    def __init__(self, encoder: GBEiRequestEncoder, heartbeat_interval: float = 60,
+                 write_policy: WritePolicy = WritePolicy.keep, max_queued_bytes: int = 4 * 1024 * 1024,
+                 write_buffer_limits: Optional[Tuple[int, int]] = None,
+                 rate_limits: Optional[Dict[OutboundLane, Tuple[float, int]]] = None,
+                 timer_wheel: Optional[TimerWheel] = None, recorder: Optional[SessionRecorder] = None,
+                 metrics: Optional[ProtocolMetrics] = None):
         """
         :param encoder: initialized encoder to follow GBEi communication protocol
         :param heartbeat_interval: frequency (in seconds) of sending ping command to GBEi server
+        :param write_policy: what to do with AddLightweightPrices messages while transport paused writing
+        :param max_queued_bytes: max size of messages queued while transport paused writing,
+                                 AddLightweightPrices messages are dropped above it
+        :param write_buffer_limits: (high, low) watermarks of transport write buffer, transport defaults if not set
+        :param rate_limits: outbound lane: (messages per second, burst size), to keep under GBEi commands limit.
+                            Cancels are always written ahead of pings and queries, which are ahead of adds
+        :param timer_wheel: shared timer wheel to track requests deadlines with, instead of timer per request
+        :param recorder: recorder to capture raw received and written bytes with
+        :param metrics: counters and histograms to update, nothing is measured if not set
         """
         self._callbacks: Dict[ProtocolEvents, List[Callable]] = {_: [] for _ in ProtocolEvents}
         self._encoder = encoder
@@ -26,14 +62,31 @@ class GBEiProtocol(asyncio.Protocol):
         self._heartbeat_loop = None
         self._stopped = asyncio.Event()
         self._buff = b''
-        self._error_seen = False
+        self._references = count(1)
+        self._pending: Dict[int, PendingRequest] = {}  # punter query reference number: request
+        self._streaming = 0  # number of pending requests with consumer
+        self._outbound = OutboundQueue(encoder, write_policy, max_queued_bytes, rate_limits,
+                                       on_drop=self._on_prices_dropped)
+        self._drain_handle: Optional[asyncio.Handle] = None
+        self._write_buffer_limits = write_buffer_limits
+        self._writing_paused = False
+        self._pauses = 0
+        self._timer_wheel = timer_wheel
+        self._streams: List[NotificationStream] = []
+        self._recorder = recorder
+        self.metrics = metrics
 
     def _apply_callbacks(self, event: ProtocolEvents, *a, **kw):
+        metrics = self.metrics if self.metrics is not None and self.metrics.time_callbacks else None
         for cb in self._callbacks[event]:
+            if metrics is not None:
+                started = time.perf_counter_ns()
             try:
                 cb(*a, **kw)
             except Exception:
                 L.exception('Callback %s for %s event failed', getattr(cb, '__name__', 'empty'), event.name)
+            if metrics is not None:
+                metrics.on_callback(cb, time.perf_counter_ns() - started)
 
     def update_callbacks(self, other: 'GBEiProtocol'):
         """Add callbacks from another instance of protocol"""
@@ -44,9 +97,36 @@ class GBEiProtocol(asyncio.Protocol):
     def add_callback(self, event: ProtocolEvents, callback: Callable):
         self._callbacks[event].append(callback)
 
+    def notifications(self, types: Optional[Iterable[GBEiMessageType]] = None,
+                      maxsize: int = 10000) -> NotificationStream:
+        """Stream of received messages to consume with `async for`, decoupled from socket reads.
+        Should be closed, or used as context manager, when not needed anymore.
+        :param types: message types to receive, all messages if not set
+        :param maxsize: max number of messages waiting for consumer, the oldest are dropped above it
+        """
+        if types is not None:
+            types = [getattr(_, 'value', _) for _ in types]
+        stream = NotificationStream(types, maxsize, on_close=self._streams.remove)
+        self._streams.append(stream)
+        return stream
+
+    def stream_stats(self) -> List[dict]:
+        return [_.stats() for _ in self._streams]
+
+    @property
+    def encoder(self) -> GBEiRequestEncoder:
+        return self._encoder
+
+    @property
+    def connected(self) -> bool:
+        return self._transport is not None
+
     def connection_made(self, transport) -> None:
         L.debug('Connection to GBEi established')
         self._transport = transport
+        if self._write_buffer_limits is not None:
+            high, low = self._write_buffer_limits
+            transport.set_write_buffer_limits(high=high, low=low)
         self._apply_callbacks(ProtocolEvents.connection_made)
         self._heartbeat_loop = asyncio.get_running_loop().create_task(self.heartbeat_cycle())
         self._heartbeat_loop.add_done_callback(on_future_task_callback)
@@ -55,64 +135,298 @@ class GBEiProtocol(asyncio.Protocol):
         L.debug('Connection to GBEi closed', exc_info=exc)
         self._transport = None
         self._heartbeat_loop.cancel()
+        self._writing_paused = False
+        if self._drain_handle is not None:
+            self._drain_handle.cancel()
+            self._drain_handle = None
+        if self._outbound:
+            L.warning('Dropping %s messages not written to GBEi', len(self._outbound))
+            self._outbound.clear()
+        for pending in self._pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(ConnectionError('Connection to GBEi closed'))
+        self._pending.clear()
+        for stream in list(self._streams):
+            stream.close()
         self._apply_callbacks(ProtocolEvents.connection_lost, exc)
 
+    def _resolve_pending(self, parsed: dict):
+        message_type = parsed['message_header']['type']
+        if message_type == GBEiMessageType.pingResponse.value:
+            pending = self._pending.pop(parsed['message']['punter_query_reference_number'], None)
+            if pending is not None and not pending.future.done():
+                pending.future.set_result(time.perf_counter() - pending.sent_at)
+        elif message_type == GBEiMessageType.lightweightPriceSummary.value:
+            message = parsed['message']
+            reference = message['punter_query_reference_number']
+            pending = self._pending.get(reference)
+            if pending is None:
+                return
+            pending.received += 1
+            if pending.consumer is None:
+                pending.messages.append(message)
+            total = message['total_summary_notifications']
+            if pending.on_progress is not None:
+                try:
+                    pending.on_progress(pending.received, total, pending.items)
+                except Exception:
+                    L.exception('Query progress callback failed')
+            if pending.received >= total:
+                del self._pending[reference]
+                if pending.future.done():
+                    return
+                if pending.consumer is not None:
+                    pending.future.set_result(pending.items)
+                else:
+                    pending.future.set_result([price for _ in pending.messages for price in _['prices']])
+
+    def _consume_item(self, message: dict, item) -> bool:
+        """Stream price of summary to consumer of pending query, while the summary is decoded"""
+        pending = self._pending.get(message.get('punter_query_reference_number'))
+        if pending is None or pending.consumer is None:
+            return False
+        pending.items += 1
+        try:
+            pending.consumer(item)
+        except Exception:
+            L.exception('Query consumer failed')
+        return True
+
+    def _on_prices_dropped(self, prices: List[dict]):
+        L.debug('Dropped %s prices to add', len(prices))
+        self._apply_callbacks(ProtocolEvents.prices_dropped, prices)
+
+    def pause_writing(self) -> None:
+        L.debug('Transport write buffer is full, queueing messages')
+        self._writing_paused = True
+        self._pauses += 1
+
+    def resume_writing(self) -> None:
+        L.debug('Transport write buffer drained, writing %s queued messages', len(self._outbound))
+        self._writing_paused = False
+        self._drain()
+
+    def _drain(self):
+        """Write queued messages, allowed by lanes rate limits, and schedule next drain for the rest"""
+        if self._drain_handle is not None:
+            self._drain_handle.cancel()
+            self._drain_handle = None
+        if self._writing_paused or self._transport is None or not self._outbound:
+            return
+        chunks, delay = self._outbound.pop_ready()
+        if chunks:
+            self._transport.writelines([data for data, _ in chunks])
+            for data, envelope in chunks:
+                self._on_written(data, envelope)
+        if delay is not None:
+            self._drain_handle = asyncio.get_running_loop().call_later(delay, self._drain)
+
+    def _on_written(self, data: bytes, envelope: Optional[dict] = None):
+        if self._recorder is not None:
+            self._recorder.record(Direction.outbound, data)
+        if self.metrics is not None:
+            self.metrics.bytes_out += len(data)
+            if envelope is not None:
+                self.metrics.on_sent(envelope['message_header']['type'])
+        if envelope is not None:
+            self._apply_callbacks(ProtocolEvents.data_sent, envelope)
+
+    def _write(self, data: bytes, envelope: Optional[dict] = None) -> bool:
+        """Write message to transport right away, or queue it while writing is paused, messages of the same
+        or higher priority are waiting or lane rate limit is reached. `data_sent` callbacks get the message,
+        when it's written to transport
+        :return: if message was written or queued
+        """
+        if not self._writing_paused and self._outbound.acquire(envelope):
+            self._transport.write(data)
+            self._on_written(data, envelope)
+            return True
+        queued = self._outbound.push(data, envelope, droppable=self._writing_paused)
+        if not self._writing_paused and self._drain_handle is None:
+            self._drain_handle = asyncio.get_running_loop().call_soon(self._drain)
+        return queued
+
+    def write_stats(self) -> dict:
+        """Outbound flow control metrics"""
+        stats = {
+            'paused': self._writing_paused,
+            'pauses': self._pauses,
+            'queued_messages': len(self._outbound),
+            'queued_bytes': self._outbound.size,
+            'queued_bytes_high_watermark': self._outbound.high_watermark,
+            'max_queued_bytes': self._outbound.max_bytes,
+            'dropped_adds': self._outbound.dropped,
+            'collapsed_adds': self._outbound.collapsed,
+            'rate_limited': self._outbound.rate_limited,
+            'queued_by_lane': self._outbound.queued(),
+        }
+        if self._transport is not None:
+            low, high = self._transport.get_write_buffer_limits()
+            stats.update(transport_buffer_bytes=self._transport.get_write_buffer_size(),
+                         transport_buffer_high=high, transport_buffer_low=low)
+        return stats
+
     def data_received(self, data: bytes) -> None:
-        data, self._buff = self._buff + data, b''
+        if self._recorder is not None:
+            self._recorder.record(Direction.inbound, data)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.bytes_in += len(data)
+        data = memoryview(self._buff + data if self._buff else data)
         while data:
+            size = self._encoder.e.frame_length(data)
+            if size is None:  # wait for the rest of the frame
+                break
+            frame, data = data[:size], data[size:]
+            if size == 1:  # keep alive
+                if metrics is not None:
+                    metrics.keep_alives_in += 1
+                continue
+            if self._callbacks[ProtocolEvents.frame_received]:
+                self._apply_callbacks(ProtocolEvents.frame_received, bytes(frame))
+            if metrics is not None:
+                started = time.perf_counter_ns()
             try:
-                parsed = self._encoder.parse_response(data)
+                parsed = self._encoder.parse_response(frame, self._consume_item if self._streaming else None)
             except Exception:
-                if self._error_seen:
-                    L.error('Failed to parse incoming message %s', data)
-                    self._error_seen = False
-                else:
-                    self._error_seen = True
-                    self._buff = bytes(data)
-                break
-            else:
-                self._error_seen = False
-                if parsed is not None:
-                    parsed, data = parsed
-                    data = bytes(data)
-                    L.debug('Received %s data', parsed)
-                    self._apply_callbacks(ProtocolEvents.data_received, parsed)
-                if not data:
-                    break
+                if metrics is not None:
+                    metrics.decode_errors += 1
+                L.error('Failed to parse incoming message %s', bytes(frame))
+                continue
+            if parsed is not None:
+                parsed, _ = parsed
+                if metrics is not None:
+                    metrics.on_received(parsed['message_header']['type'], time.perf_counter_ns() - started)
+                L.debug('Received %s data', parsed)
+                if self._pending:
+                    self._resolve_pending(parsed)
+                self._apply_callbacks(ProtocolEvents.data_received, parsed)
+                for stream in self._streams:
+                    stream.put(parsed)
+        self._buff = bytes(data)
+        if metrics is not None:
+            metrics.on_buffered(len(self._buff))
 
     def on_stop(self):
         self._stopped.set()
         self._transport.close()
 
     def keep_alive(self):
-        self._transport.write(self._encoder.keep_alive())
+        if not self._writing_paused:  # anything queued keeps connection alive as well
+            data = self._encoder.keep_alive()
+            self._transport.write(data)
+            self._on_written(data)
+
+    def _send_envelope(self, data: bytes, envelope: dict):
+        self._write(data, envelope)
 
     def send(self, message_type: str, message_body: dict):
         """Send custom message to GBEi server. Message should contain all fields"""
         env = self._encoder.get_envelope(message_type, message_body)
-        data = self._encoder.e.dumps(env)
-        self._transport.write(data)
-        self._apply_callbacks(ProtocolEvents.data_sent, env)
+        data = self._encoder.dumps(env)
+        self._send_envelope(data, env)
+
+    def send_encoded(self, data: bytes, envelope: Optional[dict] = None):
+        """Send message encoded already, e.g. by another process
+        :param data: envelope bytes
+        :param envelope: decoded envelope for outbound lanes and callbacks, parsed from data if not set
+        """
+        if envelope is None:
+            envelope, _ = self._encoder.parse_response(data)
+        self._send_envelope(data, envelope)
 
     def send_add_lightweight_prices(self, prices: List[dict], expire_at: Optional[datetime] = None):
         L.debug('Calling add prices %s', prices)
         env = self._encoder.add_lightweight_prices(prices, expire_at)
-        data = self._encoder.e.dumps(env)
-        self._transport.write(data)
-        self._apply_callbacks(ProtocolEvents.data_sent, env)
+        data = self._encoder.dumps(env)
+        self._send_envelope(data, env)
 
     def send_cancel_lightweight_prices(self, prices: List[dict], expire_at: Optional[datetime] = None):
         L.debug('Calling cancel prices %s', prices)
         env = self._encoder.cancel_lightweight_prices(prices, expire_at)
-        data = self._encoder.e.dumps(env)
-        self._transport.write(data)
-        self._apply_callbacks(ProtocolEvents.data_sent, env)
+        data = self._encoder.dumps(env)
+        self._send_envelope(data, env)
+
+    def send_cancel_all_lightweight_prices(self, expire_at: Optional[float] = None):
+        L.debug('Calling cancel all prices')
+        self.send(GBEiMessageType.cancelAllLightweightPrices.value, {'expire_at': expire_at})
+
+    def send_cancel_all_lightweight_prices_on_markets(self, market_ids: List[int], expire_at: Optional[float] = None):
+        L.debug('Calling cancel all prices on markets %s', market_ids)
+        self.send(GBEiMessageType.cancelAllLightweightPricesOnMarkets.value,
+                  {'market_ids': market_ids, 'expire_at': expire_at})
+
+    def send_cancel_all_lightweight_prices_on_selections(self, selection_ids: List[int],
+                                                         expire_at: Optional[float] = None):
+        L.debug('Calling cancel all prices on selections %s', selection_ids)
+        self.send(GBEiMessageType.cancelAllLightweightPricesOnSelections.value,
+                  {'selection_ids': selection_ids, 'expire_at': expire_at})
+
+    async def _request(self, message_type: str, message_body: dict, timeout: float,
+                       consumer: Optional[Callable[[dict], None]] = None,
+                       on_progress: Optional[Callable[[int, int, int], None]] = None):
+        reference = next(self._references)
+        pending = PendingRequest(asyncio.get_running_loop().create_future(), consumer, on_progress)
+        self._pending[reference] = pending
+        message_body['punter_query_reference_number'] = reference
+        timer = None
+        if consumer is not None:
+            self._streaming += 1
+        try:
+            self.send(message_type, message_body)
+            if self._timer_wheel is None:
+                return await asyncio.wait_for(pending.future, timeout)
+            timer = self._timer_wheel.call_later(timeout, self._expire_request, reference)
+            return await pending.future
+        finally:
+            self._pending.pop(reference, None)
+            if timer is not None:
+                timer.cancel()
+            if consumer is not None:
+                self._streaming -= 1
+
+    def _expire_request(self, reference: int):
+        pending = self._pending.pop(reference, None)
+        if pending is not None and not pending.future.done():
+            pending.future.set_exception(asyncio.TimeoutError())
+
+    async def ping(self, timeout: float = 10) -> float:
+        """Send Ping command and wait for PingResponse.
+        :param timeout: time (in seconds) to wait for response, `asyncio.TimeoutError` is raised after it
+        :return: round trip time in seconds
+        """
+        return await self._request(GBEiMessageType.ping.value, {}, timeout)
+
+    async def query_all(self, market_ids: Iterable[int] = None, selection_ids: Iterable[int] = None,
+                        timeout: float = 30, consumer: Optional[Callable[[dict], None]] = None,
+                        on_progress: Optional[Callable[[int, int, int], None]] = None) -> Union[List[dict], int]:
+        """Query currently active lightweight prices and wait for all LightWeightPriceSummary responses.
+        Prices of all markets are requested, unless market or selection ids are given.
+        :param market_ids: ids of markets to request prices for
+        :param selection_ids: ids of selections to request prices for
+        :param timeout: time (in seconds) to wait for all responses, `asyncio.TimeoutError` is raised after it
+        :param consumer: callback, which gets every price as soon as it's decoded, e.g. `LightweightPriceBook.upsert`.
+                         Prices are not collected then, and summaries passed to callbacks have no prices
+        :param on_progress: callback with number of received summaries, `total_summary_notifications`
+                            and number of prices streamed to consumer so far, called on every summary
+        :return: snapshot of all active prices from received summaries, or number of prices streamed to consumer
+        """
+        if market_ids is not None:
+            message_type, body = GBEiMessageType.queryAllLightweightPricesOnMarkets, {'market_ids': list(market_ids)}
+        elif selection_ids is not None:
+            message_type = GBEiMessageType.queryAllLightweightPricesOnSelections
+            body = {'selection_ids': list(selection_ids)}
+        else:
+            message_type, body = GBEiMessageType.queryAllLightweightPrices, {}
+        return await self._request(message_type.value, body, timeout, consumer, on_progress)
 
     async def heartbeat_cycle(self):
         L.debug('Starting heartbeat cycle')
         try:
             while not self._stopped.is_set() and self._transport is not None:
                 L.debug('Sending keep alive')
+                if self.metrics is not None:
+                    self.metrics.on_heartbeat()
                 self.keep_alive()
                 await asyncio.sleep(self._heartbeat_interval)
         except asyncio.CancelledError:
@@ -121,13 +435,19 @@ class GBEiProtocol(asyncio.Protocol):
 
     @classmethod
     async def create(cls, existing_protocol: Optional['GBEiProtocol'] = None,
-                     encoder: GBEiRequestEncoder = None) -> 'GBEiProtocol':
+                     encoder: GBEiRequestEncoder = None, **protocol_kwargs) -> 'GBEiProtocol':
+        """Connect to GBEi server
+        :param existing_protocol: protocol to copy callbacks from, e.g. when reconnecting
+        :param encoder: encoder to use, created from settings if not specified
+        :param protocol_kwargs: additional protocol initialization parameters
+        """
         host, port = s.URL.split(':', 1)
         if encoder is None:
             encoder = GBEiRequestEncoder(s.PUNTER_ID, s.PUNTER_SESSION_KEY,
                                          decimal_as_string=True, datetime_as_timestamp=True)
         loop = asyncio.get_running_loop()
-        factory = lambda: cls(encoder, heartbeat_interval=60)  # noqa E731
+        protocol_kwargs.setdefault('heartbeat_interval', 60)
+        factory = lambda: cls(encoder, **protocol_kwargs)  # noqa E731
         transport, protocol = await loop.create_connection(protocol_factory=factory, host=host, port=int(port))
         if existing_protocol is not None and isinstance(protocol, cls):
             protocol.update_callbacks(existing_protocol)
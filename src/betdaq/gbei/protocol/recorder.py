@@ -0,0 +1,109 @@
+import asyncio
+import struct
+import time
+from logging import getLogger
+from typing import IO, Iterator, Optional, Tuple
+
+from .enums import Direction
+
+
+L = getLogger(__name__)
+RECORD_HEADER = struct.Struct('<BQI')  # direction, time.monotonic_ns, number of bytes
+
+
+class SessionRecorder(object):
+
+    def __init__(self, path: str, buffer_size: int = 64 * 1024):
+        """Append-only log of raw bytes of GBEi session. Every chunk, as received by `data_received`
+        or written to transport, is stored as direction, monotonic time in nanoseconds, size and the bytes.
+        Pass it to protocol as `recorder` to capture the session
+        :param path: file to append records to
+        :param buffer_size: size of file write buffer, records are flushed when it's full or recorder is closed
+        """
+        self.path = path
+        self._file: Optional[IO[bytes]] = open(path, 'ab', buffering=buffer_size)
+        self.records = 0
+
+    def record(self, direction: Direction, data: bytes, now: Optional[int] = None):
+        if self._file is None:
+            return
+        self._file.write(RECORD_HEADER.pack(direction.value, time.monotonic_ns() if now is None else now, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            L.info('Recorded %s chunks of GBEi session to %s', self.records, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_records(path: str) -> Iterator[Tuple[Direction, int, bytes]]:
+    """Records of session file: direction, monotonic time in nanoseconds and bytes.
+    Incomplete record at the end, e.g. if process was killed while writing, is ignored
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            direction, ts, size = RECORD_HEADER.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                L.warning('Incomplete record at the end of %s', path)
+                return
+            yield Direction(direction), ts, data
+
+
+class SessionReplayer(object):
+
+    def __init__(self, path: str):
+        """Feeds recorded inbound bytes through protocol `data_received`, with the original chunk boundaries
+        :param path: file written by `SessionRecorder`
+        """
+        self.path = path
+
+    def inbound(self) -> Iterator[Tuple[int, bytes]]:
+        for direction, ts, data in read_records(self.path):
+            if direction is Direction.inbound:
+                yield ts, data
+
+    def replay_now(self, protocol: asyncio.Protocol) -> int:
+        """Feed all chunks right away, e.g. to profile decoding
+        :return: number of fed chunks
+        """
+        chunks = 0
+        for _, data in self.inbound():
+            protocol.data_received(data)
+            chunks += 1
+        return chunks
+
+    async def replay(self, protocol: asyncio.Protocol, speed: float = 1.) -> int:
+        """Feed chunks with the original pauses between them
+        :param protocol: protocol to feed bytes to
+        :param speed: replay speed factor, e.g. 10 to replay 10 times faster than recorded
+        :return: number of fed chunks
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = None
+        chunks = 0
+        for ts, data in self.inbound():
+            if first is None:
+                first = ts
+            delay = started + (ts - first) / 1e9 / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            protocol.data_received(data)
+            chunks += 1
+        return chunks
@@ -1,11 +1,13 @@
 import time
 from logging import getLogger
-from typing import List, Tuple, Optional
+from typing import Any, Callable, Dict, List, Tuple, Optional
 from datetime import datetime, timedelta
 
+from ...common.market_index import MarketIndex, is_filled
 from .enums import GBEiMessageType
 from .fields import DateTime, Decimal, MoneyAmount, Optional as Opt, Array
 from .items import Envelope, Meta, BaseFrame
+from .templates import TEMPLATE_TYPES, MessageTemplate
 
 
 L = getLogger(__name__)
@@ -17,7 +19,10 @@ class GBEiRequestEncoder(object):
                  source: str = None, format: str = 'binary', transport: str = 'lwps_tcp1',
                  interface: str = 'lightweightpriceserverexternal', priority: int = 3,
                  default_expire_timeout: timedelta = None,
-                 decimal_as_string: bool = False, datetime_as_timestamp: bool = False):
+                 decimal_as_string: bool = False, datetime_as_timestamp: bool = False,
+                 decimal_as_integer: bool = False, odds_precision: int = 2, stake_precision: int = 2,
+                 datetime_as_nanoseconds: bool = False, market_index: Optional[MarketIndex] = None,
+                 template_max_prices: int = 8, as_record: bool = False):
         """Class to follow GBEi protocol. Responsible for encoding and parsing data.
         :param punter_id: <virtual-punter-id> assigned to account by GBEi
         :param punter_session_key: <virtual-punter-session-key> assigned to account by GBEi
@@ -31,6 +36,20 @@ class GBEiRequestEncoder(object):
         :param default_expire_timeout: default time for commands expiration time, set with `expire_at` parameter
         :param decimal_as_string: should decimals be represented as strings. Decimal is used otherwise.
         :param datetime_as_timestamp: should datetime objects be represented as floats. Datetime is used otherwise.
+        :param decimal_as_integer: should decimals be represented as scaled integers (fixed point).
+                                   Decoded values with more decimal places than precision are truncated toward zero.
+                                   Takes priority over `decimal_as_string`
+        :param odds_precision: number of decimal places kept in integer odds, e.g. 2 means hundredths
+        :param stake_precision: number of decimal places kept in integer money amounts (minor currency units)
+        :param datetime_as_nanoseconds: should datetime objects be represented as integer nanoseconds since epoch.
+                                        Takes priority over `datetime_as_timestamp`
+        :param market_index: AAPI fed index to fill missing (None) expected selection reset count and
+                             withdrawal sequence number of added prices with, when message is encoded by `dumps`.
+                             Queued messages are encoded when written, so they get the values known at that time
+        :param template_max_prices: max number of prices in AddLightweightPrices and CancelLightweightPrices
+                                    messages, encoded by `dumps` with prebuilt templates. 0 disables templates
+        :param as_record: should responses be parsed to `__slots__` records (with attribute and item access)
+                          instead of dicts. Protocol and envelope headers are shared between parsed messages then
         """
         self.version = version
         self.punter_id = punter_id
@@ -45,9 +64,16 @@ class GBEiRequestEncoder(object):
         else:
             self.source = str(punter_id)
 
-        self._assign_field_parameters(decimal_as_string, datetime_as_timestamp, Envelope.body_mapping)
-
+        self.odds_precision = odds_precision if decimal_as_integer else None
+        self.stake_precision = stake_precision if decimal_as_integer else None
+        self.datetime_as_nanoseconds = datetime_as_nanoseconds
+        self.market_index = market_index if market_index is not None else MarketIndex()
+        self.as_record = as_record
         self.e = Envelope()
+        self.e.as_record = as_record
+        self._assign_field_parameters(decimal_as_string, datetime_as_timestamp, self.e.body_mapping)
+        self.template_max_prices = template_max_prices
+        self._templates: Dict[Tuple[str, int], MessageTemplate] = {}  # (message type, number of prices): template
         self.protocol_header = {'version': self.version}
         self.envelope_header = {'version': self.version, 'item_count': 2}
         self.message_base_fields = {
@@ -63,10 +89,13 @@ class GBEiRequestEncoder(object):
     def _check_field(self, f, decimal_as_string, datetime_as_timestamp):
         if isinstance(f, DateTime):
             f.as_timestamp = datetime_as_timestamp
+            f.as_nanoseconds = self.datetime_as_nanoseconds
         elif isinstance(f, Decimal):
             f.as_string = decimal_as_string
+            f.precision = self.odds_precision
         elif isinstance(f, MoneyAmount):
             f.decimal.as_string = decimal_as_string
+            f.decimal.precision = self.stake_precision
         elif isinstance(f, Opt):
             self._check_field(f.field, decimal_as_string, datetime_as_timestamp)
         elif isinstance(f, Array):
@@ -88,12 +117,27 @@ class GBEiRequestEncoder(object):
 
     def _get_expire_at(self, ts: Optional[float] = None) -> float:
         if ts is None:
-            ts = time.time() + self.expire_timeout
+            if self.datetime_as_nanoseconds:
+                ts = time.time_ns() + int(self.expire_timeout * 1e9)
+            else:
+                ts = time.time() + self.expire_timeout
         return ts
 
     def _get_command_time(self) -> float:
+        if self.datetime_as_nanoseconds:
+            return time.time_ns()
         return time.time()
 
+    def _fill_envelope(self, envelope: dict) -> dict:
+        """Add prices envelope with expected values, missing in prices, taken from `market_index`.
+        Given envelope and its prices are not changed, copy is returned if anything is filled
+        """
+        prices = envelope['message']['prices']
+        if all(is_filled(price) for price in prices):
+            return envelope
+        message = dict(envelope['message'], prices=[self.market_index.fill(price) for price in prices])
+        return dict(envelope, message=message)
+
     def _get_envelop(self, message_header: dict, message_body: dict) -> dict:
         message_body.update(command_time=self._get_command_time(), **self.message_base_fields)
         return {
@@ -104,8 +148,8 @@ class GBEiRequestEncoder(object):
         }
 
     def add_lightweight_price(self, selection_id: int, market_id: int, polarity: int, odds: str,
-                              delta_stake: str, expire_price_at: float, expected_selection_reset_count: int,
-                              expected_withdrawal_sequence_number: int, punter_reference_number: int,
+                              delta_stake: str, expire_price_at: float, expected_selection_reset_count: Optional[int],
+                              expected_withdrawal_sequence_number: Optional[int], punter_reference_number: int,
                               expire_at: Optional[float] = None) -> bytes:
         """Add lightweight price for specified selection.
         If given lightweight price already exists (combination of selection, polarity, odds, reference number),
@@ -118,8 +162,10 @@ class GBEiRequestEncoder(object):
         :param delta_stake: stake to add to given lightweight price
         :param expire_price_at: every price has an expiry time; value in the past has the effect of cancelling the price
                                 if price is not matched until this time, it will never be matched
-        :param expected_selection_reset_count: selection reset count value, used to avoid data collision
-        :param expected_withdrawal_sequence_number: market withdraw. seq. number, used to avoid data collision
+        :param expected_selection_reset_count: selection reset count value, used to avoid data collision.
+                                               None means latest value from `market_index` (or 0)
+        :param expected_withdrawal_sequence_number: market withdraw. seq. number, used to avoid data collision.
+                                                    None means latest value from `market_index` (or 0)
         :param punter_reference_number: unique request reference number, specified by user
         :param expire_at: time, when command will be considered as expired and so cancelled
         """
@@ -138,12 +184,13 @@ class GBEiRequestEncoder(object):
             }],
             'expire_at': self._get_expire_at(expire_at)
         }
-        envelope = self._get_envelop(message_header, message_body)
+        envelope = self._fill_envelope(self._get_envelop(message_header, message_body))
         result = self.e.dumps(envelope)
         return result
 
     def add_lightweight_prices(self, prices: List[dict], expire_at: Optional[float] = None) -> dict:
         """Add multiple lightweight prices in single request.
+        Missing expected values are filled from `market_index` by `dumps`, prices are not changed.
         For detailed description see `add_lightweight_price` method"""
         message_header = self._get_message_header(GBEiMessageType.addLightweightPrices.value)
         message_body = {
@@ -294,6 +341,28 @@ class GBEiRequestEncoder(object):
         result = self.e.dumps(envelope)
         return result
 
+    def dumps(self, envelope: dict) -> bytes:
+        """Envelope bytes. Messages with a few prices are written into template of the same message type
+        and number of prices, built on first such message, patching field values in place.
+        Missing expected values of added prices are filled from `market_index`
+        """
+        message_type = envelope['message_header']['type']
+        if message_type == GBEiMessageType.addLightweightPrices.value:
+            envelope = self._fill_envelope(envelope)
+        if message_type not in TEMPLATE_TYPES:
+            return self.e.dumps(envelope)
+        count = len(envelope['message']['prices'])
+        if not 0 < count <= self.template_max_prices:
+            return self.e.dumps(envelope)
+        key = (message_type, count)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = MessageTemplate(self.e, envelope)
+            return bytes(template.buffer)
+        if not template.matches(envelope):
+            return self.e.dumps(envelope)
+        return template.render(envelope['message'])
+
     def keep_alive(self) -> bytes:
         """Generate empty request to keep connection alive.
         It differs from ping request in that server will not respond to this request
@@ -301,15 +370,18 @@ class GBEiRequestEncoder(object):
         """
         return b'\x00'
 
-    def parse_response(self, response: bytes) -> Optional[Tuple[dict, memoryview]]:
+    def parse_response(self, response: bytes, consumer: Callable[[dict, Any], bool] = None
+                       ) -> Optional[Tuple[dict, memoryview]]:
         """Parse response, generated by the server.
         Response can be of the following formats:
          LightweightPriceSummary - information about single currently active lightweight price
          LWPChangeNotification - whenever any of active prices state is changed (matched or cancelled etc)
          PingResponse - response to Ping request (`ping` method)
          ResetOccurred - reset occurred and all lightweight prices have been cancelled, so user should resubmit all
+        :param consumer: callback, which gets items of message arrays (e.g. prices) as soon as they are decoded,
+                         with the message fields decoded so far. Items, it returns True for, are not kept in message
         """
-        return self.e.loads(response)
+        return self.e.loads(response, consumer)
 
 
 if __name__ == '__main__':
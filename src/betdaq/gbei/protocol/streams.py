@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import deque
+from logging import getLogger
+from typing import Callable, Deque, Iterable, Optional, Set, Tuple
+
+
+L = getLogger(__name__)
+
+
+class NotificationStream(object):
+
+    def __init__(self, types: Optional[Iterable[str]] = None, maxsize: int = 10000,
+                 on_close: Optional[Callable[['NotificationStream'], None]] = None):
+        """Bounded queue of received messages, consumed with `async for`. Messages are filtered by type
+        when dispatched, so consumer never wakes up for messages it's not interested in.
+        If consumer falls behind by more than `maxsize` messages, the oldest ones are dropped.
+        Iteration stops when connection is lost or stream is closed.
+        :param types: GBEi message types to receive, all messages if not set
+        :param maxsize: max number of messages waiting for consumer
+        :param on_close: callback with the stream, when it's closed
+        """
+        self.types: Optional[Set[str]] = set(types) if types is not None else None
+        self.maxsize = maxsize
+        self._on_close = on_close
+        self._queue: Deque[Tuple[float, dict]] = deque()  # (perf_counter when received, parsed message)
+        self._waiter: Optional[asyncio.Future] = None
+        self.closed = False
+        self.received = 0  # number of messages put to the stream
+        self.dropped = 0  # number of messages dropped because of `maxsize`
+        self.max_lag = 0  # max number of messages waiting for consumer
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, parsed: dict, now: Optional[float] = None):
+        if self.closed or (self.types is not None and parsed['message_header']['type'] not in self.types):
+            return
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            queue.popleft()
+            self.dropped += 1
+            if self.dropped == 1:
+                L.warning('Notification stream consumer is %s messages behind, dropping the oldest', self.maxsize)
+        queue.append((time.perf_counter() if now is None else now, parsed))
+        self.received += 1
+        if len(queue) > self.max_lag:
+            self.max_lag = len(queue)
+        self._wakeup()
+
+    def close(self):
+        """Stop iteration once queued messages are consumed"""
+        if self.closed:
+            return
+        self.closed = True
+        self._wakeup()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._queue.popleft()[1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def stats(self) -> dict:
+        """How far consumer has fallen behind"""
+        return {
+            'lag': len(self._queue),
+            'lag_seconds': time.perf_counter() - self._queue[0][0] if self._queue else 0.,
+            'max_lag': self.max_lag,
+            'received': self.received,
+            'dropped': self.dropped,
+            'closed': self.closed,
+        }
@@ -0,0 +1,86 @@
+from logging import getLogger
+from typing import List, Tuple
+
+from .enums import GBEiMessageType
+from .fields import Array, BaseField
+from .items import Envelope, Meta, length
+
+
+L = getLogger(__name__)
+TEMPLATE_TYPES = frozenset((GBEiMessageType.addLightweightPrices.value,
+                            GBEiMessageType.cancelLightweightPrices.value))
+
+
+def check_fixed(name: str, field: BaseField):
+    if field.size is None:
+        raise TypeError('Field %s is not of fixed size' % name)
+
+
+class MessageTemplate(object):
+
+    def __init__(self, envelope: Envelope, data: dict):
+        """Prebuilt bytes of message with `prices` array, made from the given envelope, with offsets of all
+        message body and price fields. Every field of the body (except array length) and of the prices
+        has fixed size, so messages of the same type, header and number of prices differ only in field values,
+        which are written in place with `pack_into` instead of serializing the whole envelope.
+        :param envelope: envelope serializer
+        :param data: envelope with at least one price, to build the template from
+        """
+        self.message_header = data['message_header']
+        message = data['message']
+        body = envelope.body_mapping[self.message_header['type']]
+        self.count = len(message['prices'])
+        if not self.count:
+            raise ValueError('Template requires at least one price')
+        self.fields: List[Tuple[str, BaseField, int]] = []  # body fields: (name, field, offset)
+        self.price_fields: List[Tuple[str, BaseField, int]] = []  # price fields: (name, field, offset in price)
+        self.prices_offset = 0
+        self.price_size = 0
+        parts = []
+        offset = 0
+        for name, field in getattr(body, Meta.fields_key).items():
+            value = message[name]
+            if isinstance(field, Array):
+                dumped = field.len.dumps(len(value))
+                self.prices_offset = offset + len(dumped)
+                for price_name, price_field in getattr(field.field, Meta.fields_key).items():
+                    check_fixed(price_name, price_field)
+                    self.price_fields.append((price_name, price_field, self.price_size))
+                    self.price_size += price_field.size
+                dumped += b''.join(field.field.dumps(_) for _ in value)
+            else:
+                check_fixed(name, field)
+                self.fields.append((name, field, offset))
+                dumped = field.dumps(value)
+            parts.append(dumped)
+            offset += len(dumped)
+        message_bts = b''.join(parts)
+        head = b''.join((envelope.protocol_header.dumps(data['protocol_header']),
+                         envelope.envelope_header.dumps(data['envelope_header']),
+                         envelope.message_header.dumps(self.message_header),
+                         length.dumps(len(message_bts))))
+        self.buffer = bytearray(head + message_bts)
+        shift = len(head)
+        self.fields = [(name, field, offset + shift) for name, field, offset in self.fields]
+        self.prices_offset += shift
+
+    def matches(self, data: dict) -> bool:
+        return len(data['message']['prices']) == self.count and data['message_header'] == self.message_header
+
+    def render(self, message: dict) -> bytes:
+        """Write values of the message into template
+        :param message: message body with the same number of prices as template
+        :return: copy of the patched template, so it can be reused right away
+        """
+        buffer = self.buffer
+        try:
+            for name, field, offset in self.fields:
+                field.pack_into(buffer, offset, message[name])
+            offset = self.prices_offset
+            for price in message['prices']:
+                for name, field, field_offset in self.price_fields:
+                    field.pack_into(buffer, offset + field_offset, price[name])
+                offset += self.price_size
+        except KeyError as e:
+            raise ValueError('Missing required field %s' % e.args[0])
+        return bytes(buffer)
@@ -0,0 +1,98 @@
+import asyncio
+import math
+import time
+from logging import getLogger
+from typing import Callable, List, Optional
+
+
+L = getLogger(__name__)
+
+
+class Timer(object):
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick: int, callback: Callable, args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+
+    def __init__(self, resolution: float = 0.05, slots: int = 1024, clock: Callable[[], float] = time.time):
+        """Hashed timer wheel: many timers served by single event loop timer, which runs only while any timer
+        is scheduled. Timer of time `at` is stored in slot `tick % slots`, where `tick = ceil(at / resolution)`,
+        so scheduling and cancelling are O(1), and every tick visits single slot.
+        Timers fire not earlier than scheduled, and no later than `resolution` after it.
+        :param resolution: duration (in seconds) of single tick
+        :param slots: number of slots. Timers further than `slots * resolution` wait for several wheel rotations
+        :param clock: source of time, timers are scheduled in. Seconds since epoch by default,
+                      to schedule timers at price expiry times
+        """
+        self.resolution = resolution
+        self.clock = clock
+        self._slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self._tick = self._now_tick()  # last processed tick
+        self._count = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self):
+        return self._count
+
+    def _now_tick(self) -> int:
+        return math.floor(self.clock() / self.resolution)
+
+    def schedule(self, at: float, callback: Callable, *args) -> Timer:
+        """Call `callback(*args)` at given time (of wheel clock)
+        :return: timer, which can be cancelled
+        """
+        if not self._count:
+            self._tick = self._now_tick()
+        timer = Timer(max(math.ceil(at / self.resolution), self._tick + 1), callback, args)
+        self._slots[timer.tick % len(self._slots)].append(timer)
+        self._count += 1
+        if self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.resolution, self.advance)
+        return timer
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        return self.schedule(self.clock() + delay, callback, *args)
+
+    def advance(self):
+        """Fire due timers. Called by event loop every tick while any timer is scheduled,
+        can be called directly, when wheel clock is driven manually"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        now = self._now_tick()
+        slots = self._slots
+        due = []
+        first = max(self._tick + 1, now - len(slots) + 1)  # after full rotation every slot is visited anyway
+        for tick in range(first, now + 1):
+            slot = slots[tick % len(slots)]
+            if slot and any(_.tick <= now or _.cancelled for _ in slot):
+                due.extend(_ for _ in slot if _.tick <= now or _.cancelled)
+                slot[:] = [_ for _ in slot if _.tick > now and not _.cancelled]
+        self._count -= len(due)
+        self._tick = now
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                L.exception('Timer callback %s failed', getattr(timer.callback, '__name__', 'empty'))
+        if self._count and self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.resolution, self.advance)
+
+    def clear(self):
+        for slot in self._slots:
+            slot.clear()
+        self._count = 0
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
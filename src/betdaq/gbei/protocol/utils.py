@@ -0,0 +1,11 @@
+from decimal import Decimal as DecimalNative
+
+
+def price_key(price: dict) -> tuple:
+    """Combination of fields identifying single lightweight price on GBEi side.
+    String odds are compared as decimals, as GBEi sends them normalized, e.g. `'2'` for price added with `'2.0'`
+    """
+    odds = price['odds']
+    if odds.__class__ is str:
+        odds = DecimalNative(odds)
+    return price['selection_id'], price['polarity'], odds, price['punter_reference_number']
@@ -0,0 +1,74 @@
+"""Variable length integers of GBEi binary format, 7 bits per byte, highest bit set on all bytes but the last.
+Lengths of frames and arrays are written from the most significant group (`msb`),
+lengths of strings from the least significant one (`lsb`)
+"""
+from functools import lru_cache
+from typing import Tuple
+
+
+SMALL = tuple(bytes((_,)) for _ in range(128))  # encoded values below 128, same in both orders
+MAX_BYTES = 10
+
+
+def encode_msb(value: int) -> bytes:
+    if value < 128:
+        return SMALL[value]
+    parts = [value & 127]
+    value >>= 7
+    while value:
+        parts.append((value & 127) | 128)
+        value >>= 7
+    parts.reverse()
+    return bytes(parts)
+
+
+def decode_msb(bts, offset: int = 0) -> Tuple[int, int]:
+    """Decode value starting at offset
+    :return: value and offset right after it
+    """
+    b = bts[offset]
+    if b < 128:
+        return b, offset + 1
+    value = b & 127
+    for offset in range(offset + 1, offset + MAX_BYTES):
+        b = bts[offset]
+        value = (value << 7) | (b & 127)
+        if b < 128:
+            break
+    return value, offset + 1
+
+
+def encode_lsb(value: int) -> bytes:
+    if value < 128:
+        return SMALL[value]
+    parts = []
+    while value > 127:
+        parts.append((value & 127) | 128)
+        value >>= 7
+    parts.append(value)
+    return bytes(parts)
+
+
+def decode_lsb(bts, offset: int = 0) -> Tuple[int, int]:
+    """Decode value starting at offset
+    :return: value and offset right after it
+    """
+    b = bts[offset]
+    if b < 128:
+        return b, offset + 1
+    value = b & 127
+    shift = 7
+    for offset in range(offset + 1, offset + MAX_BYTES):
+        b = bts[offset]
+        value |= (b & 127) << shift
+        if b < 128:
+            break
+        shift += 7
+    return value, offset + 1
+
+
+@lru_cache(maxsize=1024)
+def encode_string(value: str) -> bytes:
+    """String with its length prefix. Cached, as the same header strings and currency are sent in every message"""
+    value = value.encode('utf-8')
+    return encode_lsb(len(value)) + value
@@ -0,0 +1,179 @@
+from itertools import count
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
+
+from .batcher import LightweightPriceBatcher
+from .book import LightweightPriceBook, as_number
+from .protocol.enums import LWPActionType, GBEiMessageType
+from .protocol.utils import price_key
+
+
+L = getLogger(__name__)
+Quote = Tuple[int, Any, Any]  # polarity, odds, stake
+
+
+class QuotingEngine(object):
+
+    def __init__(self, book: LightweightPriceBook, batcher: LightweightPriceBatcher,
+                 reference_numbers: Iterator[int] = None):
+        """Keeps lightweight prices on GBEi in line with desired quotes, sending only the difference:
+        stake deltas (positive or negative) for existing prices, adds for new ones and cancels for unwanted ones.
+        Prices sent but not yet acknowledged by GBEi are tracked, so repeated quoting doesn't send them twice.
+        Adds, which are never written to GBEi, are released with `on_dropped`.
+        :param book: book of current lightweight prices, should be kept up to date by protocol notifications
+        :param batcher: batcher to send price adds and cancels with, adds it drops are passed to `on_dropped`
+        :param reference_numbers: iterator of punter reference numbers for new prices
+        """
+        self.book = book
+        self.batcher = batcher
+        self._references = reference_numbers or count(1)
+        self._quotes: Dict[int, dict] = {}  # selection_id: desired quotes with price parameters
+        self._pending: Dict[int, Dict[tuple, dict]] = {}  # selection_id: price key: expected state
+        batcher.on_drop = self.on_dropped
+
+    def set_quotes(self, market_id: int, selection_id: int, quotes: Iterable[Quote], expire_price_at: Any,
+                   expected_selection_reset_count: Optional[int] = None,
+                   expected_withdrawal_sequence_number: Optional[int] = None) -> int:
+        """Set desired quotes for selection and send the changes.
+        :param market_id: ID of selection market
+        :param selection_id: ID of selection to quote
+        :param quotes: desired (polarity, odds, stake) combinations. Absent or zero stake odds will be cancelled
+        :param expire_price_at: expiry time of added prices, see `GBEiRequestEncoder.add_lightweight_price`
+        :param expected_selection_reset_count: selection reset count value, used to avoid data collision.
+                                               None means the latest value of encoder `market_index` when written
+        :param expected_withdrawal_sequence_number: market withdraw. seq. number, used to avoid data collision.
+                                                    None means the latest value of encoder `market_index` when written
+        :return: number of sent price changes
+        """
+        self._quotes[selection_id] = {
+            'market_id': market_id,
+            'quotes': list(quotes),
+            'expire_price_at': expire_price_at,
+            'expected_selection_reset_count': expected_selection_reset_count,
+            'expected_withdrawal_sequence_number': expected_withdrawal_sequence_number,
+        }
+        return self.requote(selection_id)
+
+    def is_quoted(self, selection_id: int) -> bool:
+        return selection_id in self._quotes
+
+    def remove_quotes(self, selection_id: int) -> int:
+        """Cancel all quotes of selection and stop tracking it"""
+        quotes = self._quotes.get(selection_id)
+        if quotes is None:
+            return 0
+        quotes['quotes'] = []
+        sent = self.requote(selection_id)
+        del self._quotes[selection_id]
+        return sent
+
+    def _get_current(self, selection_id: int) -> Dict[tuple, Tuple[dict, Any]]:
+        """Current state of selection prices: price key: (price, remaining stake), including unacknowledged ones"""
+        current = {price_key(_): (_, as_number(_['remaining_stake'])) for _ in self.book.selection_prices(selection_id)}
+        for key, pending in self._pending.get(selection_id, {}).items():
+            if pending['remaining']:
+                current[key] = (pending['price'], pending['remaining'])
+            else:
+                current.pop(key, None)
+        return current
+
+    def _set_pending(self, price: dict, remaining: Any):
+        pending = self._pending.setdefault(price['selection_id'], {})
+        state = pending.setdefault(price_key(price), {'price': price, 'inflight': 0})
+        state['remaining'] = remaining
+        state['inflight'] += 1
+
+    def requote(self, selection_id: int) -> int:
+        """Send the difference between desired quotes and current prices of selection"""
+        params = self._quotes.get(selection_id)
+        if params is None:
+            return 0
+        levels: Dict[tuple, Tuple[dict, Any]] = {}  # (polarity, odds): (price, remaining stake)
+        to_cancel = []
+        for key, (price, remaining) in self._get_current(selection_id).items():
+            level = (price['polarity'], as_number(price['odds']))
+            if level in levels:  # more than one price on the same odds, keep only one of them
+                to_cancel.append(price)
+            else:
+                levels[level] = (price, remaining)
+        to_add = []
+        for polarity, odds, stake in params['quotes']:
+            level = (polarity, as_number(odds))
+            price, remaining = levels.pop(level, (None, 0))
+            if not as_number(stake):
+                if price is not None:
+                    to_cancel.append(price)
+                continue
+            delta = as_number(stake) - remaining
+            if not delta:
+                continue
+            if price is None:
+                price = {'selection_id': selection_id, 'market_id': params['market_id'], 'polarity': polarity,
+                         'odds': odds, 'punter_reference_number': next(self._references)}
+            to_add.append((price, delta if not isinstance(stake, str) else str(delta), remaining + delta))
+        to_cancel.extend(price for price, _ in levels.values())
+
+        for price in to_cancel:
+            self.batcher.cancel({'selection_id': price['selection_id'], 'market_id': params['market_id'],
+                                 'polarity': price['polarity'], 'odds': price['odds'],
+                                 'punter_reference_number': price['punter_reference_number']})
+            self._set_pending(price, 0)
+        for price, delta, remaining in to_add:
+            self.batcher.add({
+                'selection_id': selection_id,
+                'market_id': params['market_id'],
+                'polarity': price['polarity'],
+                'odds': price['odds'],
+                'delta_stake': delta,
+                'expire_price_at': params['expire_price_at'],
+                'expected_selection_reset_count': params['expected_selection_reset_count'],
+                'expected_withdrawal_sequence_number': params['expected_withdrawal_sequence_number'],
+                'punter_reference_number': price['punter_reference_number']
+            })
+            self._set_pending(price, remaining)
+        return len(to_cancel) + len(to_add)
+
+    def requote_all(self) -> int:
+        """Send the difference between desired quotes and current prices of all quoted selections"""
+        return sum(self.requote(_) for _ in list(self._quotes))
+
+    def reset_pending(self):
+        """Forget prices sent, but not acknowledged yet, e.g. when they can't be acknowledged anymore"""
+        self._pending.clear()
+
+    def _release(self, price: dict):
+        """Sent change of the price is acknowledged or won't be sent anymore"""
+        pending = self._pending.get(price['selection_id'])
+        key = price_key(price)
+        if not pending or key not in pending:
+            return
+        state = pending[key]
+        state['inflight'] -= 1
+        if state['inflight'] <= 0:
+            del pending[key]
+            if not pending:
+                del self._pending[price['selection_id']]
+
+    def _on_change_notification(self, price: dict):
+        if price['lwp_action_type'] == LWPActionType.Matched.value:
+            state = self._pending.get(price['selection_id'], {}).get(price_key(price))
+            if state is not None and state['remaining'] and price.get('matched_stake') is not None:
+                state['remaining'] -= as_number(price['matched_stake'])
+            return
+        self._release(price)
+
+    def on_dropped(self, prices: List[dict]):
+        """Callback for adds, which won't be sent to GBEi, so they are never acknowledged.
+        Set as batcher `on_drop`, should be registered for `ProtocolEvents.prices_dropped` event as well"""
+        for price in prices:
+            self._release(price)
+
+    def on_message(self, parsed: dict):
+        """Callback for `ProtocolEvents.data_received` event to track acknowledgement of sent prices.
+        Should be registered after the book callback"""
+        message_type = parsed['message_header']['type']
+        if message_type == GBEiMessageType.LWPChangeNotification.value:
+            for price in parsed['message']['prices']:
+                self._on_change_notification(price)
+        elif message_type == GBEiMessageType.resetOccurred.value:
+            self.reset_pending()
@@ -0,0 +1,115 @@
+import struct
+from logging import getLogger
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+
+L = getLogger(__name__)
+COUNTER = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+HEAD_OFFSET = 0  # total number of bytes written, updated by producer only
+TAIL_OFFSET = 64  # total number of bytes read, updated by consumer only, on its own cache line
+CAPACITY_OFFSET = 8
+DATA_OFFSET = 128
+WRAP = 0xFFFFFFFF  # record length marking that the rest of the buffer is skipped
+
+
+def attach(name: str) -> SharedMemory:
+    """Attach to existing shared memory without registering it in resource tracker,
+    which would remove the block on exit of attached process (`track=False` of Python 3.13)
+    """
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedRing(object):
+
+    def __init__(self, name: str, capacity: int = 1024 * 1024, create: bool = False):
+        """Lock-free single producer single consumer queue of byte records in shared memory.
+        Producer only moves the head and consumer only moves the tail, so no locks are needed.
+        Records never wrap around the end of the buffer, the rest of the buffer is skipped instead.
+        Record is 4 bytes length and the bytes.
+        :param name: name of shared memory block
+        :param capacity: size (in bytes) of records buffer, when ring is created
+        :param create: should shared memory be created, or attached to existing one
+        """
+        self.name = name
+        if create:
+            self._shm = SharedMemory(name, create=True, size=DATA_OFFSET + capacity)
+            self._shm.buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+            COUNTER.pack_into(self._shm.buf, CAPACITY_OFFSET, capacity)
+        else:
+            self._shm = attach(name)
+        self._created = create
+        self._buf = self._shm.buf
+        self.capacity = COUNTER.unpack_from(self._buf, CAPACITY_OFFSET)[0]
+        self._head = COUNTER.unpack_from(self._buf, HEAD_OFFSET)[0]
+        self._tail = COUNTER.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    def __len__(self):
+        """Number of bytes waiting for consumer"""
+        return COUNTER.unpack_from(self._buf, HEAD_OFFSET)[0] - COUNTER.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    def put(self, data: bytes) -> bool:
+        """Write record, to be called by producer only
+        :return: False if there is no space for it
+        """
+        buf = self._buf
+        capacity = self.capacity
+        head = self._head
+        size = LENGTH.size + len(data)
+        offset = head % capacity
+        rest = capacity - offset
+        skip = rest if size > rest else 0
+        if size + skip > capacity - (head - COUNTER.unpack_from(buf, TAIL_OFFSET)[0]):
+            return False
+        if skip:
+            if rest >= LENGTH.size:
+                LENGTH.pack_into(buf, DATA_OFFSET + offset, WRAP)
+            head += skip
+            offset = 0
+        start = DATA_OFFSET + offset
+        LENGTH.pack_into(buf, start, len(data))
+        buf[start + LENGTH.size:start + size] = data
+        self._head = head + size
+        COUNTER.pack_into(buf, HEAD_OFFSET, self._head)  # publish the record
+        return True
+
+    def get(self) -> Optional[bytes]:
+        """Read record, to be called by consumer only
+        :return: None if there are no records
+        """
+        buf = self._buf
+        tail = self._tail
+        if tail == COUNTER.unpack_from(buf, HEAD_OFFSET)[0]:
+            return None
+        capacity = self.capacity
+        offset = tail % capacity
+        rest = capacity - offset
+        if rest < LENGTH.size or LENGTH.unpack_from(buf, DATA_OFFSET + offset)[0] == WRAP:
+            tail += rest
+            offset = 0
+        start = DATA_OFFSET + offset + LENGTH.size
+        length = LENGTH.unpack_from(buf, DATA_OFFSET + offset)[0]
+        data = bytes(buf[start:start + length])
+        self._tail = tail + LENGTH.size + length
+        COUNTER.pack_into(buf, TAIL_OFFSET, self._tail)  # release the space
+        return data
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._buf = None
+        self._shm.close()
+        if self._created:
+            self._shm.unlink()
+        self._shm = None
@@ -0,0 +1,164 @@
+import asyncio
+from logging import getLogger
+from typing import Optional, Callable, Awaitable
+
+from .batcher import LightweightPriceBatcher
+from .book import LightweightPriceBook
+from .quoting import QuotingEngine
+from .protocol import GBEiProtocol, ProtocolEvents, GBEiMessageType
+from ..aapi.utils import on_future_task_callback
+
+
+L = getLogger(__name__)
+
+
+class GBEiSupervisor(object):
+
+    def __init__(self, book: LightweightPriceBook, engine: QuotingEngine, batcher: LightweightPriceBatcher,
+                 connect: Callable[..., Awaitable[GBEiProtocol]] = None, min_backoff: float = 0.5,
+                 max_backoff: float = 30, backoff_factor: float = 2, query_timeout: float = 30,
+                 cancel_unknown: bool = True, stream_snapshot: bool = False):
+        """Keeps connection to GBEi alive and restores lightweight prices state after reconnect or reset.
+        After connecting, active prices are queried from GBEi, the book is replaced with them
+        and quoting engine sends only the difference with desired quotes. Failed query is retried with backoff,
+        while the connection is alive.
+        :param book: book of current lightweight prices
+        :param engine: quoting engine, holding desired quotes
+        :param batcher: batcher used by quoting engine, switched to new protocol on every reconnect
+        :param connect: coroutine function creating connected protocol, with `GBEiProtocol.create` signature.
+                        Callbacks of `existing_protocol` are expected to be copied to the new one
+        :param min_backoff: pause (in seconds) before first reconnection attempt
+        :param max_backoff: max pause (in seconds) between reconnection attempts
+        :param backoff_factor: pause multiplier for every next failed attempt
+        :param query_timeout: time (in seconds) to wait for active prices query
+        :param cancel_unknown: should active prices on selections, which are not quoted by engine, be cancelled
+        :param stream_snapshot: should active prices be put to a new book as soon as they are decoded, instead of
+                                collecting all of them first, to keep memory bounded on large snapshots.
+                                The book is replaced with the new one only when the query completes
+        """
+        self.book = book
+        self.engine = engine
+        self.batcher = batcher
+        self.protocol: Optional[GBEiProtocol] = None
+        self._connect = connect or GBEiProtocol.create
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff_factor = backoff_factor
+        self.query_timeout = query_timeout
+        self.cancel_unknown = cancel_unknown
+        self.stream_snapshot = stream_snapshot
+        self._stopped = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._staging: Optional[LightweightPriceBook] = None  # book filled from streamed snapshot
+
+    def _on_connection_lost(self, exc: Optional[Exception]):
+        self._disconnected.set()
+
+    def _on_message(self, parsed: dict):
+        if self._staging is not None:  # changes during the query apply to the snapshot as well
+            self._staging.on_message(parsed)
+        if parsed['message_header']['type'] == GBEiMessageType.resetOccurred.value:
+            L.warning('Reset occurred on GBEi, reconciling lightweight prices')
+            self._schedule_reconcile()
+
+    def _schedule_reconcile(self):
+        if self._reconcile_task is not None and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+        self._reconcile_task = asyncio.get_running_loop().create_task(self._reconcile_with_retries())
+        self._reconcile_task.add_done_callback(on_future_task_callback)
+
+    def _register_callbacks(self, protocol: GBEiProtocol):
+        protocol.add_callback(ProtocolEvents.data_received, self.book.on_message)
+        protocol.add_callback(ProtocolEvents.data_received, self.engine.on_message)
+        protocol.add_callback(ProtocolEvents.data_received, self._on_message)
+        protocol.add_callback(ProtocolEvents.prices_dropped, self.engine.on_dropped)
+        protocol.add_callback(ProtocolEvents.connection_lost, self._on_connection_lost)
+
+    async def reconcile(self) -> int:
+        """Sync the book with active prices on GBEi and send the difference with desired quotes
+        :return: number of sent price changes
+        """
+        if self.stream_snapshot:
+            unknown = []
+            staging = LightweightPriceBook()
+
+            def consume(price: dict):
+                staging.upsert(price)
+                if self.cancel_unknown and not self.engine.is_quoted(price['selection_id']):
+                    unknown.append(price)
+            self._staging = staging
+            try:
+                active = await self.protocol.query_all(timeout=self.query_timeout, consumer=consume)
+            finally:
+                if self._staging is staging:
+                    self._staging = None
+            self.book.take(staging)
+        else:
+            snapshot = await self.protocol.query_all(timeout=self.query_timeout)
+            self.book.replace(snapshot)
+            active = len(snapshot)
+            unknown = [_ for _ in snapshot if self.cancel_unknown and not self.engine.is_quoted(_['selection_id'])]
+        self.engine.reset_pending()
+        sent = self.engine.requote_all()
+        for price in unknown:
+            self.batcher.cancel({'selection_id': price['selection_id'], 'market_id': price['market_id'],
+                                 'polarity': price['polarity'], 'odds': price['odds'],
+                                 'punter_reference_number': price['punter_reference_number']})
+            sent += 1
+        L.info('Reconciled %s active lightweight prices, sent %s changes', active, sent)
+        return sent
+
+    async def _reconcile_with_retries(self):
+        """Reconcile, retrying with backoff till it succeeds, connection is lost or `stop` is called"""
+        backoff = self.min_backoff
+        while not self._disconnected.is_set():
+            try:
+                await self.reconcile()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                L.warning('Failed to reconcile lightweight prices, retrying in %s seconds', backoff, exc_info=True)
+            await self._sleep(backoff, self._disconnected)
+            backoff = min(backoff * self.backoff_factor, self.max_backoff)
+
+    async def _sleep(self, delay: float, event: Optional[asyncio.Event] = None):
+        """Pause, interrupted by `stop` or given event"""
+        try:
+            await asyncio.wait_for((event or self._stopped).wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """Connect to GBEi and reconnect whenever connection is lost, till `stop` is called"""
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            try:
+                protocol = await self._connect(existing_protocol=self.protocol)
+            except Exception:
+                L.warning('Failed to connect to GBEi, retrying in %s seconds', backoff, exc_info=True)
+                await self._sleep(backoff)
+                backoff = min(backoff * self.backoff_factor, self.max_backoff)
+                continue
+            if self.protocol is None:
+                self._register_callbacks(protocol)
+            self.protocol = protocol
+            self.batcher.protocol = protocol
+            self._disconnected.clear()
+            backoff = self.min_backoff
+            if protocol.connected:
+                await self._reconcile_with_retries()
+            await self._disconnected.wait()
+            if not self._stopped.is_set():
+                L.warning('Connection to GBEi lost, reconnecting in %s seconds', backoff)
+                await self._sleep(backoff)
+        L.info('GBEi supervisor finished')
+
+    def stop(self):
+        self._stopped.set()
+        self._disconnected.set()
+        if self._reconcile_task is not None and not self._reconcile_task.done():
+            self._reconcile_task.cancel()
+        if self.protocol is not None and self.protocol.connected:
+            self.protocol.on_stop()
@@ -1,5 +1,9 @@
+import asyncio
+
 from pytest import fixture
 
+from betdaq.gbei.protocol import GBEiRequestEncoder
+
 pytest_plugins = 'aiohttp.pytest_plugin'
 
 
@@ -10,3 +14,29 @@ def coro_mock(mocker):
             return return_value
         return mocker.Mock(wraps=coro)
     return inner
+
+
+@fixture()
+def encoder():
+    return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True, datetime_as_timestamp=True)
+
+
+@fixture()
+def lightweight_price():
+    """`LightWeightPriceToAdd` item"""
+    def inner(selection_id, market_id=1, delta_stake='10', reference=1):
+        return {'selection_id': selection_id, 'market_id': market_id, 'polarity': 1, 'odds': '2.5',
+                'delta_stake': delta_stake, 'expire_price_at': 1605801993.0, 'expected_selection_reset_count': 0,
+                'expected_withdrawal_sequence_number': 0, 'punter_reference_number': reference}
+    return inner
+
+
+@fixture()
+def wait_for():
+    """Wait till condition is true, checking it on every loop iteration"""
+    async def inner(condition, timeout=1.):
+        async def check():
+            while not condition():
+                await asyncio.sleep(0.001)
+        await asyncio.wait_for(check(), timeout)
+    return inner
@@ -319,3 +319,13 @@ def test_get_next_messages_to_send_mixed(aapi_client):
     cmd4 = commands.SetRefreshPeriod(refresh_period_ms=1000)
     aapi_client.queue_ws_command(cmd4, 1)
     assert aapi_client.get_next_messages_to_send() == [cmd1, cmd4]
+
+
+def test_notify_listeners(aapi_client, mocker):
+    failing, listener = mocker.Mock(side_effect=ValueError), mocker.Mock()
+    aapi_client.add_listener(failing)
+    aapi_client.add_listener(listener)
+    resp = topics.MExchangeInfo(head=Head(message_type=MessageType.Delta), topic_kwargs={'market_id': 1})
+    aapi_client._notify_listeners(resp, 123)
+    failing.assert_called_once_with(resp, 123)
+    listener.assert_called_once_with(resp, 123)
@@ -0,0 +1,29 @@
+from betdaq.aapi.market_index import MarketIndexListener
+from betdaq.aapi.structures import topics as t
+from betdaq.aapi.structures.enums import MessageType
+from betdaq.aapi.structures.head import Head
+from betdaq.common.market_index import MarketIndex
+
+
+def topic(cls, message_type=MessageType.Delta, **kwargs):
+    ids = {k: kwargs.pop(k) for k in ('market_id', 'selection_id') if k in kwargs}
+    result = cls(head=Head(message_type=message_type), topic_kwargs=ids)
+    for k, v in kwargs.items():
+        setattr(result, k, v)
+    return result
+
+
+def test_market_index_listener():
+    index = MarketIndex()
+    listener = MarketIndexListener(index)
+    listener.on_aapi_message(topic(t.MExchangeInfo, market_id=1, withdrawal_sequence_number=2), 0)
+    listener.on_aapi_message(topic(t.MExchangeInfo, market_id=1, number_of_selections=3), 0)
+    listener.on_aapi_message(topic(t.MExchangeInfo, market_id=2, withdrawal_sequence_number=1), 0)
+    listener.on_aapi_message(topic(t.MExchangeInfo, MessageType.Delete, market_id=2), 0)
+    listener.on_aapi_message(topic(t.SExchangeInfo, selection_id=10, selection_reset_count=1), 0)
+    listener.on_aapi_message(topic(t.SExchangeInfo, selection_id=11, selection_reset_count=4), 0)
+    listener.on_aapi_message(topic(t.SExchangeInfo, MessageType.Delete, selection_id=11), 0)
+    assert index.get_withdrawal_sequence_number(1) == 2
+    assert index.get_withdrawal_sequence_number(2) is None
+    assert index.get_selection_reset_count(10) == 1
+    assert index.get_selection_reset_count(11) is None
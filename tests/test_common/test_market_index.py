@@ -0,0 +1,19 @@
+from betdaq.common.market_index import MarketIndex, is_filled
+
+
+def test_market_index_fill():
+    index = MarketIndex()
+    index.set_withdrawal_sequence_number(1, 2)
+    index.set_selection_reset_count(10, 1)
+
+    price = {'selection_id': 10, 'market_id': 1, 'expected_selection_reset_count': None}
+    assert index.fill(price) == {'selection_id': 10, 'market_id': 1, 'expected_selection_reset_count': 1,
+                                 'expected_withdrawal_sequence_number': 2}
+    assert price == {'selection_id': 10, 'market_id': 1, 'expected_selection_reset_count': None}
+    price = {'selection_id': 11, 'market_id': 2, 'expected_selection_reset_count': 5}
+    assert index.fill(price) == {'selection_id': 11, 'market_id': 2, 'expected_selection_reset_count': 5,
+                                 'expected_withdrawal_sequence_number': 0}
+    price = {'selection_id': 11, 'market_id': 2, 'expected_selection_reset_count': 5,
+             'expected_withdrawal_sequence_number': 0}
+    assert is_filled(price)
+    assert index.fill(price) is price
@@ -0,0 +1,80 @@
+import asyncio
+
+from pytest import fixture, mark
+
+from betdaq.gbei.batcher import LightweightPriceBatcher
+
+
+def price(selection_id, odds='2.0', reference=1):
+    return {'selection_id': selection_id, 'market_id': 1, 'polarity': 1, 'odds': odds, 'delta_stake': '10',
+            'expire_price_at': 0, 'expected_selection_reset_count': 0,
+            'expected_withdrawal_sequence_number': 0, 'punter_reference_number': reference}
+
+
+@fixture()
+def protocol(mocker):
+    proto = mocker.Mock()
+    calls = []
+    proto.send_add_lightweight_prices.side_effect = lambda prices: calls.append(('add', prices))
+    proto.send_cancel_lightweight_prices.side_effect = lambda prices: calls.append(('cancel', prices))
+    proto.calls = calls
+    return proto
+
+
+@mark.asyncio
+async def test_batch_sent_at_end_of_iteration(protocol):
+    batcher = LightweightPriceBatcher(protocol)
+    batcher.add(price(1))
+    batcher.add(price(2))
+    batcher.cancel(price(3))
+    assert len(batcher) == 3
+    assert not protocol.calls
+    await asyncio.sleep(0)
+    assert protocol.calls == [('cancel', [price(3)]), ('add', [price(1), price(2)])]
+    assert len(batcher) == 0
+
+
+@mark.asyncio
+async def test_batch_sent_after_window(protocol):
+    batcher = LightweightPriceBatcher(protocol, window=0.01)
+    batcher.add(price(1))
+    await asyncio.sleep(0)
+    assert not protocol.calls
+    await asyncio.sleep(0.02)
+    assert protocol.calls == [('add', [price(1)])]
+
+
+@mark.asyncio
+async def test_batch_sent_on_max_items(protocol):
+    batcher = LightweightPriceBatcher(protocol, window=10, max_items=2)
+    batcher.cancel(price(3))
+    batcher.add(price(1))
+    batcher.add(price(2))
+    assert protocol.calls == [('cancel', [price(3)]), ('add', [price(1), price(2)])]
+    batcher.flush()
+    assert len(protocol.calls) == 2
+
+
+@mark.asyncio
+async def test_cancel_removes_pending_add(protocol, mocker):
+    on_drop = mocker.Mock()
+    batcher = LightweightPriceBatcher(protocol, on_drop=on_drop)
+    batcher.add(price(1))
+    batcher.add(price(1, odds='3.0'))
+    batcher.cancel(price(1, odds='2'))
+    batcher.flush()
+    assert protocol.calls == [('cancel', [price(1, odds='2')]), ('add', [price(1, odds='3.0')])]
+    on_drop.assert_called_once_with([price(1)])
+
+
+@mark.asyncio
+async def test_batch_dropped_when_not_connected(protocol, mocker):
+    protocol.connected = False
+    on_drop = mocker.Mock()
+    batcher = LightweightPriceBatcher(protocol, on_drop=on_drop)
+    batcher.add(price(1))
+    batcher.cancel(price(2))
+    batcher.flush()
+    assert not protocol.calls
+    assert len(batcher) == 0
+    on_drop.assert_called_once_with([price(1)])
@@ -0,0 +1,16 @@
+from pytest import mark
+
+from betdaq.gbei.benchmark import bench_codec, bench_end_to_end
+
+
+def test_bench_codec(encoder):
+    rows = bench_codec(encoder, batch_sizes=[1, 5], iterations=10)
+    assert len(rows) == 12
+    assert all(_['ns_per_call'] > 0 for _ in rows)
+
+
+@mark.asyncio
+async def test_bench_end_to_end(encoder):
+    result = await bench_end_to_end(encoder, batch_size=5, batches=3, timeout=5, fragment_size=16)
+    assert result['ack_count'] == 15
+    assert result['prices_per_second'] > 0
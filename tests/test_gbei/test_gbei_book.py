@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from pytest import fixture
+
+from betdaq.gbei.book import LightweightPriceBook
+from betdaq.gbei.protocol.enums import LWPActionType
+
+
+def notification(selection_id, polarity=1, odds='2.0', remaining_stake='10', market_id=1, reference=1,
+                 action=LWPActionType.ChangedExplicitly):
+    return {'market_id': market_id, 'selection_id': selection_id, 'polarity': polarity, 'odds': odds,
+            'punter_reference_number': reference, 'remaining_stake': remaining_stake,
+            'lwp_action_type': action.value}
+
+
+def message(message_type, **body):
+    return {'message_header': {'type': message_type}, 'message': body}
+
+
+@fixture()
+def book():
+    b = LightweightPriceBook()
+    b.on_message(message('lwpchangenotification', prices=[
+        notification(11), notification(11, polarity=0), notification(12, polarity=0),
+        notification(21, market_id=2)
+    ]))
+    return b
+
+
+def test_indexes(book):
+    assert len(book) == 4
+    assert {_['selection_id'] for _ in book.market_prices(1)} == {11, 12}
+    assert {_['selection_id'] for _ in book.market_prices(1, polarity=0)} == {11, 12}
+    assert [_['polarity'] for _ in book.selection_prices(11, polarity=1)] == [1]
+    assert len(book.selection_prices(11)) == 2
+    assert book.market_prices(3) == []
+
+
+def test_change_notification_actions(book):
+    book.on_message(message('lwpchangenotification', prices=[
+        notification(11, remaining_stake='4', action=LWPActionType.Matched),
+        notification(11, polarity=0, remaining_stake='0', action=LWPActionType.Matched),
+        notification(12, polarity=0, action=LWPActionType.Expired),
+        notification(21, market_id=2, action=LWPActionType.CancelledExplicitly),
+    ]))
+    assert len(book) == 1
+    assert book.get((11, 1, Decimal('2'), 1))['remaining_stake'] == '4'
+    assert book.market_prices(1, polarity=0) == []
+    assert book.market_prices(2) == []
+
+
+def test_summary_and_reset(book):
+    book.on_message(message('lightweightpricesummary', prices=[notification(31, market_id=3)]))
+    assert len(book.market_prices(3)) == 1
+    book.on_message(message('resetoccurred'))
+    assert len(book) == 0
+    assert book.market_prices(1) == []
+
+
+def test_replace_scope(book):
+    book.replace([notification(13, odds='3.0')], market_ids=[1])
+    assert {_['selection_id'] for _ in book.market_prices(1)} == {13}
+    assert len(book.market_prices(2)) == 1
+    book.clear(selection_ids=[21])
+    assert len(book) == 1
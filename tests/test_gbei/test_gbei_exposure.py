@@ -0,0 +1,52 @@
+from pytest import approx, fixture, mark
+
+from betdaq.gbei.exposure import ExposureAggregator
+from betdaq.gbei.protocol import LWPActionType
+
+
+def fill(selection_id, polarity, odds, stake, action=LWPActionType.Matched, market_id=1):
+    return {'message_header': {'type': 'lwpchangenotification'}, 'message': {'prices': [{
+        'market_id': market_id, 'selection_id': selection_id, 'polarity': polarity, 'odds': odds,
+        'lwp_action_type': action.value, 'matched_stake': stake, 'remaining_stake': '0'}]}}
+
+
+@fixture()
+def aggregator():
+    return ExposureAggregator()
+
+
+def test_exposure(aggregator):
+    aggregator.on_message(fill(10, 1, '3', '10'))  # back: +20 if wins, -10 otherwise
+    aggregator.on_message(fill(11, 0, '2.5', '10'))  # lay: -15 if wins, +10 otherwise
+    aggregator.on_message(fill(12, 1, '2', '5', action=LWPActionType.ChangedExplicitly))
+    assert aggregator.selection_exposure(10) == (20, -10)
+    assert aggregator.selection_exposure(11) == (-15, 10)
+    assert aggregator.selection_exposure(12) == (0, 0)
+    assert aggregator.market_outcomes(1) == {10: 30, 11: -25}
+    assert aggregator.worst_case(1) == -25
+    aggregator.on_message(fill(11, 1, '2.5', '10'))
+    assert aggregator.market_outcomes(1) == {10: 20, 11: -10}
+    assert aggregator.worst_case(1) == -10  # selection 11 or none of the known selections wins
+    aggregator.on_message(fill(10, 0, '3', '10'))  # lay the same selection, closing all positions
+    assert aggregator.market_outcomes(1) == {10: 0, 11: 0}
+    assert aggregator.worst_case(1) == approx(0)
+    assert aggregator.worst_case(2) == 0
+
+
+@mark.parametrize('polarity,stake,max_loss,expected', [
+    (1, '10', 25, True),
+    (1, '10', 24, False),
+    (0, '10', 40, True),
+    (0, '10', 39, False),
+    (1, '-10', 0, True),
+])
+def test_check(aggregator, polarity, stake, max_loss, expected):
+    aggregator.on_message(fill(11, 0, '2.5', '10'))
+    price = {'market_id': 1, 'selection_id': 10, 'polarity': polarity, 'odds': '3.5', 'delta_stake': stake}
+    assert aggregator.check(price, max_loss) is expected
+
+
+def test_integer_representation():
+    aggregator = ExposureAggregator(odds_precision=2)
+    aggregator.add_fill(1, 10, 1, 250, 1000)
+    assert aggregator.selection_exposure(10) == (1500, -1000)
@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from pytest import mark
+
+from betdaq.gbei.fake_server import FakeGBEiServer
+from betdaq.gbei.protocol import GBEiProtocol, ProtocolEvents, LWPActionType
+from betdaq.gbei.protocol.utils import price_key
+
+
+@asynccontextmanager
+async def connected(encoder, **server_kwargs):
+    server = FakeGBEiServer(encoder, **server_kwargs)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    _, client = await loop.create_connection(lambda: GBEiProtocol(encoder), server.host, server.port)
+    client.received = []
+    client.add_callback(ProtocolEvents.data_received, client.received.append)
+    try:
+        yield server, client
+    finally:
+        client.on_stop()
+        await server.stop()
+        await asyncio.sleep(0)
+
+
+def actions(client):
+    return [(_['selection_id'], LWPActionType(_['lwp_action_type']), _['remaining_stake'])
+            for message in client.received if message['message_header']['type'] == 'lwpchangenotification'
+            for _ in message['message']['prices']]
+
+
+@mark.asyncio
+async def test_add_cancel_and_query(encoder, lightweight_price, wait_for):
+    async with connected(encoder) as (server, client):
+        client.send_add_lightweight_prices([lightweight_price(1), lightweight_price(2)])
+        client.send_add_lightweight_prices([lightweight_price(1, delta_stake='-4')])
+        await wait_for(lambda: len(actions(client)) == 3)
+        assert await client.ping() >= 0
+        assert [_['selection_id'] for _ in await client.query_all()] == [1, 2]
+        client.send_cancel_lightweight_prices([{'selection_id': 2, 'polarity': 1, 'odds': '2.5',
+                                                'punter_reference_number': 1}])
+        client.send_cancel_all_lightweight_prices_on_markets([1])
+        await wait_for(lambda: len(actions(client)) == 5)
+        assert actions(client) == [
+            (1, LWPActionType.ChangedExplicitly, '10'),
+            (2, LWPActionType.ChangedExplicitly, '10'),
+            (1, LWPActionType.ChangedExplicitly, '6'),
+            (2, LWPActionType.CancelledExplicitly, '0'),
+            (1, LWPActionType.CancelledAllOnMarket, '0'),
+        ]
+        assert not server.prices
+
+
+@mark.asyncio
+async def test_fills_reset_and_fragmentation(encoder, lightweight_price, wait_for):
+    async with connected(encoder, fragment_size=5, summary_size=1) as (server, client):
+        client.send_add_lightweight_prices([lightweight_price(1), lightweight_price(2)])
+        await wait_for(lambda: len(server.prices) == 2)
+        assert server.fill([price_key(lightweight_price(1))], ratio=0.25) == 1
+        assert len(await client.query_all()) == 2
+        server.reset()
+        await wait_for(lambda: client.received[-1]['message_header']['type'] == 'resetoccurred')
+        assert actions(client) == [
+            (1, LWPActionType.ChangedExplicitly, '10'),
+            (2, LWPActionType.ChangedExplicitly, '10'),
+            (1, LWPActionType.Matched, '7.5'),
+        ]
+        assert await client.query_all() == []
@@ -4,10 +4,14 @@ from decimal import Decimal as DecimalNative
 from pytest import mark
 
 from betdaq.gbei.protocol.fields import DateTime, Decimal, Int, Length, Long,\
-    String, MoneyAmount, Optional, Array, Enum
+    String, MoneyAmount, Optional, Array, Enum, EPOCH_TICKS, MAX_TICKS, ticks_to_ns, ns_to_ticks, \
+    ticks_to_timestamp, timestamp_to_ticks
 from betdaq.gbei.protocol.enums import LWPActionType
 
 
+TICKS_PER_FLOAT_ERROR = 10 ** 7 * 2 ** -52 * 4  # relative error of float seconds, in ticks
+
+
 @mark.parametrize('dt, as_timestamp', [
     (datetime(2020, 1, 1), False),
     (datetime(2020, 1, 2, 3, 4, 5), False),
@@ -21,6 +25,37 @@ def test_datetime(dt, as_timestamp):
     assert not bytes(remaining_bts)
 
 
+@mark.parametrize('dt, bts', [
+    (datetime(2020, 1, 2, 3, 4, 5, 123456), b'\x00\xd7\x4d\x6d\x30\x8f\xd7\x08'),
+    (datetime(1, 1, 1, 0, 0, 0, 1), b'\x0a' + b'\x00' * 7),
+])
+def test_datetime_ticks_precision(dt, bts):
+    f = DateTime()
+    dumped = f.dumps(dt)
+    assert dumped == bts
+    loaded, _ = f.loads(memoryview(dumped))
+    assert loaded == dt
+
+
+@mark.parametrize('ticks', [1, 10 ** 9, EPOCH_TICKS - 1, EPOCH_TICKS, EPOCH_TICKS + 1,
+                            637450000000000001, MAX_TICKS - 1, MAX_TICKS] +
+                  list(range(1, MAX_TICKS, MAX_TICKS // 97)))
+def test_ticks_round_trip(ticks):
+    assert ns_to_ticks(ticks_to_ns(ticks)) == ticks
+    ts = ticks_to_timestamp(ticks)
+    assert abs(timestamp_to_ticks(ts) - ticks) <= max(1, abs(ts) * TICKS_PER_FLOAT_ERROR)
+
+
+@mark.parametrize('ns', [-10 ** 18, -100, 100, 1605801993123456700, 10 ** 18])
+def test_datetime_as_nanoseconds(ns):
+    f = DateTime(as_nanoseconds=True)
+    dumped = f.dumps(ns)
+    assert f.dumps(ns + 99) == dumped  # sub-tick part is truncated
+    loaded, remaining_bts = f.loads(memoryview(dumped))
+    assert loaded == ns
+    assert not bytes(remaining_bts)
+
+
 @mark.parametrize('as_string, value, bts', [
     (False, DecimalNative('1'), b'\x01' + b'\x00' * 15),
     (False, DecimalNative('1.0'), b'\x0a' + b'\x00' * 13 + b'\x01\x00'),
@@ -42,6 +77,32 @@ def test_decimal(as_string, value, bts):
     assert not bytes(remaining_bts)
 
 
+@mark.parametrize('precision, value, bts, loaded_value', [
+    (2, 250, b'\xfa' + b'\x00' * 13 + b'\x02\x00', 250),
+    (2, -100, b'\x64' + b'\x00' * 13 + b'\x02\x80', -100),
+    (0, 3, b'\x03' + b'\x00' * 15, 3),
+])
+def test_decimal_as_integer(precision, value, bts, loaded_value):
+    f = Decimal(precision=precision)
+    dumped = f.dumps(value)
+    assert dumped == bts
+    loaded, remaining_bts = f.loads(memoryview(dumped))
+    assert loaded == loaded_value
+    assert not bytes(remaining_bts)
+
+
+@mark.parametrize('precision, bts, value', [
+    (2, b'\x0a' + b'\x00' * 13 + b'\x01\x00', 100),  # 1.0
+    (2, b'\x00\xe4\x0b\x54\x02' + b'\x00' * 9 + b'\x05\x00', 10000000),  # 100000.00000
+    (2, b'\x4d\x00\x00\x00' + b'\x00' * 10 + b'\x03\x80', -7),  # -0.077
+    (0, b'\x0c' + b'\x00' * 13 + b'\x01\x00', 1),  # 1.2
+])
+def test_decimal_as_integer_rescale(precision, bts, value):
+    loaded, remaining_bts = Decimal(precision=precision).loads(memoryview(bts))
+    assert loaded == value
+    assert not bytes(remaining_bts)
+
+
 @mark.parametrize('value, bts', [
     (1, b'\x01\x00\x00\x00'),
     (1234567890, b'\xd2\x02\x96\x49'),
@@ -139,6 +200,15 @@ def test_money_amount(as_string, money, currency, bts):
     assert not bytes(remaining_bts)
 
 
+def test_money_amount_as_integer():
+    f = MoneyAmount('GBP', precision=2)
+    dumped = f.dumps(1050)
+    assert dumped == b'\x1a\x04' + b'\x00' * 12 + b'\x02\x00\x03GBP'
+    loaded, remaining_bts = f.loads(memoryview(dumped))
+    assert loaded == 1050
+    assert not bytes(remaining_bts)
+
+
 @mark.parametrize('value, bts', [
     (None, b'\x00'),
     ('s', b'\x01\x01s')
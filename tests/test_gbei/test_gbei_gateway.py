@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import os
+
+from pytest import fixture, mark
+
+from betdaq.gbei.fake_server import FakeGBEiServer
+from betdaq.gbei.gateway import GBEiGateway, GatewayClient, reference_range
+from betdaq.gbei.protocol import GBEiProtocol
+from betdaq.gbei.shared_ring import SharedRing
+
+
+@fixture()
+def name():
+    return 'gbei-test-%s' % os.getpid()
+
+
+@fixture()
+def ring(name):
+    ring = SharedRing(name, capacity=64, create=True)
+    yield ring
+    ring.close()
+
+
+def test_ring_wraps_around(ring, name):
+    consumer = SharedRing(name)
+    assert consumer.capacity == 64
+    assert consumer.get() is None
+    for i in range(20):
+        record = bytes([i]) * (i % 7 + 20)
+        assert ring.put(record)
+        assert len(ring) == len(record) + 4 or i and len(ring) > len(record) + 4
+        assert consumer.get() == record
+        assert len(consumer) == 0
+    assert ring.put(b'a' * 28)
+    assert not ring.put(b'b' * 28)  # would wrap into unread record
+    assert not ring.put(b'c' * 61)  # larger than the ring
+    assert consumer.get() == b'a' * 28
+    assert ring.put(b'b' * 28)
+    assert consumer.get() == b'b' * 28
+    consumer.close()
+
+
+def produce(name, count):
+    ring = SharedRing(name)
+    for i in range(count):
+        while not ring.put(i.to_bytes(4, 'little') * (i % 5 + 1)):
+            pass
+    ring.close()
+
+
+def test_ring_between_processes(ring, name):
+    process = multiprocessing.get_context('fork').Process(target=produce, args=(name, 500))
+    process.start()
+    received = []
+    while len(received) < 500:
+        record = ring.get()
+        if record is not None:
+            received.append(record)
+    process.join(5)
+    assert received == [i.to_bytes(4, 'little') * (i % 5 + 1) for i in range(500)]
+
+
+@mark.asyncio
+async def test_gateway(encoder, name, mocker, lightweight_price, wait_for):
+    server = FakeGBEiServer(encoder)
+    await server.start()
+    _, protocol = await asyncio.get_running_loop().create_connection(lambda: GBEiProtocol(encoder),
+                                                                     server.host, server.port)
+    sent = mocker.spy(protocol, '_apply_callbacks')
+    gateway = GBEiGateway(protocol, name, clients=2, capacity=4096, poll_interval=0.001)
+    gateway.start()
+    clients = [GatewayClient(name, i, encoder) for i in range(2)]
+    messages = [[], []]
+    try:
+        assert clients[0].send_add_lightweight_prices([lightweight_price(1), lightweight_price(2)])
+        assert clients[1].send_cancel_all_lightweight_prices_on_markets([1])
+        clients[0].commands.put(b'\x01\x02')
+
+        def received():
+            for client, client_messages in zip(clients, messages):
+                client_messages.extend(client.poll())
+            return len(messages[1]) == 2
+        await wait_for(received)
+        assert messages[0] == messages[1]
+        assert [[(_['selection_id'], _['lwp_action_type']) for _ in message['message']['prices']]
+                for message in messages[1]] == [[(1, 4), (2, 4)], [(1, 16), (2, 16)]]
+        assert gateway.stats() == {'forwarded': 2, 'rejected': 1, 'dropped': 0, 'queued_commands_bytes': [0, 0],
+                                   'queued_notifications_bytes': [0, 0]}
+        assert ['addlightweightprices', 'cancelalllightweightpricesonmarkets'] == [
+            _.args[1]['message_header']['type'] for _ in sent.call_args_list if _.args[0].name == 'data_sent']
+    finally:
+        for client in clients:
+            client.close()
+        gateway.stop()
+        protocol.on_stop()
+        await server.stop()
+        await asyncio.sleep(0)
+
+
+@mark.asyncio
+async def test_gateway_routes_replies(encoder, name, lightweight_price, wait_for):
+    server = FakeGBEiServer(encoder)
+    await server.start()
+    _, protocol = await asyncio.get_running_loop().create_connection(lambda: GBEiProtocol(encoder),
+                                                                     server.host, server.port)
+    gateway = GBEiGateway(protocol, name, clients=2, capacity=4096, poll_interval=0.001)
+    gateway.start()
+    clients = [GatewayClient(name, i, encoder) for i in range(2)]
+    messages = [[], []]
+    try:
+        assert clients[0].send_add_lightweight_prices([lightweight_price(1)])
+        reference = clients[0].send_ping()
+        assert reference in reference_range(0)
+        assert clients[1].send_query_all(market_ids=[1]) in reference_range(1)
+        await protocol.ping()  # reply to gateway protocol request is not forwarded
+
+        def received():
+            for client, client_messages in zip(clients, messages):
+                client_messages.extend(client.poll())
+            return len(messages[0]) == 2 and len(messages[1]) == 2
+        await wait_for(received)
+        await asyncio.sleep(0.01)
+        assert [_['message_header']['type'] for _ in messages[0] + clients[0].poll()] == [
+            'lwpchangenotification', 'pingresponse']
+        assert messages[0][1]['message']['punter_query_reference_number'] == reference
+        assert [_['message_header']['type'] for _ in messages[1] + clients[1].poll()] == [
+            'lwpchangenotification', 'lightweightpricesummary']
+
+        # references of another client are rejected
+        clients[1].commands.put(encoder.ping(next(iter(reference_range(0)))))
+        await wait_for(lambda: gateway.rejected == 1)
+        assert gateway.stats()['forwarded'] == 3
+    finally:
+        for client in clients:
+            client.close()
+        gateway.stop()
+        protocol.on_stop()
+        await server.stop()
+        await asyncio.sleep(0)
@@ -0,0 +1,84 @@
+import asyncio
+
+from pytest import fixture, mark
+
+from betdaq.gbei.protocol import GBEiProtocol, ProtocolEvents
+from betdaq.gbei.protocol.instrumentation import ProtocolMetrics
+
+
+@fixture()
+def protocol(encoder, mocker):
+    protocol = GBEiProtocol(encoder, metrics=ProtocolMetrics())
+    protocol._transport = mocker.Mock()
+    return protocol
+
+
+def ping_response(encoder, reference):
+    return encoder.encode_request('pingresponse', {'punter_query_reference_number': reference,
+                                                   'total_summary_notifications': 0})
+
+
+def on_data(parsed):
+    pass
+
+
+def test_snapshot(protocol, encoder):
+    protocol.add_callback(ProtocolEvents.data_received, on_data)
+    protocol.send_cancel_all_lightweight_prices()
+    protocol.keep_alive()
+    data = ping_response(encoder, 1) + b'\x00' + ping_response(encoder, 2)
+    protocol.data_received(data[:-3])
+    snapshot = protocol.metrics.snapshot()
+    assert snapshot['buffered_bytes'] == len(ping_response(encoder, 2)) - 3
+    protocol.data_received(data[-3:])
+    protocol.data_received(b'\x01\x7f' * 4)  # undecodable frame
+
+    snapshot = protocol.metrics.snapshot()
+    assert snapshot['bytes_in'] == len(data) + 8
+    assert snapshot['bytes_out'] == sum(len(_[0][0]) for _ in protocol._transport.write.call_args_list)
+    assert snapshot['keep_alives_in'] == 1
+    assert snapshot['messages_in'] == {'pingresponse': 2}
+    assert snapshot['messages_out'] == {'cancelalllightweightprices': 1}
+    assert snapshot['decode_errors'] == 1
+    assert snapshot['decode_ns']['count'] == 2
+    assert snapshot['callback_ns']['on_data']['count'] == 2
+    assert snapshot['buffered_bytes'] == 0
+    assert snapshot['max_buffered_bytes'] == len(ping_response(encoder, 2)) - 3
+
+
+def test_reset(protocol, encoder):
+    protocol.data_received(ping_response(encoder, 1))
+    assert protocol.metrics.snapshot(reset=True)['messages_in'] == {'pingresponse': 1}
+    snapshot = protocol.metrics.snapshot()
+    assert snapshot['bytes_in'] == 0
+    assert snapshot['messages_in'] == {}
+    assert snapshot['decode_ns']['count'] == 0
+
+
+def test_heartbeat():
+    metrics = ProtocolMetrics()
+    for now in (0, 1000, 3000):
+        metrics.on_heartbeat(now)
+    snapshot = metrics.snapshot()['heartbeat_interval_ns']
+    assert snapshot['count'] == 2
+    assert snapshot['min'] == 1000
+    assert snapshot['max'] == 2000
+
+
+def test_no_callback_timing(encoder, mocker):
+    protocol = GBEiProtocol(encoder, metrics=ProtocolMetrics(time_callbacks=False))
+    protocol.add_callback(ProtocolEvents.data_received, on_data)
+    protocol.data_received(ping_response(encoder, 1))
+    assert protocol.metrics.snapshot()['callback_ns'] == {}
+
+
+@mark.asyncio
+async def test_emitter(protocol, encoder, mocker):
+    emit = mocker.Mock()
+    protocol.metrics.start_emitter(0.01, emit)
+    protocol.data_received(ping_response(encoder, 1))
+    await asyncio.sleep(0.05)
+    protocol.metrics.stop_emitter()
+    assert emit.call_count >= 2
+    assert emit.call_args_list[0][0][0]['messages_in'] == {'pingresponse': 1}
+    assert emit.call_args_list[-1][0][0]['messages_in'] == {}
@@ -0,0 +1,125 @@
+import time
+
+from pytest import fixture, mark
+
+from betdaq.aapi.structures import topics as t
+from betdaq.aapi.structures.enums import MessageType
+from betdaq.aapi.structures.head import Head
+from betdaq.common.enums import MarketStatus, SelectionStatus
+from betdaq.gbei.kill_switch import KillSwitch
+from betdaq.gbei.protocol import GBEiProtocol
+
+
+def market_info(market_id=1, message_type=MessageType.Delta, **kwargs):
+    topic = t.MExchangeInfo(head=Head(message_type=message_type), topic_kwargs={'market_id': market_id})
+    for k, v in kwargs.items():
+        setattr(topic, k, v)
+    return topic
+
+
+def selection_info(selection_id=10, message_type=MessageType.Delta, **kwargs):
+    topic = t.SExchangeInfo(head=Head(message_type=message_type), topic_kwargs={'selection_id': selection_id})
+    for k, v in kwargs.items():
+        setattr(topic, k, v)
+    return topic
+
+
+@fixture()
+def protocol(encoder, mocker):
+    proto = GBEiProtocol(encoder)
+    proto._transport = mocker.Mock()
+    mocker.spy(proto, 'send_cancel_all_lightweight_prices_on_markets')
+    mocker.spy(proto, 'send_cancel_all_lightweight_prices_on_selections')
+    return proto
+
+
+@fixture()
+def kill_switch(protocol):
+    switch = KillSwitch(protocol)
+    switch.on_aapi_message(market_info(message_type=MessageType.TopicLoad, status=MarketStatus.Active,
+                                       is_currently_in_running=False, withdrawal_sequence_number=0), 0)
+    switch.on_aapi_message(selection_info(message_type=MessageType.TopicLoad, status=SelectionStatus.Active,
+                                          selection_reset_count=0), 0)
+    return switch
+
+
+@mark.parametrize('kwargs', [
+    {'status': MarketStatus.Suspended},
+    {'is_currently_in_running': True},
+    {'withdrawal_sequence_number': 1},
+])
+def test_market_change_cancels_prices(kill_switch, protocol, kwargs):
+    kill_switch.on_aapi_message(market_info(**kwargs), time.perf_counter_ns())
+    protocol.send_cancel_all_lightweight_prices_on_markets.assert_called_once_with([1])
+    assert kill_switch.triggered == 1
+    assert kill_switch.latency.count == 1
+
+
+@mark.parametrize('kwargs', [
+    {'status': MarketStatus.Active},
+    {'is_currently_in_running': False},
+    {'withdrawal_sequence_number': 0},
+    {'number_of_selections': 3},
+])
+def test_market_no_change(kill_switch, protocol, kwargs):
+    kill_switch.on_aapi_message(market_info(**kwargs), time.perf_counter_ns())
+    assert not protocol.send_cancel_all_lightweight_prices_on_markets.called
+    assert kill_switch.triggered == 0
+
+
+def test_market_cancels_while_unsafe(kill_switch, protocol):
+    kill_switch.on_aapi_message(market_info(status=MarketStatus.Suspended), time.perf_counter_ns())
+    kill_switch.on_aapi_message(market_info(status=MarketStatus.Suspended), time.perf_counter_ns())
+    kill_switch.on_aapi_message(market_info(status=MarketStatus.Active), time.perf_counter_ns())
+    assert protocol.send_cancel_all_lightweight_prices_on_markets.call_count == 2
+
+
+@mark.parametrize('kwargs', [
+    {'status': SelectionStatus.Withdrawn},
+    {'selection_reset_count': 1},
+])
+def test_selection_change_cancels_prices(kill_switch, protocol, kwargs):
+    kill_switch.on_aapi_message(selection_info(**kwargs), time.perf_counter_ns())
+    protocol.send_cancel_all_lightweight_prices_on_selections.assert_called_once_with([10])
+    assert not protocol.send_cancel_all_lightweight_prices_on_markets.called
+
+
+@mark.parametrize('kwargs', [
+    {'status': MarketStatus.Suspended},
+    {'is_currently_in_running': True},
+])
+def test_unknown_market_unsafe_state_cancels_prices(kill_switch, protocol, kwargs):
+    kill_switch.on_aapi_message(market_info(market_id=2, message_type=MessageType.TopicLoad, **kwargs), 0)
+    protocol.send_cancel_all_lightweight_prices_on_markets.assert_called_once_with([2])
+
+
+def test_unknown_selection_unsafe_state_cancels_prices(kill_switch, protocol):
+    kill_switch.on_aapi_message(selection_info(selection_id=11, status=SelectionStatus.Withdrawn), 0)
+    protocol.send_cancel_all_lightweight_prices_on_selections.assert_called_once_with([11])
+
+
+def test_deleted_items_forgotten(kill_switch, protocol):
+    kill_switch.on_aapi_message(market_info(message_type=MessageType.Delete), time.perf_counter_ns())
+    kill_switch.on_aapi_message(selection_info(message_type=MessageType.Delete), time.perf_counter_ns())
+    # sequence number and reset count are not known anymore, so their change can't be detected
+    kill_switch.on_aapi_message(market_info(withdrawal_sequence_number=1), time.perf_counter_ns())
+    kill_switch.on_aapi_message(selection_info(selection_reset_count=1), time.perf_counter_ns())
+    assert kill_switch.triggered == 0
+    kill_switch.on_aapi_message(market_info(withdrawal_sequence_number=2), time.perf_counter_ns())
+    protocol.send_cancel_all_lightweight_prices_on_markets.assert_called_once_with([1])
+
+
+def test_latency_measured_when_cancel_is_written(kill_switch, protocol):
+    protocol.pause_writing()
+    kill_switch.on_aapi_message(market_info(status=MarketStatus.Suspended), time.perf_counter_ns())
+    assert kill_switch.latency.count == 0
+    protocol.resume_writing()
+    assert kill_switch.latency.count == 1
+
+
+def test_not_connected(kill_switch, protocol):
+    protocol._transport = None
+    kill_switch.on_aapi_message(selection_info(selection_reset_count=1), time.perf_counter_ns())
+    assert not protocol.send_cancel_all_lightweight_prices_on_selections.called
+    assert kill_switch.triggered == 1
+    assert kill_switch.latency.count == 0
@@ -0,0 +1,47 @@
+from pytest import fixture
+
+from betdaq.gbei.latency import AckLatencyTracker
+from betdaq.gbei.protocol import LWPActionType
+
+
+def envelope(message_type, references):
+    return {'message_header': {'type': message_type},
+            'message': {'prices': [{'punter_reference_number': _} for _ in references]}}
+
+
+def notification(*items):
+    return {'message_header': {'type': 'lwpchangenotification'},
+            'message': {'prices': [{'punter_reference_number': reference, 'lwp_action_type': action.value}
+                                   for reference, action in items]}}
+
+
+@fixture()
+def tracker():
+    return AckLatencyTracker(unacknowledged_after=1, max_pending=3)
+
+
+def test_latency_per_action_type(tracker):
+    tracker.on_sent(envelope('addlightweightprices', [1, 2]), now=100)
+    tracker.on_sent(envelope('cancellightweightprices', [3]), now=200)
+    tracker.on_sent(envelope('ping', [4]), now=200)
+    assert len(tracker) == 3
+    tracker.on_message(notification((1, LWPActionType.ChangedExplicitly), (2, LWPActionType.Matched)), now=400)
+    tracker.on_message(notification((1, LWPActionType.Matched), (3, LWPActionType.CancelledExplicitly)), now=500)
+    assert len(tracker) == 0
+    assert tracker.latency[LWPActionType.ChangedExplicitly].snapshot()['max'] == 300
+    assert tracker.latency[LWPActionType.Matched].count == 1  # only first notification is counted
+    assert tracker.latency[LWPActionType.CancelledExplicitly].snapshot()['max'] == 300
+
+
+def test_unacknowledged_and_evicted(tracker):
+    tracker.on_sent(envelope('addlightweightprices', [1, 2]), now=0)
+    tracker.on_sent(envelope('addlightweightprices', [1]), now=10 ** 9 - 10)
+    tracker.on_message(notification((3, LWPActionType.ChangedExplicitly)), now=10 ** 9)
+    assert tracker.unacknowledged == 1
+    assert len(tracker) == 1
+    tracker.on_sent(envelope('addlightweightprices', [4, 5, 6]), now=10 ** 9)
+    assert tracker.evicted == 1
+    snapshot = tracker.snapshot(reset=True)
+    assert snapshot['pending'] == 0
+    assert snapshot['unacknowledged'] == 4
+    assert snapshot['latency'] == {}
@@ -0,0 +1,13 @@
+from betdaq.gbei.metrics import Histogram
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.snapshot() == {'count': 0, 'mean': None, 'min': None, 'max': None, 'p50': None, 'p99': None}
+    for value in (0, 1, 3, 100, 1000):
+        histogram.add(value)
+    assert histogram.snapshot() == {'count': 5, 'mean': 220.8, 'min': 0, 'max': 1000, 'p50': 3, 'p99': 1000}
+    assert histogram.percentile(80) == 127
+    histogram.reset()
+    assert histogram.count == 0
+    assert histogram.percentile(50) is None
@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from pytest import mark
+
+from betdaq.gbei.exposure import ExposureAggregator
+from betdaq.gbei.fake_server import FakeGBEiServer
+from betdaq.gbei.pool import GBEiConnectionPool
+from betdaq.gbei.protocol import GBEiProtocol, GBEiRequestEncoder, ProtocolEvents
+
+
+def make_encoder(source):
+    return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, source=source, decimal_as_string=True,
+                              datetime_as_timestamp=True)
+
+
+@asynccontextmanager
+async def started_pool(encoder, mocker, **pool_kwargs):
+    server = FakeGBEiServer(encoder)
+    await server.start()
+    handle = mocker.spy(server, 'handle')
+
+    async def connect(encoder, **kwargs):
+        _, protocol = await asyncio.get_running_loop().create_connection(
+            lambda: GBEiProtocol(encoder, **kwargs), server.host, server.port)
+        return protocol
+
+    pool = GBEiConnectionPool(shards=2, spares=1, encoder_factory=make_encoder, source_prefix='p', connect=connect,
+                              **pool_kwargs)
+    await pool.start()
+    try:
+        yield pool, server, handle
+    finally:
+        pool.stop()
+        await server.stop()
+        await asyncio.sleep(0)
+
+
+def received(handle):
+    """Message source: market ids of received requests"""
+    result = {}
+    for call in handle.call_args_list:
+        parsed = call.args[1]
+        message = parsed['message']
+        market_ids = message.get('market_ids') or [_.get('market_id') for _ in message.get('prices', [])]
+        result.setdefault(parsed['message_header']['source'], []).extend(market_ids)
+    return result
+
+
+@mark.asyncio
+async def test_routing_by_market(encoder, mocker, lightweight_price, wait_for):
+    async with started_pool(encoder, mocker, health_interval=None) as (pool, server, handle):
+        assert [_['source'] for _ in pool.stats()] == ['p-0', 'p-1', 'p-2']
+        pool.send_add_lightweight_prices([lightweight_price(selection_id, market_id)
+                                          for market_id, selection_id in ((1, 11), (2, 21), (3, 31), (4, 41))])
+        pool.send_cancel_lightweight_prices([{'selection_id': 31, 'polarity': 1, 'odds': '2.5',
+                                              'punter_reference_number': 1}])
+        pool.send_cancel_all_lightweight_prices_on_markets([2])
+        pool.send_cancel_lightweight_prices([{'selection_id': 21, 'market_id': 2, 'polarity': 1, 'odds': '2.5',
+                                              'punter_reference_number': 1}])
+        pool.send_cancel_all_lightweight_prices_on_selections([41])
+        await wait_for(lambda: handle.call_count == 6)
+        assert received(handle) == {'p-0': [2, 4, 2, None], 'p-1': [1, 3, None]}
+        sources = {tuple(_['selection_id'] for _ in parsed['message'].get('prices', [])) or
+                   tuple(parsed['message'].get('selection_ids', [])): parsed['message_header']['source']
+                   for parsed in (_.args[1] for _ in handle.call_args_list)}
+        assert sources[(21,)] == 'p-0' and sources[(41,)] == 'p-0'
+        # market of the selection is unknown, cancels are rejected
+        pool.send_cancel_lightweight_prices([{'selection_id': 99, 'polarity': 1, 'odds': '2.5',
+                                              'punter_reference_number': 1}])
+        pool.send_cancel_all_lightweight_prices_on_selections([98])
+        assert pool.rejected == 2
+        assert await pool.ping() >= 0
+
+
+@mark.asyncio
+async def test_failover_to_spare(encoder, mocker, lightweight_price, wait_for):
+    async with started_pool(encoder, mocker, health_interval=None, reconnect_delay=0.01) as (pool, server, handle):
+        lost = pool.connections[1].protocol
+        lost._transport.close()
+        await wait_for(lambda: pool.connections[1].protocol is not lost)
+        assert pool.routes == [0, 2]
+        assert pool.failovers == 1
+        pool.send_add_lightweight_prices([lightweight_price(11, 1)])
+        await wait_for(lambda: handle.call_count == 1)
+        assert received(handle) == {'p-2': [1]}
+        await wait_for(lambda: pool.connections[1].healthy)
+        assert pool.routes == [0, 2]  # reconnected connection becomes spare
+        assert [_['shards'] for _ in pool.stats()] == [[0], [], [1]]
+
+
+@mark.asyncio
+async def test_health_check_failure(encoder, mocker, wait_for):
+    async with started_pool(encoder, mocker, health_interval=0.01, health_timeout=0.01,
+                            reconnect_delay=10) as (pool, server, handle):
+        mocker.patch.object(pool.connections[0].protocol, 'ping', side_effect=asyncio.TimeoutError)
+        await wait_for(lambda: pool.routes[0] != 0)
+        assert pool.routes == [2, 1]
+        assert pool.stats()[0]['failures'] == 1
+        await wait_for(lambda: pool.stats()[1]['rtt'] is not None)
+
+
+@mark.asyncio
+async def test_notifications_from_primary_connection(encoder, mocker, lightweight_price, wait_for):
+    async with started_pool(encoder, mocker, health_interval=None, reconnect_delay=0.01) as (pool, server, handle):
+        aggregator = ExposureAggregator()
+        pool.add_callback(ProtocolEvents.data_received, aggregator.on_message)
+        pings = []
+        pool.add_callback(ProtocolEvents.data_received,
+                          lambda parsed: parsed['message_header']['type'] == 'pingresponse' and pings.append(parsed))
+        assert pool.primary == 0
+        pool.send_add_lightweight_prices([lightweight_price(10, 1)])
+        await wait_for(lambda: len(server.prices) == 1)
+        server.fill(ratio=0.5)
+        await wait_for(lambda: aggregator.selection_exposure(10) != (0, 0))
+        await pool.connections[1].protocol.ping()
+        assert len(pings) == 1  # response of non primary connection
+        assert aggregator.selection_exposure(10) == (7.5, -5)
+
+        lost = pool.connections[0].protocol
+        lost._transport.close()
+        await wait_for(lambda: pool.connections[0].protocol is not lost)
+        assert pool.primary == 1
+        assert [_['primary'] for _ in pool.stats()] == [False, True, False]
+        server.fill()
+        await wait_for(lambda: aggregator.selection_exposure(10) != (7.5, -5))
+        await pool.ping()
+        assert aggregator.selection_exposure(10) == (15, -10)
+
+
+@mark.asyncio
+async def test_markets_learned_from_received_prices(encoder, mocker, lightweight_price, wait_for):
+    async with started_pool(encoder, mocker, health_interval=None) as (pool, server, handle):
+        pool.send_add_lightweight_prices([lightweight_price(11, 1), lightweight_price(21, 2)])
+        await wait_for(lambda: len(server.prices) == 2)
+        pool._selection_markets.clear()  # e.g. prices added before start
+        await pool.query_all(consumer=lambda price: None)
+        assert pool._selection_markets == {11: 1, 21: 2}
+        pool._selection_markets.clear()
+        await pool.query_all()
+        assert pool._selection_markets == {11: 1, 21: 2}
+        pool.send_cancel_all_lightweight_prices_on_selections([11, 21])
+        await wait_for(lambda: not server.prices)
+        assert pool.rejected == 0
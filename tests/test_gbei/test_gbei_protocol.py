@@ -0,0 +1,261 @@
+import asyncio
+
+from pytest import fixture, mark, raises
+
+from betdaq.gbei.protocol import GBEiProtocol, GBEiMessageType, ProtocolEvents, WritePolicy, OutboundLane
+from betdaq.gbei.protocol.outbound import OutboundQueue
+
+
+@fixture()
+def protocol(encoder, mocker):
+    proto = GBEiProtocol(encoder, heartbeat_interval=60)
+    proto._transport = mocker.Mock()
+    proto._heartbeat_loop = mocker.Mock()
+    return proto
+
+
+def sent_messages(protocol, encoder):
+    return [encoder.parse_response(_.args[0])[0] for _ in protocol._transport.write.call_args_list]
+
+
+def summary(encoder, reference, total, prices):
+    return encoder.encode_request('lightweightpricesummary', {
+        'punter_query_reference_number': reference, 'total_summary_notifications': total, 'prices': prices})
+
+
+def price(selection_id):
+    return {'market_id': 1, 'selection_id': selection_id, 'polarity': 1, 'odds': '2.0',
+            'punter_reference_number': 1, 'expire_at': 1605801993.0, 'expected_selection_reset_count': 0,
+            'expected_withdrawal_sequence_number': 0, 'remaining_stake': '10.0'}
+
+
+@mark.asyncio
+async def test_ping(protocol, encoder, mocker):
+    callback = mocker.Mock()
+    protocol.add_callback(ProtocolEvents.data_received, callback)
+    task = asyncio.ensure_future(protocol.ping())
+    await asyncio.sleep(0)
+    request, = sent_messages(protocol, encoder)
+    reference = request['message']['punter_query_reference_number']
+    protocol.data_received(encoder.encode_request('pingresponse', {
+        'punter_query_reference_number': reference, 'total_summary_notifications': 0}))
+    rtt = await task
+    assert rtt >= 0
+    callback.assert_called_once()
+    assert not protocol._pending
+
+
+@mark.asyncio
+async def test_query_all_collects_summaries(protocol, encoder):
+    task = asyncio.ensure_future(protocol.query_all(market_ids=[1]))
+    await asyncio.sleep(0)
+    request, = sent_messages(protocol, encoder)
+    assert request['message_header']['type'] == 'queryalllightweightpricesonmarkets'
+    assert request['message']['market_ids'] == [1]
+    reference = request['message']['punter_query_reference_number']
+    protocol.data_received(summary(encoder, reference + 1, 1, [price(99)]))
+    protocol.data_received(summary(encoder, reference, 2, [price(11), price(12)]))
+    assert not task.done()
+    protocol.data_received(summary(encoder, reference, 2, [price(13)]))
+    snapshot = await task
+    assert [_['selection_id'] for _ in snapshot] == [11, 12, 13]
+
+
+@mark.asyncio
+async def test_query_all_empty(protocol, encoder):
+    task = asyncio.ensure_future(protocol.query_all())
+    await asyncio.sleep(0)
+    request, = sent_messages(protocol, encoder)
+    protocol.data_received(summary(encoder, request['message']['punter_query_reference_number'], 0, []))
+    assert await task == []
+
+
+@mark.asyncio
+async def test_request_timeout_and_connection_lost(protocol):
+    with raises(asyncio.TimeoutError):
+        await protocol.ping(timeout=0.01)
+    assert not protocol._pending
+    task = asyncio.ensure_future(protocol.ping())
+    await asyncio.sleep(0)
+    protocol.connection_lost(None)
+    with raises(ConnectionError):
+        await task
+
+
+def add_price(selection_id):
+    return {'selection_id': selection_id, 'market_id': 1, 'polarity': 1, 'odds': '2.0', 'delta_stake': '10',
+            'expire_price_at': 1605801993.0, 'expected_selection_reset_count': 0,
+            'expected_withdrawal_sequence_number': 0, 'punter_reference_number': selection_id}
+
+
+def cancel_price(selection_id):
+    return {'selection_id': selection_id, 'polarity': 1, 'odds': '2.0', 'punter_reference_number': selection_id}
+
+
+def written_messages(protocol, encoder):
+    chunks = [b''.join(_.args[0]) for _ in protocol._transport.writelines.call_args_list]
+    messages = []
+    for chunk in chunks:
+        while chunk:
+            parsed, chunk = encoder.parse_response(chunk)
+            chunk = bytes(chunk)
+            messages.append((parsed['message_header']['type'],
+                             [_['selection_id'] for _ in parsed['message'].get('prices', [])]))
+    return messages
+
+
+@mark.parametrize('policy, expected, dropped, collapsed, dropped_prices', [
+    (WritePolicy.keep, [('cancellightweightprices', [1]), ('addlightweightprices', [2]),
+                        ('addlightweightprices', [3])], 0, 0, [[1]]),
+    (WritePolicy.drop_adds, [('cancellightweightprices', [1])], 3, 0, [[1], [2], [3]]),
+    (WritePolicy.collapse_adds, [('cancellightweightprices', [1]), ('addlightweightprices', [2, 3])], 0, 2, [[1]]),
+])
+def test_write_paused(protocol, encoder, mocker, policy, expected, dropped, collapsed, dropped_prices):
+    on_dropped, on_sent = mocker.Mock(), mocker.Mock()
+    protocol.add_callback(ProtocolEvents.prices_dropped, on_dropped)
+    protocol.add_callback(ProtocolEvents.data_sent, on_sent)
+    protocol._outbound.policy = policy
+    protocol.pause_writing()
+    protocol.keep_alive()
+    protocol.send_add_lightweight_prices([add_price(1)])
+    protocol.send_add_lightweight_prices([add_price(2)])
+    protocol.send_cancel_lightweight_prices([cancel_price(1)])
+    protocol.send_add_lightweight_prices([add_price(3)])
+    protocol._transport.write.assert_not_called()
+    assert not on_sent.called
+    protocol._transport.get_write_buffer_limits.return_value = (16384, 65536)
+    protocol._transport.get_write_buffer_size.return_value = 70000
+    stats = protocol.write_stats()
+    assert stats['paused'] and stats['pauses'] == 1
+    assert stats['queued_bytes'] == stats['queued_bytes_high_watermark'] > 0
+    assert stats['dropped_adds'] == dropped and stats['collapsed_adds'] == collapsed
+    assert stats['transport_buffer_high'] == 65536
+
+    protocol.resume_writing()
+    protocol._transport.writelines.assert_called_once()
+    assert written_messages(protocol, encoder) == expected
+    assert [(_.args[0]['message_header']['type'], [p['selection_id'] for p in _.args[0]['message'].get('prices', [])])
+            for _ in on_sent.call_args_list] == expected
+    assert [[_['selection_id'] for _ in call.args[0]] for call in on_dropped.call_args_list] == dropped_prices
+    assert protocol.write_stats()['queued_bytes'] == 0
+    protocol.send_add_lightweight_prices([add_price(4)])
+    protocol._transport.write.assert_called_once()
+
+
+def test_write_paused_fills_expected_values_when_written(protocol, encoder):
+    protocol.pause_writing()
+    added = dict(add_price(1), expected_selection_reset_count=None, expected_withdrawal_sequence_number=None)
+    protocol.send_add_lightweight_prices([added])
+    encoder.market_index.set_selection_reset_count(1, 2)
+    encoder.market_index.set_withdrawal_sequence_number(1, 3)
+    protocol.resume_writing()
+    parsed, _ = encoder.parse_response(b''.join(protocol._transport.writelines.call_args.args[0]))
+    price = parsed['message']['prices'][0]
+    assert (price['expected_selection_reset_count'], price['expected_withdrawal_sequence_number']) == (2, 3)
+    assert added['expected_selection_reset_count'] is None
+
+
+def test_cancel_recomputes_queued_add_size(protocol, encoder):
+    protocol.pause_writing()
+    protocol.send_add_lightweight_prices([add_price(1), add_price(2)])
+    protocol.send_cancel_lightweight_prices([cancel_price(1)])
+    add_size = len(encoder.dumps(encoder.add_lightweight_prices([add_price(2)])))
+    cancel_size = len(encoder.dumps(encoder.cancel_lightweight_prices([cancel_price(1)])))
+    assert protocol._outbound.size == add_size + cancel_size
+
+
+def test_queued_bytes_limit(protocol, encoder):
+    protocol._outbound.max_bytes = 1
+    protocol.pause_writing()
+    protocol.send_add_lightweight_prices([add_price(1)])
+    protocol.send_cancel_lightweight_prices([cancel_price(1)])
+    protocol.resume_writing()
+    assert written_messages(protocol, encoder) == [('cancellightweightprices', [1])]
+
+
+@mark.asyncio
+async def test_priority_lanes(protocol, encoder):
+    protocol._outbound = OutboundQueue(encoder, rate_limits={OutboundLane.add: (50, 1)})
+    protocol._transport.get_write_buffer_limits.return_value = (16384, 65536)
+    protocol.send_add_lightweight_prices([add_price(1)])
+    protocol.send_add_lightweight_prices([add_price(2)])
+    protocol.send_add_lightweight_prices([add_price(3), add_price(4)])
+    protocol.send('ping', {'punter_query_reference_number': 1})
+    protocol.send('cancelalllightweightpricesonselections', {'selection_ids': [3]})
+    # ping and cancel are not held back by rate limited adds
+    assert [encoder.parse_response(_.args[0])[0]['message_header']['type']
+            for _ in protocol._transport.write.call_args_list] == [
+        'addlightweightprices', 'ping', 'cancelalllightweightpricesonselections']
+    assert protocol.write_stats()['queued_by_lane'] == {'cancel': 0, 'control': 0, 'add': 2}
+    await asyncio.sleep(0.06)
+    assert written_messages(protocol, encoder) == [('addlightweightprices', [2]), ('addlightweightprices', [4])]
+    assert protocol.write_stats()['rate_limited'] == 1
+    assert not protocol._outbound
+
+
+def test_data_received_fragmented(protocol, encoder, mocker):
+    callback = mocker.Mock()
+    protocol.add_callback(ProtocolEvents.data_received, callback)
+    data = summary(encoder, 1, 1, [price(11)]) + b'\x00' + summary(encoder, 2, 1, [price(12)])
+    for i in range(0, len(data), 7):
+        protocol.data_received(data[i:i + 7])
+    assert [_.args[0]['message']['punter_query_reference_number'] for _ in callback.call_args_list] == [1, 2]
+    assert protocol._buff == b''
+
+
+def ping_response(encoder, reference):
+    return encoder.encode_request('pingresponse', {'punter_query_reference_number': reference,
+                                                   'total_summary_notifications': 0})
+
+
+@mark.asyncio
+async def test_notifications_stream(protocol, encoder):
+    summaries = protocol.notifications(types=[GBEiMessageType.lightweightPriceSummary], maxsize=2)
+    everything = protocol.notifications()
+    protocol.data_received(ping_response(encoder, 1) + summary(encoder, 2, 1, [price(11)]))
+    protocol.data_received(summary(encoder, 3, 1, [price(12)]) + summary(encoder, 4, 1, [price(13)]))
+    assert summaries.stats()['lag'] == 2
+    assert summaries.stats()['dropped'] == 1
+    assert len(everything) == 4
+    message = await summaries.__anext__()
+    assert message['message']['punter_query_reference_number'] == 3
+    everything.close()
+    assert [_['received'] for _ in protocol.stream_stats()] == [3]
+    assert [_['message_header']['type'] async for _ in everything] == ['pingresponse'] + \
+        ['lightweightpricesummary'] * 3
+
+    task = asyncio.ensure_future(summaries.__anext__())
+    await asyncio.sleep(0)
+    assert task.done()
+    task = asyncio.ensure_future(summaries.__anext__())
+    await asyncio.sleep(0)
+    assert not task.done()
+    protocol.data_received(summary(encoder, 5, 1, [price(14)]))
+    message = await task
+    assert message['message']['punter_query_reference_number'] == 5
+    protocol._heartbeat_loop = asyncio.ensure_future(asyncio.sleep(1))
+    protocol.connection_lost(None)
+    assert [_ async for _ in summaries] == []
+    assert protocol.stream_stats() == []
+
+
+@mark.asyncio
+async def test_query_all_streams_to_consumer(protocol, encoder, mocker):
+    callback = mocker.Mock()
+    protocol.add_callback(ProtocolEvents.data_received, callback)
+    consumer = mocker.Mock()
+    progress = mocker.Mock()
+    task = asyncio.ensure_future(protocol.query_all(consumer=consumer, on_progress=progress))
+    await asyncio.sleep(0)
+    request, = sent_messages(protocol, encoder)
+    reference = request['message']['punter_query_reference_number']
+    notification = encoder.encode_request('lwpchangenotification', {'prices': [
+        dict(price(21), lwp_action_type=4)]})
+    protocol.data_received(summary(encoder, reference, 2, [price(11), price(12)]) + notification)
+    assert [_.args[0]['selection_id'] for _ in consumer.call_args_list] == [11, 12]
+    assert [len(_.args[0]['message']['prices']) for _ in callback.call_args_list] == [0, 1]
+    assert not task.done()
+    protocol.data_received(summary(encoder, reference, 2, [price(13)]))
+    assert await task == 3
+    assert [_.args for _ in progress.call_args_list] == [(1, 2, 2), (2, 2, 3)]
+    assert not protocol._streaming
@@ -0,0 +1,127 @@
+from pytest import fixture
+
+from betdaq.gbei.book import LightweightPriceBook
+from betdaq.gbei.quoting import QuotingEngine
+from betdaq.gbei.protocol.enums import LWPActionType
+from betdaq.gbei.protocol.request_encoder import GBEiRequestEncoder
+
+
+def notification(price, remaining_stake, action=LWPActionType.ChangedExplicitly, matched_stake=None):
+    return {'message_header': {'type': 'lwpchangenotification'}, 'message': {'prices': [{
+        'market_id': 1, 'selection_id': price['selection_id'], 'polarity': price['polarity'], 'odds': price['odds'],
+        'punter_reference_number': price['punter_reference_number'], 'remaining_stake': remaining_stake,
+        'lwp_action_type': action.value, 'matched_stake': matched_stake
+    }]}}
+
+
+def encoded_notification(encoder, price, remaining_stake, action=LWPActionType.ChangedExplicitly):
+    """Notification passed through GBEi binary format, as it's received from GBEi"""
+    message = notification(price, remaining_stake, action)['message']
+    message['prices'][0].update(expire_at=100., expected_selection_reset_count=0,
+                                expected_withdrawal_sequence_number=0, order_id=None,
+                                matched_against_side_stake=None)
+    return encoder.parse_response(encoder.encode_request('lwpchangenotification', message))[0]
+
+
+@fixture()
+def batcher(mocker):
+    b = mocker.Mock()
+    b.added = []
+    b.cancelled = []
+    b.add.side_effect = b.added.append
+    b.cancel.side_effect = b.cancelled.append
+    return b
+
+
+@fixture()
+def engine(batcher):
+    book = LightweightPriceBook()
+    e = QuotingEngine(book, batcher)
+
+    def on_message(parsed):
+        book.on_message(parsed)
+        e.on_message(parsed)
+
+    e.receive = on_message
+    return e
+
+
+def test_new_quotes_added(engine, batcher):
+    assert engine.set_quotes(1, 11, [(1, '2.0', '10'), (0, '1.9', '5')], 100) == 2
+    assert [(_['polarity'], _['odds'], _['delta_stake'], _['punter_reference_number'])
+            for _ in batcher.added] == [(1, '2.0', '10', 1), (0, '1.9', '5', 2)]
+    assert not batcher.cancelled
+    # nothing is resent while prices are not acknowledged yet
+    assert engine.requote(11) == 0
+
+
+def test_only_difference_sent(engine, batcher):
+    engine.set_quotes(1, 11, [(1, '2.0', '10'), (1, '3.0', '5')], 100)
+    for price in batcher.added:
+        engine.receive(notification(price, price['delta_stake']))
+    batcher.added.clear()
+
+    assert engine.set_quotes(1, 11, [(1, '2', '4'), (1, '4.0', '5')], 100) == 3
+    assert [(_['odds'], _['delta_stake'], _['punter_reference_number']) for _ in batcher.added] == [
+        ('2.0', '-6', 1), ('4.0', '5', 3)]
+    assert [(_['odds'], _['punter_reference_number']) for _ in batcher.cancelled] == [('3.0', 2)]
+    assert set(batcher.cancelled[0]) == {'selection_id', 'market_id', 'polarity', 'odds', 'punter_reference_number'}
+
+
+def test_matched_stake_reduces_pending(engine, batcher):
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    price = batcher.added.pop()
+    engine.receive(notification(price, '7', LWPActionType.Matched, matched_stake='3'))
+    assert engine.requote(11) == 1
+    assert batcher.added.pop()['delta_stake'] == '3'
+
+
+def test_remove_quotes_and_reset(engine, batcher):
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    price = batcher.added.pop()
+    engine.receive(notification(price, '10'))
+    assert engine.remove_quotes(11) == 1
+    assert batcher.cancelled.pop()['punter_reference_number'] == 1
+    assert engine.requote_all() == 0
+
+    engine.set_quotes(1, 12, [(1, '2.0', '10')], 100)
+    engine.receive({'message_header': {'type': 'resetoccurred'}, 'message': {}})
+    assert engine.requote_all() == 1
+    assert batcher.added[-1]['delta_stake'] == '10'
+
+
+def test_acknowledgement_with_normalized_odds(engine, batcher):
+    encoder = GBEiRequestEncoder(punter_id=1, punter_session_key=1, decimal_as_string=True,
+                                 datetime_as_timestamp=True)
+    engine.set_quotes(1, 11, [(1, '2.0', '10'), (0, '1.50', '5')], 100)
+    for price in batcher.added:
+        parsed = encoded_notification(encoder, price, price['delta_stake'])
+        assert parsed['message']['prices'][0]['odds'] != price['odds']
+        engine.receive(parsed)
+    assert not engine._pending
+    assert engine.requote(11) == 0
+    assert not batcher.cancelled
+
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    price = batcher.cancelled.pop()
+    engine.receive(encoded_notification(encoder, price, '0', LWPActionType.CancelledExplicitly))
+    assert not engine._pending
+    assert not engine.book.selection_prices(11, 0)
+
+
+def test_dropped_adds_released(engine, batcher):
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    price = batcher.added.pop()
+    engine.on_dropped([price])
+    assert not engine._pending
+    assert engine.requote(11) == 1
+    price = batcher.added.pop()
+    assert price['delta_stake'] == '10'
+
+    # add cancelled while it's still in the batch is never acknowledged
+    engine.set_quotes(1, 11, [], 100)
+    cancel = batcher.cancelled.pop()
+    engine.on_dropped([price])
+    engine.receive(notification(cancel, '0', LWPActionType.CancelledExplicitly))
+    assert not engine._pending
+    assert batcher.on_drop == engine.on_dropped
@@ -0,0 +1,64 @@
+import time
+
+from pytest import fixture, mark
+
+from betdaq.gbei.protocol import Direction, GBEiProtocol, ProtocolEvents
+from betdaq.gbei.protocol.recorder import SessionRecorder, SessionReplayer, read_records
+
+
+def ping_response(encoder, reference):
+    return encoder.encode_request('pingresponse', {'punter_query_reference_number': reference,
+                                                   'total_summary_notifications': 0})
+
+
+@fixture()
+def session(encoder, tmp_path, mocker):
+    path = str(tmp_path / 'session.bin')
+    with SessionRecorder(path) as recorder:
+        protocol = GBEiProtocol(encoder, recorder=recorder)
+        protocol._transport = mocker.Mock()
+        protocol.send_cancel_all_lightweight_prices()
+        protocol.keep_alive()
+        data = ping_response(encoder, 1) + ping_response(encoder, 2)
+        protocol.data_received(data[:5])
+        time.sleep(0.02)
+        protocol.data_received(data[5:])
+        assert recorder.records == 4
+    return path, data
+
+
+def received_callback(protocol, mocker):
+    callback = mocker.Mock()
+    protocol.add_callback(ProtocolEvents.data_received, callback)
+    return callback
+
+
+def test_read_records(session, encoder):
+    path, data = session
+    records = list(read_records(path))
+    assert [_[0] for _ in records] == [Direction.outbound, Direction.outbound, Direction.inbound, Direction.inbound]
+    assert encoder.parse_response(records[0][2])[0]['message_header']['type'] == 'cancelalllightweightprices'
+    assert records[1][2] == b'\x00'
+    assert [_[2] for _ in records[2:]] == [data[:5], data[5:]]
+    assert records[3][1] - records[2][1] >= 20000000
+
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x01')
+    assert len(list(read_records(path))) == 4
+
+
+@mark.asyncio
+async def test_replay(session, encoder, mocker):
+    path, data = session
+    replayer = SessionReplayer(path)
+    protocol = GBEiProtocol(encoder)
+    callback = received_callback(protocol, mocker)
+    feed = mocker.spy(protocol, 'data_received')
+    assert replayer.replay_now(protocol) == 2
+    assert [_.args[0]['message']['punter_query_reference_number'] for _ in callback.call_args_list] == [1, 2]
+
+    feed.reset_mock()
+    started = time.perf_counter()
+    assert await replayer.replay(protocol, speed=0.5) == 2
+    assert time.perf_counter() - started >= 0.04
+    assert [len(_.args[0]) for _ in feed.call_args_list] == [5, len(data) - 5]
@@ -1,6 +1,7 @@
 from datetime import datetime
-from pytest import fixture
+from pytest import fixture, raises
 
+from betdaq.common.market_index import MarketIndex
 from betdaq.gbei.protocol.request_encoder import GBEiRequestEncoder
 
 
@@ -9,6 +10,12 @@ def encoder():
     return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True, datetime_as_timestamp=True)
 
 
+@fixture()
+def integer_encoder():
+    return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, datetime_as_timestamp=True,
+                              decimal_as_integer=True)
+
+
 def test_ping(encoder):
     bts = encoder.ping(1, datetime(2020, 1, 2, 3, 4, 5).timestamp())
     encoder.parse_response(bts)
@@ -69,3 +76,146 @@ def test_add_lightweight_prices(encoder):
                                          'expected_withdrawal_sequence_number': 0,
                                          'punter_reference_number': 1}])
     encoder.parse_response(encoder.e.dumps(e))
+
+
+def test_add_lightweight_price_as_integer(integer_encoder):
+    bts = integer_encoder.add_lightweight_price(12345, 67890, 1, 250, 1050,
+                                                datetime(2021, 1, 2, 3, 4, 5).timestamp(), 0, 0, 1)
+    parsed, _ = integer_encoder.parse_response(bts)
+    price = parsed['message']['prices'][0]
+    assert price['odds'] == 250
+    assert price['delta_stake'] == 1050
+
+    # encoder created later keeps its own representation
+    other = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                               datetime_as_timestamp=True)
+    assert other.parse_response(bts)[0]['message']['prices'][0]['odds'] == '2.5'
+    assert integer_encoder.parse_response(bts)[0]['message']['prices'][0]['odds'] == 250
+
+
+def test_datetime_as_nanoseconds_per_encoder():
+    ns_encoder = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                                    datetime_as_nanoseconds=True)
+    expire_price_at = 1609556645123456700
+    bts = ns_encoder.add_lightweight_price(12345, 67890, 1, '2.5', '10', expire_price_at, 0, 0, 1)
+    other = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                               datetime_as_timestamp=True)
+    assert other.parse_response(bts)[0]['message']['prices'][0]['expire_price_at'] == 1609556645.1234567
+    assert ns_encoder.parse_response(bts)[0]['message']['prices'][0]['expire_price_at'] == expire_price_at
+
+
+def test_parse_response_caches_message_header(mocker):
+    encoder = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                                 datetime_as_timestamp=True)
+    loads = mocker.spy(encoder.e.message_header, 'loads')
+    first, _ = encoder.parse_response(encoder.cancel_all_lightweight_prices())
+    second, _ = encoder.parse_response(bytearray(encoder.cancel_all_lightweight_prices()))
+    other, _ = encoder.parse_response(encoder.ping(1))
+    assert second['message_header'] == first['message_header']
+    assert other['message_header']['type'] == 'ping'
+    assert loads.call_count == 2  # the second header of the same bytes is taken from cache
+    assert len(encoder.e._header_cache) == 2
+
+    first['message_header']['source'] = 'other'
+    assert type(first['message_header']) is dict
+    third, _ = encoder.parse_response(encoder.cancel_all_lightweight_prices())
+    assert third['message_header']['source'] == second['message_header']['source'] != 'other'
+
+
+def test_add_lightweight_prices_filled_from_market_index(encoder):
+    index = MarketIndex()
+    index.set_withdrawal_sequence_number(67890, 3)
+    index.set_selection_reset_count(12345, 2)
+    indexed = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                                 datetime_as_timestamp=True, market_index=index)
+    added = {'selection_id': 12345, 'market_id': 67890, 'polarity': 1, 'odds': '2.0', 'delta_stake': '100',
+             'expire_price_at': datetime(2021, 1, 2, 3, 4, 5).timestamp(), 'punter_reference_number': 1}
+    e = indexed.add_lightweight_prices([added])
+    parsed, _ = indexed.parse_response(indexed.dumps(e))
+    price = parsed['message']['prices'][0]
+    assert price['expected_selection_reset_count'] == 2
+    assert price['expected_withdrawal_sequence_number'] == 3
+    assert 'expected_selection_reset_count' not in added
+    assert e['message']['prices'][0] is added
+
+    # values are taken when envelope is encoded, not when it is built
+    index.set_selection_reset_count(12345, 4)
+    parsed, _ = indexed.parse_response(indexed.dumps(e))
+    assert parsed['message']['prices'][0]['expected_selection_reset_count'] == 4
+
+    bts = encoder.add_lightweight_price(12345, 67890, 1, '2.0', '100', 0, None, None, 1)
+    parsed, _ = encoder.parse_response(bts)
+    assert parsed['message']['prices'][0]['expected_selection_reset_count'] == 0
+
+
+def add_price(selection_id, odds, stake, reference):
+    return {'selection_id': selection_id, 'market_id': 67890, 'polarity': 1, 'odds': odds, 'delta_stake': stake,
+            'expire_price_at': datetime(2021, 1, 2, 3, 4, 5).timestamp() + reference,
+            'expected_selection_reset_count': 0, 'expected_withdrawal_sequence_number': 0,
+            'punter_reference_number': reference}
+
+
+def check_templates(e, odds, stake):
+    for count in (1, 3, 9):
+        for i in range(3):
+            prices = [add_price(100 + j, odds, stake, i * 10 + j) for j in range(count)]
+            envelope = e.add_lightweight_prices(prices, expire_at=1609556645.0 + i)
+            assert e.dumps(envelope) == e.e.dumps(envelope)
+            cancels = [{k: _[k] for k in ('selection_id', 'polarity', 'odds', 'punter_reference_number')}
+                       for _ in prices]
+            envelope = e.cancel_lightweight_prices(cancels)
+            assert e.dumps(envelope) == e.e.dumps(envelope)
+    assert sorted(e._templates) == [('addlightweightprices', 1), ('addlightweightprices', 3),
+                                    ('cancellightweightprices', 1), ('cancellightweightprices', 3)]
+
+
+def test_dumps_with_templates(encoder):
+    check_templates(encoder, '2.5', '10.25')
+    envelope = encoder.add_lightweight_prices([add_price(100, '3', '10', 1)])
+    envelope['message']['prices'][0].pop('market_id')
+    with raises(ValueError):
+        encoder.dumps(envelope)
+
+
+def test_dumps_with_templates_as_integer(integer_encoder):
+    check_templates(integer_encoder, 250, 1025)
+
+
+@fixture()
+def record_encoder():
+    return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                              datetime_as_timestamp=True, as_record=True)
+
+
+def test_parse_response_as_record(record_encoder):
+    prices = [dict(add_price(100 + i, '2.5', '10', i), remaining_stake='10', lwp_action_type=3,
+                   expire_at=1609556645.0, matched_stake='5' if i else None) for i in range(2)]
+    bts = record_encoder.encode_request('lwpchangenotification', {'prices': prices})
+    parsed, _ = record_encoder.parse_response(bts)
+    price = parsed.message.prices[1]
+    assert type(price).__name__ == 'LightWeightPriceChangeNotificationRecord'
+    assert not hasattr(price, '__dict__')
+    assert price.selection_id == price['selection_id'] == 101
+    assert price.matched_stake == '5'
+    assert parsed.message.prices[0].get('matched_stake') is None
+    assert parsed['message_header']['type'] == 'lwpchangenotification'
+    with raises(KeyError):
+        price['unknown']
+
+    other, _ = record_encoder.parse_response(bts)
+    assert other.protocol_header is parsed.protocol_header
+    assert other.envelope_header is parsed.envelope_header
+    assert other == parsed
+
+    # encoder with dicts, created later, does not change record encoder mode
+    encoder = GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True,
+                                 datetime_as_timestamp=True)
+    expected, _ = encoder.parse_response(bts)
+    assert type(expected['message']['prices'][1]) is dict
+    assert parsed.to_dict() == expected
+    assert dict(price) == expected['message']['prices'][1]
+    again, _ = record_encoder.parse_response(bts)
+    assert type(again.message.prices[1]).__name__ == 'LightWeightPriceChangeNotificationRecord'
+    streamed = []
+    again, _ = record_encoder.parse_response(bts, lambda message, item: streamed.append(item))
+    assert [type(_).__name__ for _ in streamed] == ['LightWeightPriceChangeNotificationRecord'] * 2
@@ -0,0 +1,182 @@
+import asyncio
+
+from pytest import fixture, mark
+
+from betdaq.gbei.book import LightweightPriceBook
+from betdaq.gbei.batcher import LightweightPriceBatcher
+from betdaq.gbei.quoting import QuotingEngine
+from betdaq.gbei.supervisor import GBEiSupervisor
+from betdaq.gbei.protocol import GBEiProtocol
+
+
+def price(selection_id, odds, remaining_stake, reference):
+    return {'market_id': 1, 'selection_id': selection_id, 'polarity': 1, 'odds': odds,
+            'punter_reference_number': reference, 'remaining_stake': remaining_stake}
+
+
+@fixture()
+def connect(encoder, mocker):
+    snapshots = []
+    protocols = []
+    failures = []
+    query_failures = []  # raised by the next query, after snapshot is streamed to consumer, if any
+
+    async def inner(existing_protocol=None):
+        if failures:
+            raise failures.pop(0)
+        protocol = GBEiProtocol(encoder)
+        protocol._transport = mocker.Mock()
+        protocol._heartbeat_loop = mocker.Mock()
+        snapshot = snapshots.pop(0)
+
+        async def query_all(timeout=None, consumer=None):
+            if consumer is None:
+                if query_failures:
+                    raise query_failures.pop(0)
+                return snapshot
+            for _ in snapshot:
+                consumer(_)
+            if query_failures:
+                raise query_failures.pop(0)
+            return len(snapshot)
+        protocol.query_all = query_all
+        protocol.send_add_lightweight_prices = mocker.Mock()
+        protocol.send_cancel_lightweight_prices = mocker.Mock()
+        if existing_protocol is not None:
+            protocol.update_callbacks(existing_protocol)
+        protocols.append(protocol)
+        return protocol
+
+    inner.snapshots = snapshots
+    inner.protocols = protocols
+    inner.failures = failures
+    inner.query_failures = query_failures
+    return inner
+
+
+@mark.parametrize('stream_snapshot', [False, True])
+@mark.asyncio
+async def test_reconnect_sends_only_difference(connect, stream_snapshot):
+    book = LightweightPriceBook()
+    batcher = LightweightPriceBatcher(None, window=0)
+    engine = QuotingEngine(book, batcher)
+    supervisor = GBEiSupervisor(book, engine, batcher, connect=connect, min_backoff=0.001,
+                                stream_snapshot=stream_snapshot)
+    connect.snapshots.extend([[], [price(11, '2.0', '10', 1), price(12, '2.0', '5', 2)]])
+    connect.failures.append(OSError('refused'))
+
+    task = asyncio.ensure_future(supervisor.run())
+    await asyncio.sleep(0.01)
+    first, = connect.protocols
+    assert batcher.protocol is first
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    await asyncio.sleep(0)
+    first.send_add_lightweight_prices.assert_called_once()
+
+    first.connection_lost(None)
+    await asyncio.sleep(0.02)
+    assert len(connect.protocols) == 2
+    second = connect.protocols[1]
+    assert batcher.protocol is second
+    await asyncio.sleep(0)
+    # price 11 is still active on GBEi, unknown price 12 is cancelled
+    second.send_add_lightweight_prices.assert_not_called()
+    cancelled, = second.send_cancel_lightweight_prices.call_args.args
+    assert [_['selection_id'] for _ in cancelled] == [12]
+    assert len(book) == 2
+
+    supervisor.stop()
+    await task
+
+
+@mark.asyncio
+async def test_streamed_snapshot_failure_keeps_book(connect):
+    book = LightweightPriceBook()
+    batcher = LightweightPriceBatcher(None, window=0)
+    engine = QuotingEngine(book, batcher)
+    supervisor = GBEiSupervisor(book, engine, batcher, connect=connect, min_backoff=0.001, stream_snapshot=True)
+    connect.snapshots.extend([[price(11, '2.0', '10', 1), price(12, '2.0', '5', 2)], [price(11, '2.0', '10', 1)]])
+
+    task = asyncio.ensure_future(supervisor.run())
+    await asyncio.sleep(0.01)
+    assert len(book) == 2
+    connect.query_failures.append(asyncio.TimeoutError())
+    supervisor.min_backoff = 10  # reconcile is not retried during the test
+    first, = connect.protocols
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    engine.set_quotes(1, 12, [(1, '2.0', '5')], 100)
+    first.connection_lost(None)
+    await asyncio.sleep(0.02)
+    second = connect.protocols[1]
+    # query failed after streaming part of the snapshot, the book is kept and nothing is added twice
+    assert len(book) == 2
+    assert supervisor._staging is None
+    engine.requote_all()
+    await asyncio.sleep(0)
+    second.send_add_lightweight_prices.assert_not_called()
+
+    supervisor.stop()
+    await task
+
+
+@mark.asyncio
+async def test_reset_occurred_resubmits(connect):
+    book = LightweightPriceBook()
+    batcher = LightweightPriceBatcher(None, window=0)
+    engine = QuotingEngine(book, batcher)
+    supervisor = GBEiSupervisor(book, engine, batcher, connect=connect)
+    connect.snapshots.extend([[], []])
+    task = asyncio.ensure_future(supervisor.run())
+    await asyncio.sleep(0)
+    protocol, = connect.protocols
+    engine.set_quotes(1, 11, [(1, '2.0', '10')], 100)
+    await asyncio.sleep(0)
+    protocol.send_add_lightweight_prices.reset_mock()
+
+    protocol.data_received(protocol._encoder.encode_request('resetoccurred', {}))
+    await asyncio.sleep(0.01)
+    added, = protocol.send_add_lightweight_prices.call_args.args
+    assert [_['delta_stake'] for _ in added] == ['10']
+
+    supervisor.stop()
+    protocol.connection_lost(None)
+    await task
+
+
+@mark.asyncio
+async def test_failed_reconcile_retried(connect):
+    book = LightweightPriceBook()
+    batcher = LightweightPriceBatcher(None, window=0)
+    engine = QuotingEngine(book, batcher)
+    supervisor = GBEiSupervisor(book, engine, batcher, connect=connect, min_backoff=0.001)
+    connect.snapshots.append([price(11, '2.0', '10', 1)])
+    connect.query_failures.extend([asyncio.TimeoutError(), asyncio.TimeoutError()])
+    task = asyncio.ensure_future(supervisor.run())
+    await asyncio.sleep(0.02)
+    assert not connect.query_failures
+    assert len(book) == 1
+    protocol, = connect.protocols
+    cancelled, = protocol.send_cancel_lightweight_prices.call_args.args
+    assert [_['selection_id'] for _ in cancelled] == [11]
+
+    supervisor.stop()
+    await task
+
+
+@mark.asyncio
+async def test_stop_cancels_reconcile_after_reset(connect):
+    book = LightweightPriceBook()
+    batcher = LightweightPriceBatcher(None, window=0)
+    engine = QuotingEngine(book, batcher)
+    supervisor = GBEiSupervisor(book, engine, batcher, connect=connect)
+    connect.snapshots.append([])
+    task = asyncio.ensure_future(supervisor.run())
+    await asyncio.sleep(0)
+    protocol, = connect.protocols
+    protocol.data_received(protocol._encoder.encode_request('resetoccurred', {}))
+    reconcile = supervisor._reconcile_task
+    supervisor.stop()
+    await asyncio.sleep(0)
+    assert reconcile.cancelled()
+    protocol.connection_lost(None)
+    await task
@@ -0,0 +1,157 @@
+import asyncio
+
+from pytest import fixture, mark, raises
+
+from betdaq.gbei.expiry import PriceExpiryWatcher
+from betdaq.gbei.protocol import GBEiProtocol, GBEiRequestEncoder, LWPActionType
+from betdaq.gbei.protocol.timer_wheel import TimerWheel
+
+
+class Clock(object):
+    """Wheel clock moved by tests"""
+
+    def __init__(self, now: float = 1000.):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@fixture()
+def encoder():
+    return GBEiRequestEncoder(punter_id=3233, punter_session_key=1, decimal_as_string=True, datetime_as_timestamp=True)
+
+
+@fixture()
+def clock():
+    return Clock()
+
+
+@fixture()
+def wheel(clock):
+    # event loop ticks are far apart, so timers fire only when wheel is advanced by test
+    w = TimerWheel(resolution=1, slots=4, clock=clock)
+    yield w
+    w.clear()
+
+
+def price(selection_id, expire_price_at, odds='2.5'):
+    return {'selection_id': selection_id, 'market_id': 1, 'polarity': 1, 'odds': odds, 'delta_stake': '10',
+            'expire_price_at': expire_price_at, 'expected_selection_reset_count': 0,
+            'expected_withdrawal_sequence_number': 0, 'punter_reference_number': 1}
+
+
+def envelope(message_type, prices):
+    return {'message_header': {'type': message_type}, 'message': {'prices': prices}}
+
+
+def change_notification(encoder, added, action, remaining_stake='0'):
+    """Notification of the added price, encoded as GBEi sends it"""
+    return encoder.encode_request('lwpchangenotification', {'prices': [{
+        'market_id': added['market_id'], 'selection_id': added['selection_id'], 'polarity': added['polarity'],
+        'odds': added['odds'], 'punter_reference_number': added['punter_reference_number'],
+        'expire_at': added['expire_price_at'], 'expected_selection_reset_count': 0,
+        'expected_withdrawal_sequence_number': 0, 'lwp_action_type': action.value,
+        'remaining_stake': remaining_stake, 'matched_stake': None, 'order_id': None,
+        'matched_against_side_stake': None,
+    }]})
+
+
+def advance(clock, wheel, now):
+    clock.now = now
+    wheel.advance()
+
+
+@mark.asyncio
+async def test_timer_wheel(clock, wheel):
+    fired = []
+    wheel.schedule(1008, fired.append, 'late')  # more than single rotation away
+    wheel.schedule(999, fired.append, 'past')
+    wheel.call_later(2, fired.append, 'soon')
+    wheel.call_later(2, fired.append, 'cancelled').cancel()
+    assert len(wheel) == 4
+    advance(clock, wheel, 1001.5)
+    assert fired == ['past']
+    advance(clock, wheel, 1003)
+    assert fired == ['past', 'soon']
+    advance(clock, wheel, 1007.9)
+    assert fired == ['past', 'soon']
+    advance(clock, wheel, 1008)
+    assert fired == ['past', 'soon', 'late']
+    assert len(wheel) == 0
+    assert wheel._handle is None
+
+
+@mark.asyncio
+async def test_price_expiry(encoder, mocker, clock, wheel):
+    on_refresh, on_expired = mocker.Mock(), mocker.Mock()
+    watcher = PriceExpiryWatcher(wheel, encoder, refresh_before=3, on_refresh=on_refresh, on_expired=on_expired)
+    watcher.on_sent(envelope('addlightweightprices', [price(1, 1005), price(2, 1005)]))
+    watcher.on_sent(envelope('cancellightweightprices', [price(2, 0)]))
+    advance(clock, wheel, 1002)
+    on_refresh.assert_called_once_with(price(1, 1005))
+    assert not on_expired.called
+    advance(clock, wheel, 1005)
+    on_expired.assert_called_once_with(price(1, 1005))
+    assert watcher.is_expired(price(1, 0))
+    assert not watcher.is_expired(price(2, 0))
+    watcher.on_message({'message_header': {'type': 'lwpchangenotification'}, 'message': {'prices': [
+        dict(price(1, 0), lwp_action_type=8, remaining_stake='0')]}})
+    assert not watcher.expired
+
+
+@mark.parametrize('action, remaining_stake', [
+    (LWPActionType.Matched, '0'),
+    (LWPActionType.CancelledExplicitly, '0'),
+    (LWPActionType.Expired, '0'),
+])
+@mark.asyncio
+async def test_price_expiry_notifications_round_trip(encoder, mocker, clock, wheel, action, remaining_stake):
+    on_refresh, on_expired = mocker.Mock(), mocker.Mock()
+    protocol = GBEiProtocol(encoder)
+    protocol._transport = mocker.Mock()
+    watcher = PriceExpiryWatcher(wheel, encoder, refresh_before=3, on_refresh=on_refresh, on_expired=on_expired)
+    watcher.attach(protocol)
+    added = price(1, 1005, odds='2.50')
+    protocol.send_add_lightweight_prices([added])
+    assert len(watcher) == 1
+    protocol.data_received(change_notification(encoder, added, action, remaining_stake))
+    assert len(watcher) == 0
+    advance(clock, wheel, 1010)
+    assert not on_refresh.called and not on_expired.called
+    assert not watcher.expired
+
+
+@mark.asyncio
+async def test_price_expiry_tracks_written_prices(encoder, mocker, clock, wheel):
+    protocol = GBEiProtocol(encoder)
+    protocol._transport = mocker.Mock()
+    protocol._heartbeat_loop = mocker.Mock()
+    watcher = PriceExpiryWatcher(wheel, encoder)
+    watcher.attach(protocol)
+    protocol.pause_writing()
+    protocol.send_add_lightweight_prices([price(1, 1005)])
+    assert len(watcher) == 0
+    protocol.resume_writing()
+    assert len(watcher) == 1
+    protocol.pause_writing()
+    protocol.send_add_lightweight_prices([price(2, 1005)])
+    protocol.connection_lost(None)
+    assert len(watcher) == 1
+    watcher.on_dropped([price(1, 1005)])
+    assert len(watcher) == 0
+
+
+@mark.asyncio
+async def test_request_deadline(encoder, mocker, clock, wheel):
+    protocol = GBEiProtocol(encoder, timer_wheel=wheel)
+    protocol._transport = mocker.Mock()
+    task = asyncio.get_running_loop().create_task(protocol.ping(timeout=5))
+    await asyncio.sleep(0)
+    advance(clock, wheel, 1004)
+    await asyncio.sleep(0)
+    assert not task.done()
+    advance(clock, wheel, 1005)
+    with raises(asyncio.TimeoutError):
+        await task
+    assert not protocol._pending
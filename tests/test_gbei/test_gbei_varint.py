@@ -0,0 +1,27 @@
+from pytest import mark
+
+from betdaq.gbei.protocol.fields import String
+from betdaq.gbei.protocol.varint import decode_lsb, decode_msb, encode_lsb, encode_msb, encode_string
+
+
+@mark.parametrize('value', [0, 1, 127, 128, 255, 16383, 16384, 123456, 2 ** 35 + 5])
+def test_round_trip(value):
+    for encode, decode in ((encode_msb, decode_msb), (encode_lsb, decode_lsb)):
+        bts = b'\xff' + encode(value) + b'\x05'
+        assert decode(memoryview(bts), 1) == (value, len(bts) - 1)
+        assert all(_ & 128 for _ in bts[1:-2]) and not bts[-2] & 128
+
+
+def test_byte_order():
+    assert encode_msb(1234) == b'\x89\x52'
+    assert encode_lsb(1234) == b'\xd2\x09'
+    assert encode_msb(5) is encode_lsb(5)
+
+
+def test_string():
+    assert encode_string('GBP') is encode_string('GBP')
+    assert encode_string('ставка') == b'\x0c' + 'ставка'.encode()
+    loaded, remaining = String().loads(memoryview(encode_string('ставка') + b'\x01'))
+    assert loaded == 'ставка'
+    assert bytes(remaining) == b'\x01'
+    assert bytes(String().skip(memoryview(encode_string('GBP') + b'\x02'))) == b'\x02'